@@ -0,0 +1,34 @@
+USE nebula;
+
+-- Content-addressed media: files live under media_files/<aa>/<bb>/<sha256>.<ext>.
+-- media_objects has one row per stored file. media_refs ties each file to
+-- the messages, scheduled messages and avatars that use it, and ref_count
+-- mirrors the number of those refs. Files whose ref_count stays at zero past
+-- the grace period are removed by the background worker.
+CREATE TABLE IF NOT EXISTS media_objects (
+    object_name VARCHAR(80) PRIMARY KEY,
+    sha256 CHAR(64) NOT NULL,
+    size BIGINT UNSIGNED NOT NULL,
+    ref_count INT UNSIGNED NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    released_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_media_orphans (ref_count, released_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS media_refs (
+    owner_type VARCHAR(16) NOT NULL,
+    owner_id VARCHAR(100) NOT NULL,
+    object_name VARCHAR(80) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (owner_type, owner_id, object_name),
+    INDEX idx_media_refs_object (object_name)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Who uploaded each file: an avatar may only point at a file its owner uploaded.
+CREATE TABLE IF NOT EXISTS media_uploads (
+    object_name VARCHAR(80) NOT NULL,
+    username VARCHAR(32) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (object_name, username),
+    FOREIGN KEY (username) REFERENCES users(username) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -1,5 +1,6 @@
 """«Небула» — веб-мессенджер: точка входа и фабрика приложения."""
 
+import inspect
 import logging
 import os
 import threading
@@ -29,14 +30,27 @@ from handlers.socket_handlers import SocketRuntime, register_socket_handlers
 from routes.ai_api import create_ai_api_bp
 from routes.api_tools import create_api_tools_bp
 from routes.auth_api import create_auth_api_bp
-from routes.chat_api import bind_user_connections, chat_api_bp
+from routes.chat_api import bind_presence, chat_api_bp
 from routes.moderation_api import moderation_api_bp
 from routes.system_api import create_system_bp
 from services.scheduled_worker import start_scheduled_worker
+from utils.admission import AdmissionControl
 from utils.auth_token_store import build_auth_token_store
+from utils.backpressure import install_backpressure
+from utils.facade_cache import facade_cache
+from utils.json_provider import FastJSONProvider, SocketJSON
 from utils.media import ensure_media_dir
 from utils.media import save_media_file as save_media_file_to_disk
+from utils.media_upload import ChunkedUploads
+from utils.outbound_batch import bind_outbound_batch, start_outbound_flusher
+from utils.presence_registry import build_presence_registry
+from utils.room_delivery import bind_room_delivery, start_room_reconciler
+from utils.room_events import bind_room_events, build_room_event_log
 from utils.sanitizers import sanitize_text
+from utils.session_tickets import build_session_ticket_store
+from utils.sharded_lock import ShardedLock
+from utils.socket_dispatcher import install_socket_dispatcher
+from utils.socket_serializer import install_socket_serializer
 from utils.validators import is_valid_password, is_valid_username, validate_mime_type
 
 
@@ -57,28 +71,121 @@ def _parse_allowed_origins(raw: object) -> str | list[str]:
     return origins[0] if len(origins) == 1 else origins
 
 
-def _install_socketio_emit_lock(socketio: SocketIO) -> threading.RLock:
-    """Сериализация emit/комнат: воркер отложенных сообщений + Werkzeug (threading).
-
-    Без общего замка возможны гонки Engine.IO / long-polling и ошибка Werkzeug
-    ``write() before start_response``; см. предупреждение о потоках в python-socketio.
+def _emit_lock_keys(srv, name: str, bound: dict) -> list | None:
+    """Ключи шардов для вызова ``srv.<name>``; ``None`` — нужны все шарды."""
+    if name in ("enter_room", "leave_room", "close_room"):
+        return [bound.get("room")]
+    if name == "disconnect":
+        # Отключение выводит sid из всех его комнат (включая комнату самого sid).
+        sid = bound.get("sid")
+        try:
+            rooms = srv.manager.get_rooms(sid, bound.get("namespace") or "/")
+        except Exception:
+            return None
+        return [sid, *rooms]
+    return None
+
+
+def _install_socketio_emit_lock(socketio: SocketIO) -> ShardedLock:
+    """Сериализация изменений комнат по шардам: воркер отложенных сообщений + Werkzeug (threading).
+
+    ``enter_room``/``leave_room``/``close_room``/``disconnect`` над одной комнатой
+    идут по очереди, разные комнаты друг друга не ждут. Сами ``emit`` этот замок
+    не берут: запись в сокет сериализуется по получателю
+    (:func:`_install_socket_write_lock`), а порядок событий комнаты держит
+    ``utils.room_events`` тем же замком по ``room_id``.
     """
-    lock: threading.RLock = threading.RLock()
+    locks = ShardedLock()
     srv = socketio.server
-    for name in ("emit", "send", "enter_room", "leave_room", "close_room", "disconnect"):
+    for name in ("enter_room", "leave_room", "close_room", "disconnect"):
         if not hasattr(srv, name):
             continue
         orig = getattr(srv, name)
 
-        def _wrap(fn):
+        def _wrap(fn, name=name):
+            sig = inspect.signature(fn)
+
             def _locked(*args, **kwargs):
-                with lock:
+                bound = sig.bind_partial(*args, **kwargs).arguments
+                with locks.hold(_emit_lock_keys(srv, name, bound)):
                     return fn(*args, **kwargs)
 
             return _locked
 
         setattr(srv, name, _wrap(orig))
-    return lock
+    return locks
+
+
+def _binary_attachments(data: object) -> int:
+    """Сколько бинарных кадров идёт следом за заголовком ``5N-``/``6N-`` Socket.IO."""
+    if not isinstance(data, str) or data[:1] not in ("5", "6"):
+        return 0
+    count, dash, _ = data[1:].partition("-")
+    return int(count) if dash and count.isdigit() else 0
+
+
+def _install_socket_write_lock(socketio: SocketIO) -> ShardedLock:
+    """Запись пакетов в один сокет Engine.IO — строго по очереди.
+
+    Без этого возможны гонки Engine.IO / long-polling и ошибка Werkzeug
+    ``write() before start_response``; см. предупреждение о потоках в python-socketio.
+    Замок (реентерабельный, по ``eio_sid`` получателя) стоит на трёх уровнях:
+
+    * ``eio.send_packet`` — каждый кадр, в том числе MessagePack-кадры,
+      которые сериализатор пишет мимо сервера Socket.IO;
+    * ``Server._send_packet`` — весь пакет целиком: заголовок и его бинарные
+      вложения уходят подряд, чужой кадр между ними не вклинится;
+    * ``Server._send_eio_packet`` — менеджер рассылает вложения отдельными
+      вызовами, поэтому кадры пакета собираются (в пределах потока) и
+      уходят под одним захватом.
+
+    Рассылка на сотни получателей держит за раз один шард, а не все сразу.
+    Внутри замка ничего больше не захватывается — с замком комнат он не
+    сцепляется.
+    """
+    locks = ShardedLock()
+    srv = socketio.server
+    eio = srv.eio
+    eio_send_packet = eio.send_packet
+    send_packet = srv._send_packet
+    send_eio_packet = srv._send_eio_packet
+    # (eio_sid, число вложений, собранные кадры) незаконченного пакета потока.
+    group = threading.local()
+
+    def _eio_send_packet(eio_sid, pkt):
+        with locks.hold([eio_sid]):
+            eio_send_packet(eio_sid, pkt)
+
+    def _send_packet(eio_sid, pkt):
+        with locks.hold([eio_sid]):
+            send_packet(eio_sid, pkt)
+
+    def _send_eio_packet(eio_sid, eio_pkt):
+        pending = getattr(group, "pending", None)
+        group.pending = None
+        if pending is not None and pending[0] == eio_sid and not isinstance(
+            eio_pkt.data, str
+        ):
+            pending[2].append(eio_pkt)
+            if len(pending[2]) <= pending[1]:
+                group.pending = pending
+                return
+            frames = pending[2]
+        elif attachments := _binary_attachments(eio_pkt.data):
+            # Незаконченный пакет (вложение отброшено выше) просто забывается:
+            # клиент его всё равно не собрал бы.
+            group.pending = (eio_sid, attachments, [eio_pkt])
+            return
+        else:
+            frames = [eio_pkt]
+        with locks.hold([eio_sid]):
+            for frame in frames:
+                send_eio_packet(eio_sid, frame)
+
+    eio.send_packet = _eio_send_packet
+    srv._send_packet = _send_packet
+    srv._send_eio_packet = _send_eio_packet
+    return locks
 
 
 def _should_emit_startup_log(app: Flask) -> bool:
@@ -134,6 +241,7 @@ def create_app(testing=False, strict_db=True):
         __name__,
         static_folder=str(project_root / "static"),
     )
+    app.json = FastJSONProvider(app)
     config_cls = get_config(testing=testing)
     app.config.from_object(config_cls)
     app.config["MAX_CONTENT_LENGTH"] = MAX_MEDIA_FILE_SIZE + 1024 * 1024
@@ -239,18 +347,53 @@ def create_app(testing=False, strict_db=True):
         engineio_logger=False,
         ping_timeout=60,
         ping_interval=25,
+        json=SocketJSON,
+        # Несколько воркеров: эмиты расходятся между процессами через Redis.
+        message_queue=redis_url if redis_url and not testing else None,
     )
     app.extensions["nebula_socketio_emit_lock"] = _install_socketio_emit_lock(socketio)
+    app.extensions["nebula_socket_write_lock"] = _install_socket_write_lock(socketio)
+    handler_workers = int(app.config.get("SOCKET_HANDLER_WORKERS") or 0)
+    if handler_workers and not testing:
+        app.extensions["nebula_socket_dispatcher"] = install_socket_dispatcher(
+            socketio, handler_workers, app.logger
+        )
+    serializers = ["json"]
+    if app.config.get("SOCKET_MSGPACK") and not testing and install_socket_serializer(socketio):
+        serializers.append("msgpack")
+    app.extensions["nebula_socket_serializers"] = serializers
+    if not testing:
+        app.extensions["nebula_backpressure"] = install_backpressure(socketio, app.logger)
     app.extensions["socketio"] = socketio
 
     media_root = str(project_root / MEDIA_DIR)
     ensure_media_dir(media_root)
+    app.extensions["nebula_media_root"] = media_root
+    uploads = ChunkedUploads(
+        media_root, MAX_MEDIA_FILE_SIZE, app.logger, on_stored=db.register_media_object
+    )
+    app.extensions["nebula_uploads"] = uploads
 
     auth_token_store = build_auth_token_store(redis_url, app.logger)
-    user_sessions: dict[str, str] = {}
-    user_connections: dict[str, set[str]] = {}
+    if not testing:
+        facade_cache.configure_redis(redis_url, app.logger)
+    presence = build_presence_registry(redis_url, app.logger)
     message_timestamps: defaultdict[str, list[float]] = defaultdict(list)
-    app.extensions["nebula_user_connections"] = user_connections
+    app.extensions["nebula_presence"] = presence
+    bind_room_delivery(socketio, presence)
+    room_event_log = build_room_event_log(redis_url, app.logger)
+    app.extensions["nebula_room_events"] = room_event_log
+    bind_room_events(socketio, room_event_log, app.extensions["nebula_socketio_emit_lock"])
+    bind_outbound_batch(
+        socketio,
+        int(app.config.get("SOCKET_COALESCE_MS") or 0),
+        app.extensions["nebula_socketio_emit_lock"],
+    )
+    session_tickets = build_session_ticket_store(redis_url, app.logger)
+    admission = AdmissionControl(
+        app.config["SOCKET_CONNECT_RATE"], app.config["SOCKET_BOOTSTRAP_RATE"]
+    )
+    app.extensions["nebula_admission"] = admission
     app.extensions["auth_token_store"] = auth_token_store
     app.extensions["auth_token_lifetime"] = AUTH_TOKEN_LIFETIME
 
@@ -269,7 +412,9 @@ def create_app(testing=False, strict_db=True):
 
     def save_media_file(media_data, media_type):
         _ = media_type
-        return save_media_file_to_disk(media_data, media_root, app.logger)
+        return save_media_file_to_disk(
+            media_data, media_root, app.logger, on_stored=db.register_media_object
+        )
 
     db_ready = db.init_connection_pool()
     if not db_ready:
@@ -279,7 +424,7 @@ def create_app(testing=False, strict_db=True):
 
     app.register_blueprint(create_api_tools_bp(media_root))
     app.register_blueprint(create_ai_api_bp(limiter))
-    bind_user_connections(user_connections)
+    bind_presence(presence)
     app.register_blueprint(chat_api_bp)
     app.register_blueprint(moderation_api_bp)
     app.register_blueprint(
@@ -300,8 +445,7 @@ def create_app(testing=False, strict_db=True):
             media_dir=media_root,
             max_media_file_size=MAX_MEDIA_FILE_SIZE,
             auth_token_store=auth_token_store,
-            user_sessions=user_sessions,
-            user_connections=user_connections,
+            presence=presence,
             message_timestamps=message_timestamps,
         )
     )
@@ -311,12 +455,14 @@ def create_app(testing=False, strict_db=True):
         app=app,
         db=db,
         auth_token_store=auth_token_store,
-        user_sessions=user_sessions,
-        user_connections=user_connections,
+        presence=presence,
+        session_tickets=session_tickets,
+        admission=admission,
         check_rate_limit=check_rate_limit,
         sanitize_text=sanitize_text,
         validate_mime_type=validate_mime_type,
         save_media_file=save_media_file,
+        uploads=uploads,
         auth_token_lifetime=AUTH_TOKEN_LIFETIME,
         max_message_length=MAX_MESSAGE_LENGTH,
         max_media_file_size=MAX_MEDIA_FILE_SIZE,
@@ -326,5 +472,7 @@ def create_app(testing=False, strict_db=True):
 
     if not testing:
         start_scheduled_worker(app, socketio)
+        start_room_reconciler(app)
+        start_outbound_flusher(app)
 
     return app, socketio
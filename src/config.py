@@ -73,6 +73,16 @@ class AppSettings(BaseSettings):
     SECRET_KEY: str = Field(default_factory=lambda: os.urandom(24).hex())
     ALLOWED_ORIGINS: str = "*"
     REDIS_URL: str | None = None
+    # Потоки обработки событий Socket.IO; 0 — обрабатывать в принимающем потоке.
+    # Держите меньше DB_POOL_SIZE: каждому выполняющемуся событию нужно соединение.
+    SOCKET_HANDLER_WORKERS: int = Field(default=8, ge=0)
+    # Приём подключений на процесс (в секунду): все рукопожатия / полные входы без билета.
+    SOCKET_CONNECT_RATE: float = Field(default=50, gt=0)
+    SOCKET_BOOTSTRAP_RATE: float = Field(default=20, gt=0)
+    # Окно склейки набора текста/прочтений/реакций в один ``batch``; 0 — без склейки.
+    SOCKET_COALESCE_MS: int = Field(default=50, ge=0)
+    # Разрешить клиентам MessagePack вместо JSON (нужен пакет ``msgpack``).
+    SOCKET_MSGPACK: bool = True
     ALLOW_TOKEN_IN_QUERY: bool = True
     NEBULA_ENV: str = "development"
 
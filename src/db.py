@@ -4,17 +4,28 @@ DB settings come from Config (BaseConfig); get_config() uses the same env vars f
 """
 
 import logging
+import threading
 from contextlib import contextmanager
+from datetime import UTC, datetime
 
 from mysql.connector import Error, pooling
 
 from config import Config
 from repositories import extra_features as extra_repo
+from repositories import media as media_repo
 from repositories import messages as messages_repo
 from repositories import moderation as moderation_repo
 from repositories import rooms as rooms_repo
 from repositories import users as users_repo
+from utils import pinned_cache, profile_cache, recent_messages
+from utils.facade_cache import (
+    cached,
+    cached_batch,
+    facade_cache,
+    invalidate_tags,
+)
 from utils.room_access import private_chat_access, private_room_peer_username
+from utils.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +45,14 @@ DB_CONFIG = {
 }
 
 connection_pool = None
+# Открытая ``transaction()`` текущего потока: её соединение берут все get_db_cursor.
+_tx = threading.local()
+# Склейка одинаковых одновременных чтений (get_messages, последние сообщения инбокса).
+_read_flight = SingleFlight()
+# Изменения из других воркеров сбрасывают локальные кэши сообщений, закрепов и профилей.
+facade_cache.add_invalidation_listener(recent_messages.on_invalidate)
+facade_cache.add_invalidation_listener(pinned_cache.on_invalidate)
+facade_cache.add_invalidation_listener(profile_cache.on_invalidate)
 
 
 def init_connection_pool():
@@ -78,6 +97,15 @@ def get_db_connection():
 
 @contextmanager
 def get_db_cursor(dictionary=True, buffered=True):
+    tx_connection = getattr(_tx, "connection", None)
+    if tx_connection is not None:
+        # Внутри transaction(): COMMIT/ROLLBACK делает она сама, один раз.
+        cursor = tx_connection.cursor(dictionary=dictionary, buffered=buffered)
+        try:
+            yield cursor, tx_connection
+        finally:
+            cursor.close()
+        return
     with get_db_connection() as connection:
         cursor = connection.cursor(dictionary=dictionary, buffered=buffered)
         try:
@@ -91,6 +119,50 @@ def get_db_cursor(dictionary=True, buffered=True):
             cursor.close()
 
 
+@contextmanager
+def transaction():
+    """Несколько вызовов фасада на одном соединении из пула с одним COMMIT.
+
+    Ошибки отдельных запросов репозитории по-прежнему гасят сами (MySQL
+    откатывает только упавший оператор); исключение из блока откатывает всё.
+    Вложенный вызов просто продолжает внешнюю транзакцию. Правки кэшей,
+    сделанные фасадом внутри блока, откладываются до COMMIT (:func:`after_commit`).
+    """
+    if getattr(_tx, "connection", None) is not None:
+        yield
+        return
+    with get_db_connection() as connection:
+        _tx.connection = connection
+        _tx.after_commit = []
+        try:
+            yield
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            _tx.connection = None
+            pending, _tx.after_commit = _tx.after_commit, []
+    # Сюда доходим только после COMMIT: откат просто выбрасывает отложенное.
+    for fn in pending:
+        try:
+            fn()
+        except Exception:
+            logger.warning("Ошибка обновления кэша после COMMIT", exc_info=True)
+
+
+def after_commit(fn):
+    """Выполнить ``fn`` (правку кэшей, инвалидацию) после COMMIT текущей транзакции.
+
+    Вне ``transaction()`` каждый запрос фасада коммитится сам — ``fn`` сразу.
+    Внутри — кэши не видят изменений, которые ещё могут откатиться.
+    """
+    if getattr(_tx, "connection", None) is None:
+        fn()
+    else:
+        _tx.after_commit.append(fn)
+
+
 # Users
 def create_user(username, password_hash):
     return users_repo.create_user(get_db_cursor, logger, Error, username, password_hash)
@@ -100,8 +172,16 @@ def get_user(username):
     return users_repo.get_user(get_db_cursor, logger, Error, username)
 
 
+def _profile_changed(username):
+    profile_cache.bump_profile_version(username)
+    invalidate_tags(profile_cache.profile_tag(username), local=False)
+
+
 def update_last_seen(username):
-    return users_repo.update_last_seen(get_db_cursor, logger, Error, username)
+    ok = users_repo.update_last_seen(get_db_cursor, logger, Error, username)
+    if ok:
+        after_commit(lambda: _profile_changed(username))
+    return ok
 
 
 def get_last_seen(username):
@@ -115,7 +195,7 @@ def get_user_profile(username):
 def upsert_user_profile(
     username, bio=None, avatar=None, avatar_type="emoji", nickname=None
 ):
-    return users_repo.upsert_user_profile(
+    ok = users_repo.upsert_user_profile(
         get_db_cursor,
         logger,
         Error,
@@ -125,6 +205,18 @@ def upsert_user_profile(
         avatar_type=avatar_type,
         nickname=nickname,
     )
+    if ok:
+        after_commit(lambda: _profile_changed(username))
+    return ok
+
+
+def _load_user_cards(usernames):
+    return users_repo.list_user_cards(get_db_cursor, logger, Error, usernames)
+
+
+def get_user_cards(usernames):
+    """Profile fields and last_seen per username (cached, one query for misses)."""
+    return profile_cache.get_user_cards(usernames, _load_user_cards)
 
 
 def get_all_users(exclude_username=None):
@@ -164,13 +256,39 @@ def get_blocked_users(username):
 
 # Rooms
 def create_room(room_id, name, members):
-    return rooms_repo.create_room(get_db_cursor, logger, Error, room_id, name, members)
+    ok = rooms_repo.create_room(get_db_cursor, logger, Error, room_id, name, members)
+    if ok:
+        after_commit(
+            lambda: invalidate_tags(
+                f"room:{room_id}", *(contacts_tag(member) for member in members)
+            )
+        )
+    return ok
 
 
 def get_user_rooms(username):
     return rooms_repo.get_user_rooms(get_db_cursor, logger, Error, username)
 
 
+def contacts_tag(username):
+    return f"contacts:{username}"
+
+
+# Каждая смена онлайн-статуса рассылается контактам (utils.presence_fanout) —
+# без кэша это скан комнат на каждый вход/выход. Группы сбрасывают кэш своих
+# участников при создании; новый личный чат (он появляется с первым
+# сообщением) контакты увидят не позже чем через TTL.
+@cached(ttl=60, tags=lambda username: [contacts_tag(username)])
+def list_contact_usernames(username):
+    """Users sharing a group or a private chat with ``username`` (profile/presence fan-out)."""
+    peers = rooms_repo.list_room_peer_usernames(get_db_cursor, logger, Error, username)
+    for rid in list_private_room_ids_for_user(username):
+        peer = private_room_peer_username(rid, username)
+        if peer:
+            peers.append(peer)
+    return list(dict.fromkeys(peers))
+
+
 def is_room_member(room_id, username):
     return rooms_repo.is_room_member(get_db_cursor, logger, Error, room_id, username)
 
@@ -214,18 +332,87 @@ def create_message(message_data):
     return messages_repo.create_message(get_db_cursor, logger, Error, message_data)
 
 
+def _load_room_page(room_id, limit, before_id):
+    # С поколением записей: чтение, начатое до записи, не отдаётся тем, кто пришёл после неё.
+    value, _ = _read_flight.do(
+        (
+            "get_messages",
+            room_id,
+            limit,
+            before_id,
+            recent_messages.write_generation(room_id),
+        ),
+        lambda: messages_repo.get_messages(
+            get_db_cursor,
+            logger,
+            Error,
+            room_id,
+            limit=limit,
+            before_id=before_id,
+        ),
+    )
+    return value
+
+
 def get_messages(room_id, limit=50, before_id=None, excluded_usernames=None):
-    return messages_repo.get_messages(
-        get_db_cursor,
-        logger,
-        Error,
-        room_id,
-        limit=limit,
-        before_id=before_id,
-        excluded_usernames=excluded_usernames,
+    """Страница сообщений комнаты без сообщений ``excluded_usernames``.
+
+    Одинаковые одновременные запросы страницы (после нового сообщения её
+    перечитывают все участники) идут в MySQL одним вызовом; чёрный список
+    зрителя применяется уже к общей странице.
+    """
+    excluded = {un for un in (excluded_usernames or ()) if un}
+    page = None
+    if before_id is None:
+        # Первая страница — из кольцевого буфера комнаты, без MySQL.
+        page = recent_messages.first_page(
+            room_id, limit, lambda rid, n: _load_room_page(rid, n, None)
+        )
+    if page is None:
+        page = _load_room_page(room_id, limit, before_id)
+    if page is None:
+        return []
+    visible = [dict(m) for m in page if m.get("username") not in excluded]
+    if len(visible) == len(page) or len(page) < limit:
+        return visible
+    # Фильтр выкинул строки из полной страницы — добираем её запросом с NOT IN.
+    return (
+        messages_repo.get_messages(
+            get_db_cursor,
+            logger,
+            Error,
+            room_id,
+            limit=limit,
+            before_id=before_id,
+            excluded_usernames=excluded,
+        )
+        or []
     )
 
 
+def remember_recent_message(saved_msg):
+    """Дописать только что сохранённое сообщение в буфер последних сообщений.
+
+    ``saved_msg`` — строка ``get_message_by_id``; отправитель уже в ``read_by``
+    (``create_message`` отмечает его прочтение).
+    """
+    reply_msg = None
+    reply_to_id = saved_msg.get("reply_to_id")
+    if reply_to_id:
+        reply_msg = recent_messages.find(reply_to_id) or get_message_by_id(reply_to_id)
+    msg = messages_repo.hydrate_message_row(
+        dict(saved_msg),
+        reactions={},
+        read_by=[saved_msg["username"]],
+        reply_msg=reply_msg,
+    )
+    def apply():
+        recent_messages.append(saved_msg["room_id"], msg)
+        invalidate_tags(recent_messages.room_tag(saved_msg["room_id"]), local=False)
+
+    after_commit(apply)
+
+
 def list_room_messages_for_viewer(room_id, viewer_username, limit=50, before_id=None):
     """Messages in room excluding senders blocked by the viewer."""
     blocked = set(get_blocked_users(viewer_username))
@@ -238,7 +425,22 @@ def list_room_messages_for_viewer(room_id, viewer_username, limit=50, before_id=
 
 
 def cleanup_expired_messages():
-    return messages_repo.cleanup_expired_messages(get_db_cursor, logger, Error)
+    removed = messages_repo.cleanup_expired_messages(get_db_cursor, logger, Error)
+    if removed:
+
+        def apply():
+            pinned_cache.invalidate_pinned_messages(r["message_id"] for r in removed)
+            for row in removed:
+                recent_messages.remove_message(row["message_id"])
+            room_ids = {r["room_id"] for r in removed}
+            invalidate_tags(
+                *(recent_messages.room_tag(room_id) for room_id in room_ids),
+                *(pinned_cache.pinned_tag(room_id) for room_id in room_ids),
+                local=False,
+            )
+
+        after_commit(apply)
+    return removed
 
 
 def search_messages_global(username, query_text, limit=50):
@@ -261,7 +463,8 @@ def _inbox_preview_from_draft_text(text):
     return t if len(t) <= 120 else f"{t[:117]}..."
 
 
-def _inbox_preview_from_row(row):
+def inbox_preview_from_row(row):
+    """Превью сообщения для списка чатов (тот же текст, что в ``get_inbox_summary``)."""
     if not row:
         return ""
     text = (row.get("text") or "").strip()
@@ -292,21 +495,19 @@ def get_inbox_summary(username):
     )
     group_ids = [g["room_id"] for g in groups]
     all_ids = list(dict.fromkeys(group_ids + private_ids))
-    latest = messages_repo.get_latest_message_per_room(
-        get_db_cursor, logger, Error, all_ids
-    )
+    latest = get_latest_message_per_room(all_ids)
 
     items = []
     seen = set()
     draft_rows = extra_repo.list_drafts_for_user(get_db_cursor, logger, Error, username)
     draft_by_room = {d["room_id"]: d.get("draft_text", "") for d in draft_rows}
-    room_meta_by_id = extra_repo.list_room_rows(get_db_cursor, logger, Error, group_ids)
+    room_meta_by_id = list_room_rows(group_ids)
 
     for g in groups:
         rid = g["room_id"]
         seen.add(rid)
         lm = latest.get(rid)
-        last_at = lm["created_at"].isoformat() if lm and lm.get("created_at") else None
+        last_at = lm.get("created_at") if lm else None
         row_meta = room_meta_by_id.get(rid)
         display_name = (row_meta.get("name") if row_meta else None) or g.get("name") or rid
         draft_plain = (draft_by_room.get(rid) or "").strip()
@@ -314,7 +515,7 @@ def get_inbox_summary(username):
         last_preview = (
             _inbox_preview_from_draft_text(draft_plain)
             if has_draft
-            else _inbox_preview_from_row(lm)
+            else inbox_preview_from_row(lm)
         )
         items.append(
             {
@@ -323,6 +524,7 @@ def get_inbox_summary(username):
                 "title": display_name,
                 "last_preview": last_preview,
                 "last_at": last_at,
+                "last_message_id": lm.get("message_id") if lm else None,
                 "has_draft": has_draft,
             }
         )
@@ -333,13 +535,13 @@ def get_inbox_summary(username):
         seen.add(rid)
         lm = latest.get(rid)
         peer = private_room_peer_username(rid, username)
-        last_at = lm["created_at"].isoformat() if lm and lm.get("created_at") else None
+        last_at = lm.get("created_at") if lm else None
         draft_plain = (draft_by_room.get(rid) or "").strip()
         has_draft = bool(draft_plain)
         last_preview = (
             _inbox_preview_from_draft_text(draft_plain)
             if has_draft
-            else _inbox_preview_from_row(lm)
+            else inbox_preview_from_row(lm)
         )
         items.append(
             {
@@ -348,14 +550,37 @@ def get_inbox_summary(username):
                 "title": peer or rid,
                 "last_preview": last_preview,
                 "last_at": last_at,
+                "last_message_id": lm.get("message_id") if lm else None,
                 "has_draft": has_draft,
             }
         )
 
-    items.sort(key=lambda x: x["last_at"] or "", reverse=True)
+    items.sort(key=lambda x: x["last_at"] or datetime.min, reverse=True)
     return items
 
 
+def get_latest_message_per_room(room_ids):
+    """Последнее сообщение по комнатам; комнаты, которые уже читает другой
+    запрос (инбоксы участников одной группы), не запрашиваются повторно."""
+    keys = [("latest_message", rid) for rid in dict.fromkeys(room_ids) if rid]
+    if not keys:
+        return {}
+    rows = _read_flight.do_many(
+        keys,
+        lambda own: {
+            ("latest_message", rid): row
+            for rid, row in messages_repo.get_latest_message_per_room(
+                get_db_cursor, logger, Error, [k[1] for k in own]
+            ).items()
+        },
+    )
+    return {key[1]: row for key, row in rows.items() if row}
+
+
+def read_flight_stats():
+    return _read_flight.stats()
+
+
 def list_private_room_ids_for_user(username):
     """РљРѕРјРЅР°С‚С‹ private_* РёР· РёСЃС‚РѕСЂРёРё СЃРѕРѕР±С‰РµРЅРёР№, РіРґРµ СѓС‡Р°СЃС‚РІСѓРµС‚ РїРѕР»СЊР·РѕРІР°С‚РµР»СЊ."""
     return messages_repo.list_private_room_ids_for_user(
@@ -368,19 +593,46 @@ def get_message_by_id(message_id):
 
 
 def update_message(message_id, new_text):
-    return messages_repo.update_message(
+    ok = messages_repo.update_message(
         get_db_cursor, logger, Error, message_id, new_text
     )
+    if ok:
+        edited_at = datetime.now(UTC)
+
+        def apply():
+            pinned_cache.invalidate_pinned_messages([message_id])
+            recent_messages.edit_message(message_id, new_text, edited_at)
+            invalidate_tags(recent_messages.message_tag(message_id), local=False)
+
+        after_commit(apply)
+    return ok
 
 
 def delete_message(message_id):
-    return messages_repo.delete_message(get_db_cursor, logger, Error, message_id)
+    ok = messages_repo.delete_message(get_db_cursor, logger, Error, message_id)
+    if ok:
+
+        def apply():
+            pinned_cache.invalidate_pinned_messages([message_id])
+            recent_messages.remove_message(message_id)
+            invalidate_tags(recent_messages.message_tag(message_id), local=False)
+
+        after_commit(apply)
+    return ok
 
 
 def toggle_reaction(message_id, username, emoji):
-    return messages_repo.toggle_reaction(
+    ok = messages_repo.toggle_reaction(
         get_db_cursor, logger, Error, message_id, username, emoji
     )
+    if ok:
+
+        def apply():
+            recent_messages.toggle_reaction(message_id, username, emoji)
+            invalidate_tags(recent_messages.message_tag(message_id), local=False)
+
+        after_commit(apply)
+    return ok
 
 
 def get_message_reactions(message_id):
@@ -388,13 +640,21 @@ def get_message_reactions(message_id):
 
 
 def add_message_read(message_id, username):
-    return messages_repo.add_message_read(
+    ok = messages_repo.add_message_read(
         get_db_cursor, logger, Error, message_id, username
     )
+    if ok:
+
+        def apply():
+            recent_messages.add_reader(message_id, username)
+            invalidate_tags(recent_messages.message_tag(message_id), local=False)
+
+        after_commit(apply)
+    return ok
 
 
 def add_message_reads_for_room(message_ids, username, room_id, limit=80):
-    return messages_repo.add_message_reads_for_room(
+    reads_by_message = messages_repo.add_message_reads_for_room(
         get_db_cursor,
         logger,
         Error,
@@ -403,6 +663,15 @@ def add_message_reads_for_room(message_ids, username, room_id, limit=80):
         room_id,
         limit=limit,
     )
+    if reads_by_message:
+
+        def apply():
+            for mid, read_by in reads_by_message.items():
+                recent_messages.set_readers(mid, read_by)
+            invalidate_tags(recent_messages.room_tag(room_id), local=False)
+
+        after_commit(apply)
+    return reads_by_message
 
 
 def get_message_reads(message_id):
@@ -410,21 +679,37 @@ def get_message_reads(message_id):
 
 
 def pin_message(room_id, message_id, username):
-    return messages_repo.pin_message(
+    ok = messages_repo.pin_message(
         get_db_cursor, logger, Error, room_id, message_id, username
     )
+    if ok:
+        after_commit(lambda: _pinned_changed(room_id))
+    return ok
 
 
 def unpin_message(room_id, message_id):
-    return messages_repo.unpin_message(
+    ok = messages_repo.unpin_message(
         get_db_cursor, logger, Error, room_id, message_id
     )
+    if ok:
+        after_commit(lambda: _pinned_changed(room_id))
+    return ok
 
 
-def get_pinned_messages(room_id):
+def _pinned_changed(room_id):
+    pinned_cache.invalidate_pinned(room_id)
+    invalidate_tags(pinned_cache.pinned_tag(room_id), local=False)
+
+
+def _load_pinned_messages(room_id):
     return messages_repo.get_pinned_messages(get_db_cursor, logger, Error, room_id)
 
 
+def get_pinned_messages(room_id):
+    """Закрепы комнаты из кэша; в MySQL только после pin/unpin/правки/удаления."""
+    return pinned_cache.get_pinned(room_id, _load_pinned_messages) or []
+
+
 def is_message_pinned(room_id, message_id):
     return messages_repo.is_message_pinned(
         get_db_cursor, logger, Error, room_id, message_id
@@ -432,6 +717,8 @@ def is_message_pinned(room_id, message_id):
 
 
 # Moderation
+# Роль не кэшируется: от неё зависят права модерации, а смену роли или бана
+# нечем было бы сбросить из кэша.
 def get_user_role(username):
     return moderation_repo.get_user_role(get_db_cursor, logger, Error, username)
 
@@ -534,8 +821,9 @@ def get_report_by_id(report_id):
     )
 
 
+@cached(ttl=300, stale_ttl=60, tags=lambda room_id: [f"room:{room_id}"])
 def get_room_title(room_id):
-    row = extra_repo.get_room_row(get_db_cursor, logger, Error, room_id)
+    row = get_room_row(room_id)
     return (row or {}).get("name") or room_id
 
 
@@ -626,9 +914,36 @@ def delete_pending_scheduled(sched_id, username):
     )
 
 
+@cached(ttl=300, stale_ttl=60, tags=lambda room_id: [f"room:{room_id}"])
 def get_room_row(room_id):
     return extra_repo.get_room_row(get_db_cursor, logger, Error, room_id)
 
 
+@cached_batch(ttl=300, tags=lambda room_id: [f"room:{room_id}"])
 def list_room_rows(room_ids):
     return extra_repo.list_room_rows(get_db_cursor, logger, Error, room_ids)
+
+
+# Media (content-addressed files and their references)
+def register_media_object(path, size, uploaded_by=None):
+    return media_repo.register_media_object(
+        get_db_cursor, logger, Error, path, size, uploaded_by
+    )
+
+
+def media_uploaded_by(path, username):
+    return media_repo.media_uploaded_by(get_db_cursor, logger, Error, path, username)
+
+
+def release_dangling_media_refs(limit=500):
+    return media_repo.release_dangling_media_refs(get_db_cursor, logger, Error, limit)
+
+
+def list_orphan_media(grace_sec, limit=200):
+    return media_repo.list_orphan_media(get_db_cursor, logger, Error, grace_sec, limit)
+
+
+def delete_orphan_media_object(object_name):
+    return media_repo.delete_orphan_media_object(
+        get_db_cursor, logger, Error, object_name
+    )
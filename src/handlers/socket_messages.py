@@ -1,4 +1,5 @@
 import uuid
+from collections.abc import Callable
 from typing import Any
 
 from flask_socketio import emit
@@ -8,10 +9,13 @@ from handlers.socket_runtime import (
     SocketRuntime,
     assert_socket_identity,
     payload_str,
+    socket_sid,
 )
 from utils.message_payload import serialize_saved_message
+from utils.outbound_batch import emit_coalesced
 from utils.room_access import private_two_party_counterparty
-from utils.room_delivery import ensure_online_members_in_room
+from utils.room_delivery import emit_inbox_update
+from utils.room_events import publish_room_event
 
 ALLOWED_MEDIA_TYPES = {
     "image",
@@ -24,18 +28,46 @@ ALLOWED_MEDIA_TYPES = {
 }
 
 
+Deferred = list[Callable[[], Any]]
+# (логин, комната, данные, отложенные рассылки) -> текст ошибки или None.
+Operation = Callable[[str, str, dict[str, Any], Deferred], str | None]
+BATCH_MAX_OPS = 100
+
+
+def _merge_read_batches(old: dict[str, Any], new: dict[str, Any]) -> dict[str, Any]:
+    """Две неотправленные пачки прочтений одного пользователя — одна, свежие read_by."""
+    reads = {item["message_id"]: item for item in old.get("reads", [])}
+    reads.update((item["message_id"], item) for item in new.get("reads", []))
+    return {**new, "reads": list(reads.values())}
+
+
 def register_message_handlers(rt: SocketRuntime) -> None:
     socketio = rt.socketio
     app = rt.app
     db = rt.db
-    user_sessions = rt.user_sessions
+    presence = rt.presence
     check_rate_limit = rt.check_rate_limit
     sanitize_text = rt.sanitize_text
     validate_mime_type = rt.validate_mime_type
     save_media_file = rt.save_media_file
+    uploads = rt.uploads
     max_message_length = rt.max_message_length
     max_media_file_size = rt.max_media_file_size
 
+    def send_ack(event: dict[str, Any], sent_text: str) -> dict[str, Any]:
+        """Подтверждение отправителю: id, время и то, что сервер поменял в сообщении."""
+        ack = {
+            key: event[key]
+            for key in ("id", "room", "timestamp", "client_id", "expires_at", "seq", "epoch")
+            if key in event
+        }
+        media = event.get("media")
+        if media:
+            ack["media_data"] = media.get("data")
+        if event.get("text") != sent_text:
+            ack["text"] = event.get("text")
+        return ack
+
     @socketio.on("send_message")
     def handle_message(data: SendMessagePayload):
         try:
@@ -47,7 +79,7 @@ def register_message_handlers(rt: SocketRuntime) -> None:
                 emit("error", {"message": "Missing required fields"})
                 return
 
-            if not assert_socket_identity(user_sessions, username):
+            if not assert_socket_identity(presence, username):
                 return
 
             if db.is_user_banned(username):
@@ -80,6 +112,20 @@ def register_message_handlers(rt: SocketRuntime) -> None:
                 return
 
             media = data.get("media")
+            upload_id = media.get("upload_id") if media else None
+            if media and upload_id:
+                # Файл уже принят кусками (``upload_*``) — сообщение ссылается на него.
+                # Забирается только после сохранения сообщения: отказ на любой
+                # проверке (или ошибка БД) оставляет загрузку для повтора.
+                upload = uploads.peek(username, upload_id)
+                if upload is None:
+                    emit("error", {"message": "Upload not found"})
+                    return
+                media = {
+                    "type": upload["type"],
+                    "data": upload["path"],
+                    "name": media.get("name") or upload["name"],
+                }
             if media and media.get("data"):
                 if len(media["data"]) > max_media_file_size * 1.37:
                     emit("error", {"message": "Media file too large"})
@@ -134,9 +180,12 @@ def register_message_handlers(rt: SocketRuntime) -> None:
             if not db.create_message(message_data):
                 emit("error", {"message": "Could not save message"})
                 return
+            if upload_id:
+                uploads.claim(username, upload_id)
 
             saved_msg = db.get_message_by_id(message_id)
             if saved_msg:
+                db.remember_recent_message(saved_msg)
                 message_to_send = serialize_saved_message(
                     saved_msg,
                     read_by_username=username,
@@ -145,257 +194,335 @@ def register_message_handlers(rt: SocketRuntime) -> None:
                     forwarded=message_data.get("forwarded"),
                 )
 
-                ensure_online_members_in_room(socketio, app, room)
-                emit("receive_message", message_to_send, room=room)
+                # Клиент, попросивший подтверждение, уже показывает своё сообщение:
+                # ему — короткий ack, полная копия — остальным соединениям комнаты
+                # (включая другие устройства отправителя).
+                wants_ack = bool(data.get("ack"))
+                event = publish_room_event(
+                    room,
+                    "receive_message",
+                    message_to_send,
+                    skip_sid=socket_sid() if wants_ack else None,
+                )
+                emit_inbox_update(
+                    socketio,
+                    room,
+                    {
+                        "message_id": message_id,
+                        "username": username,
+                        "created_at": message_to_send.get("timestamp"),
+                        "preview": db.inbox_preview_from_row(saved_msg),
+                        "unread": 1,
+                    },
+                )
                 app.logger.info(f"Сообщение отправлено: {username}, комната {room}")
+                if wants_ack:
+                    return send_ack(event, data.get("message", ""))
         except Exception as error:
             app.logger.error(f"Ошибка обработки сообщения: {error}", exc_info=True)
             emit("error", {"message": "Failed to send message"})
 
-    @socketio.on("add_reaction")
-    def handle_add_reaction(data: dict[str, Any]):
-        try:
-            room = payload_str(data, "room")
-            message_id = payload_str(data, "message_id")
-            emoji = payload_str(data, "emoji")
-            username = payload_str(data, "username")
-
-            if room is None or message_id is None or emoji is None or username is None:
-                emit("error", {"message": "Missing required fields"})
-                return
-
-            if not assert_socket_identity(user_sessions, username):
-                return
-
-            message = db.get_message_by_id(message_id)
-            if not message or message.get("room_id") != room:
-                emit("error", {"message": "Message not found in this room"})
-                return
-            if not db.user_can_access_room(username, room):
-                emit("error", {"message": "No access to this chat"})
-                return
+    # ------------------------------------------------------------------
+    # Операции над существующими сообщениями. Каждая получает уже
+    # проверенные логин и комнату, возвращает текст ошибки (или None) и
+    # откладывает рассылки в ``out``: одиночный обработчик выполняет их сразу,
+    # пакетный ``batch`` — после COMMIT всей пачки.
+    # ------------------------------------------------------------------
 
-            if db.toggle_reaction(message_id, username, emoji):
-                reactions = db.get_message_reactions(message_id)
-                emit(
+    def op_add_reaction(username: str, room: str, data: dict[str, Any], out: Deferred):
+        message_id = payload_str(data, "message_id")
+        emoji = payload_str(data, "emoji")
+        if message_id is None or emoji is None:
+            return "Missing required fields"
+        message = db.get_message_by_id(message_id)
+        if not message or message.get("room_id") != room:
+            return "Message not found in this room"
+        if db.toggle_reaction(message_id, username, emoji):
+            reactions = db.get_message_reactions(message_id)
+            out.append(
+                lambda: publish_room_event(
+                    room,
                     "reaction_updated",
                     {"message_id": message_id, "reactions": reactions},
-                    room=room,
+                    coalesce_key=f"reactions:{message_id}",
                 )
-                app.logger.debug(
-                    f"Реакция {emoji} переключена: {username}, сообщение {message_id}"
-                )
-        except Exception as error:
-            app.logger.error(f"Ошибка обработки реакции: {error}", exc_info=True)
-            emit("error", {"message": "Failed to add reaction"})
+            )
+            app.logger.debug(
+                f"Реакция {emoji} переключена: {username}, сообщение {message_id}"
+            )
+        return None
 
-    @socketio.on("mark_as_read")
-    def handle_mark_as_read(data: dict[str, Any]):
-        room = payload_str(data, "room")
+    def op_mark_as_read(username: str, room: str, data: dict[str, Any], out: Deferred):
         message_id = payload_str(data, "message_id")
-        username = payload_str(data, "username")
-        if room is None or message_id is None or username is None:
-            return
-        if not assert_socket_identity(user_sessions, username):
-            return
-
+        if message_id is None:
+            return "Missing required fields"
         message = db.get_message_by_id(message_id)
         if not message or message.get("room_id") != room:
-            return
-        if not db.user_can_access_room(username, room):
-            return
-
+            return "Message not found in this room"
         if db.add_message_read(message_id, username):
             read_by = db.get_message_reads(message_id)
-            emit(
-                "message_read",
-                {"message_id": message_id, "username": username, "read_by": read_by},
-                room=room,
+            out.append(
+                lambda: publish_room_event(
+                    room,
+                    "message_read",
+                    {"message_id": message_id, "username": username, "read_by": read_by},
+                    coalesce_key=f"read:{message_id}",
+                )
             )
+        return None
 
-    @socketio.on("mark_read_batch")
-    def handle_mark_read_batch(data: dict[str, Any]):
-        room = payload_str(data, "room")
-        username = payload_str(data, "username")
+    def op_mark_read_batch(username: str, room: str, data: dict[str, Any], out: Deferred):
         raw_ids = data.get("message_ids")
-        if room is None or username is None or not isinstance(raw_ids, list):
-            return
-        if not assert_socket_identity(user_sessions, username):
-            return
-        if not db.user_can_access_room(username, room):
-            return
-
+        if not isinstance(raw_ids, list):
+            return "Missing required fields"
         message_ids = [str(mid) for mid in raw_ids if mid is not None and str(mid)]
         reads_by_message = db.add_message_reads_for_room(message_ids, username, room)
-        if not reads_by_message:
-            return
-
-        emit(
-            "message_read_batch",
-            {
-                "room": room,
-                "username": username,
-                "reads": [
-                    {"message_id": mid, "read_by": read_by}
-                    for mid, read_by in reads_by_message.items()
-                ],
-            },
-            room=room,
-        )
+        if reads_by_message:
+            out.append(
+                lambda: publish_room_event(
+                    room,
+                    "message_read_batch",
+                    {
+                        "room": room,
+                        "username": username,
+                        "reads": [
+                            {"message_id": mid, "read_by": read_by}
+                            for mid, read_by in reads_by_message.items()
+                        ],
+                    },
+                    coalesce_key=f"reads:{username}",
+                    merge=_merge_read_batches,
+                )
+            )
+        return None
 
-    @socketio.on("edit_message")
-    def handle_edit_message(data: dict[str, Any]):
-        try:
-            room = payload_str(data, "room")
-            message_id = payload_str(data, "message_id")
-            raw_text = data.get("new_text", "")
-            new_text = raw_text.strip() if isinstance(raw_text, str) else ""
-            username = payload_str(data, "username")
+    def op_edit_message(username: str, room: str, data: dict[str, Any], out: Deferred):
+        message_id = payload_str(data, "message_id")
+        raw_text = data.get("new_text", "")
+        new_text = raw_text.strip() if isinstance(raw_text, str) else ""
+        if message_id is None:
+            return "Missing required fields"
+        if not new_text or len(new_text) > max_message_length:
+            return "Invalid text length"
+        message = db.get_message_by_id(message_id)
+        if not message or message["username"] != username:
+            return "You cannot edit someone else's messages"
+        if message.get("room_id") != room:
+            return "Room does not match message"
+        if db.update_message(message_id, new_text):
+
+            def send() -> None:
+                publish_room_event(
+                    room,
+                    "message_edited",
+                    {"message_id": message_id, "new_text": new_text},
+                )
+                emit_inbox_update(
+                    socketio,
+                    room,
+                    {
+                        "message_id": message_id,
+                        "edited": True,
+                        "preview": db.inbox_preview_from_row({**message, "text": new_text}),
+                    },
+                )
 
-            if room is None or message_id is None or username is None:
-                emit("error", {"message": "Missing required fields"})
-                return
+            out.append(send)
+            app.logger.info(f"Сообщение {message_id} изменено пользователем {username}")
+        return None
 
-            if not assert_socket_identity(user_sessions, username):
-                return
+    def op_delete_message(username: str, room: str, data: dict[str, Any], out: Deferred):
+        message_id = payload_str(data, "message_id")
+        if message_id is None:
+            return "Missing required fields"
+        message = db.get_message_by_id(message_id)
+        if not message or message["username"] != username:
+            return "You cannot delete someone else's messages"
+        if message.get("room_id") != room:
+            return "Room does not match message"
+        if db.delete_message(message_id):
+
+            def send() -> None:
+                publish_room_event(
+                    room, "message_deleted", {"message_id": message_id, "room": room}
+                )
+                emit_inbox_update(socketio, room, {"message_id": message_id, "deleted": True})
 
-            if not new_text or len(new_text) > max_message_length:
-                emit("error", {"message": "Invalid text length"})
-                return
+            out.append(send)
+            app.logger.info(f"Сообщение {message_id} удалено пользователем {username}")
+        return None
 
-            message = db.get_message_by_id(message_id)
-            if not message or message["username"] != username:
-                emit("error", {"message": "You cannot edit someone else's messages"})
-                return
-            if message.get("room_id") != room:
-                emit("error", {"message": "Room does not match message"})
-                return
-            if not db.user_can_access_room(username, room):
-                emit("error", {"message": "No access to this chat"})
-                return
+    def op_pin_message(username: str, room: str, data: dict[str, Any], out: Deferred):
+        message_id = payload_str(data, "message_id")
+        if message_id is None:
+            return "Missing required fields"
+        msg = db.get_message_by_id(message_id)
+        if not msg or msg.get("room_id") != room:
+            return "Message does not belong to this room"
+        if db.pin_message(room, message_id, username):
+            out.append(
+                lambda: publish_room_event(
+                    room,
+                    "message_pinned",
+                    {"room_id": room, "message_id": message_id, "pinned_by": username},
+                )
+            )
+            app.logger.info(f"Сообщение {message_id} закреплено пользователем {username}")
+        return None
 
-            if db.update_message(message_id, new_text):
-                emit(
-                    "message_edited",
-                    {"message_id": message_id, "new_text": new_text},
-                    room=room,
+    def op_unpin_message(username: str, room: str, data: dict[str, Any], out: Deferred):
+        message_id = payload_str(data, "message_id")
+        if message_id is None:
+            return "Missing required fields"
+        msg = db.get_message_by_id(message_id)
+        if not msg or msg.get("room_id") != room:
+            return "Message does not belong to this room"
+        if db.unpin_message(room, message_id):
+            out.append(
+                lambda: publish_room_event(
+                    room,
+                    "message_unpinned",
+                    {"room_id": room, "message_id": message_id},
                 )
-                app.logger.info(
-                    f"Сообщение {message_id} изменено пользователем {username}"
+            )
+            app.logger.info(f"Сообщение {message_id} откреплено")
+        return None
+
+    def op_typing(event: str) -> Operation:
+        def run(username: str, room: str, data: dict[str, Any], out: Deferred):
+            _ = data
+            out.append(
+                lambda: emit_coalesced(
+                    room, event, {"username": username, "room": room}, f"typing:{username}"
                 )
-        except Exception as error:
-            app.logger.error(f"Ошибка редактирования сообщения: {error}", exc_info=True)
-            emit("error", {"message": "Failed to edit message"})
-
-    @socketio.on("delete_message")
-    def handle_delete_message(data: dict[str, Any]):
+            )
+            return None
+
+        return run
+
+    operations: dict[str, Operation] = {
+        "add_reaction": op_add_reaction,
+        "mark_as_read": op_mark_as_read,
+        "mark_read_batch": op_mark_read_batch,
+        "edit_message": op_edit_message,
+        "delete_message": op_delete_message,
+        "pin_message": op_pin_message,
+        "unpin_message": op_unpin_message,
+        "typing": op_typing("user_typing"),
+        "stop_typing": op_typing("user_stop_typing"),
+    }
+
+    def run_single(
+        data: dict[str, Any],
+        op: Operation,
+        *,
+        room_key: str = "room",
+        failure: str | None = None,
+    ) -> None:
+        """Одиночное событие: проверки, операция и рассылка сразу.
+
+        ``failure=None`` — тихое событие (прочтения): об ошибках клиенту не сообщаем.
+        """
         try:
-            room = payload_str(data, "room")
-            message_id = payload_str(data, "message_id")
+            room = payload_str(data, room_key)
             username = payload_str(data, "username")
-
-            if room is None or message_id is None or username is None:
-                emit("error", {"message": "Missing required fields"})
-                return
-
-            if not assert_socket_identity(user_sessions, username):
+            if room is None or username is None:
+                if failure:
+                    emit("error", {"message": "Missing required fields"})
                 return
-
-            message = db.get_message_by_id(message_id)
-            if not message or message["username"] != username:
-                emit("error", {"message": "You cannot delete someone else's messages"})
-                return
-            if message.get("room_id") != room:
-                emit("error", {"message": "Room does not match message"})
+            if not assert_socket_identity(presence, username):
                 return
             if not db.user_can_access_room(username, room):
-                emit("error", {"message": "No access to this chat"})
+                if failure:
+                    emit("error", {"message": "No access to this chat"})
                 return
-
-            if db.delete_message(message_id):
-                ensure_online_members_in_room(socketio, app, room)
-                emit(
-                    "message_deleted",
-                    {"message_id": message_id, "room": room},
-                    room=room,
-                )
-                app.logger.info(
-                    f"Сообщение {message_id} удалено пользователем {username}"
-                )
+            out: Deferred = []
+            error = op(username, room, data, out)
+            if error and failure:
+                emit("error", {"message": error})
+            for send in out:
+                send()
         except Exception as error:
-            app.logger.error(f"Ошибка удаления сообщения: {error}", exc_info=True)
-            emit("error", {"message": "Failed to delete message"})
+            if not failure:
+                raise
+            app.logger.error(f"{failure}: {error}", exc_info=True)
+            emit("error", {"message": failure})
 
-    @socketio.on("pin_message")
-    def handle_pin_message(data: dict[str, Any]):
-        try:
-            room_id = payload_str(data, "room_id")
-            message_id = payload_str(data, "message_id")
-            username = payload_str(data, "username")
+    @socketio.on("add_reaction")
+    def handle_add_reaction(data: dict[str, Any]):
+        run_single(data, op_add_reaction, failure="Failed to add reaction")
 
-            if room_id is None or message_id is None or username is None:
-                emit("error", {"message": "Missing required fields"})
-                return
+    @socketio.on("mark_as_read")
+    def handle_mark_as_read(data: dict[str, Any]):
+        run_single(data, op_mark_as_read)
 
-            if not assert_socket_identity(user_sessions, username):
-                return
+    @socketio.on("mark_read_batch")
+    def handle_mark_read_batch(data: dict[str, Any]):
+        run_single(data, op_mark_read_batch)
 
-            if not db.user_can_access_room(username, room_id):
-                emit("error", {"message": "No access to this chat"})
-                return
+    @socketio.on("edit_message")
+    def handle_edit_message(data: dict[str, Any]):
+        run_single(data, op_edit_message, failure="Failed to edit message")
 
-            msg = db.get_message_by_id(message_id)
-            if not msg or msg.get("room_id") != room_id:
-                emit("error", {"message": "Message does not belong to this room"})
-                return
+    @socketio.on("delete_message")
+    def handle_delete_message(data: dict[str, Any]):
+        run_single(data, op_delete_message, failure="Failed to delete message")
 
-            if db.pin_message(room_id, message_id, username):
-                emit(
-                    "message_pinned",
-                    {
-                        "room_id": room_id,
-                        "message_id": message_id,
-                        "pinned_by": username,
-                    },
-                    room=room_id,
-                )
-                app.logger.info(
-                    f"Сообщение {message_id} закреплено пользователем {username}"
-                )
-        except Exception as error:
-            app.logger.error(f"Ошибка закрепления сообщения: {error}", exc_info=True)
-            emit("error", {"message": "Failed to pin message"})
+    @socketio.on("pin_message")
+    def handle_pin_message(data: dict[str, Any]):
+        run_single(data, op_pin_message, room_key="room_id", failure="Failed to pin message")
 
     @socketio.on("unpin_message")
     def handle_unpin_message(data: dict[str, Any]):
-        try:
-            room_id = payload_str(data, "room_id")
-            message_id = payload_str(data, "message_id")
-            username = payload_str(data, "username")
-
-            if room_id is None or message_id is None or username is None:
-                emit("error", {"message": "Missing required fields"})
-                return
-
-            if not assert_socket_identity(user_sessions, username):
-                return
+        run_single(
+            data, op_unpin_message, room_key="room_id", failure="Failed to unpin message"
+        )
 
-            if not db.user_can_access_room(username, room_id):
-                emit("error", {"message": "No access to this chat"})
-                return
+    @socketio.on("batch")
+    def handle_batch(data: dict[str, Any]):
+        """Пачка операций ``{"username", "ops": [{"op": ..., "room": ...}, ...]}``.
 
-            msg = db.get_message_by_id(message_id)
-            if not msg or msg.get("room_id") != room_id:
-                emit("error", {"message": "Message does not belong to this room"})
-                return
-
-            if db.unpin_message(room_id, message_id):
-                emit(
-                    "message_unpinned",
-                    {"room_id": room_id, "message_id": message_id},
-                    room=room_id,
-                )
-                app.logger.info(f"Сообщение {message_id} откреплено")
-        except Exception as error:
-            app.logger.error(f"Ошибка открепления сообщения: {error}", exc_info=True)
-            emit("error", {"message": "Failed to unpin message"})
+        Личность проверяется один раз, доступ — один раз на комнату, записи идут
+        одной транзакцией; правки кэшей (``db.after_commit``) и рассылки — после
+        COMMIT, при откате кэши не трогаются. Ответ (ack) — результаты по
+        порядку: ``{"results": [{"op", "ok", "error"?}, ...]}``.
+        """
+        username = payload_str(data, "username")
+        ops = data.get("ops")
+        if username is None or not isinstance(ops, list):
+            return {"error": "Missing required fields"}
+        if not assert_socket_identity(presence, username):
+            return {"error": "Authentication error"}
+        if len(ops) > BATCH_MAX_OPS:
+            return {"error": "Too many operations"}
+
+        access: dict[str, bool] = {}
+        results: list[dict[str, Any]] = []
+        out: Deferred = []
+        try:
+            with db.transaction():
+                for item in ops:
+                    item = item if isinstance(item, dict) else {}
+                    name = payload_str(item, "op") or "?"
+                    op = operations.get(name)
+                    room = payload_str(item, "room") or payload_str(item, "room_id")
+                    error: str | None
+                    if op is None or room is None:
+                        error = "Unknown operation" if op is None else "Missing required fields"
+                    else:
+                        if room not in access:
+                            access[room] = bool(db.user_can_access_room(username, room))
+                        error = (
+                            op(username, room, item, out)
+                            if access[room]
+                            else "No access to this chat"
+                        )
+                    results.append(
+                        {"op": name, "ok": not error, **({"error": error} if error else {})}
+                    )
+        except Exception as exc:
+            app.logger.error(f"Ошибка пакета операций: {exc}", exc_info=True)
+            return {"error": "Failed to apply operations"}
+        for send in out:
+            send()
+        return {"results": results}
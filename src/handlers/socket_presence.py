@@ -1,8 +1,7 @@
 import time
-from datetime import datetime
 from typing import Any
 
-from flask_socketio import emit, join_room
+from flask_socketio import ConnectionRefusedError, emit, join_room
 
 from handlers.socket_runtime import (
     SocketRuntime,
@@ -10,6 +9,16 @@ from handlers.socket_runtime import (
     payload_str,
     socket_sid,
 )
+from utils.backpressure import pop_forced_disconnect
+from utils.message_payload import message_table
+from utils.outbound_batch import emit_coalesced
+from utils.presence_fanout import PresenceFanout
+from utils.room_delivery import active_room, forget_sid, set_active_room, user_room
+from utils.room_events import room_event_head, room_events_since
+from utils.session_tickets import RESUME_TICKET_TTL_SEC
+
+# Больше пропущенных событий дешевле отдать одной историей.
+RESYNC_MAX_EVENTS = 200
 
 
 def register_presence_handlers(rt: SocketRuntime) -> None:
@@ -17,79 +26,118 @@ def register_presence_handlers(rt: SocketRuntime) -> None:
     app = rt.app
     db = rt.db
     auth_token_store = rt.auth_token_store
-    user_sessions = rt.user_sessions
-    user_connections = rt.user_connections
+    presence = rt.presence
+    session_tickets = rt.session_tickets
+    admission = rt.admission
     auth_token_lifetime = rt.auth_token_lifetime
 
-    @socketio.on("connect")
-    def handle_connect():
-        app.logger.info(f"Клиент подключён: {socket_sid()}")
+    fanout = PresenceFanout(socketio, db, presence.is_online, app.logger)
+    app.extensions["nebula_presence_fanout"] = fanout
+    fanout.start()
 
-    @socketio.on_error_default
-    def default_error_handler(error):
-        app.logger.error(f"Ошибка сокета: {error}", exc_info=True)
-        emit("error", {"message": "Server error"})
+    def reaped_offline(usernames: list[str]) -> None:
+        # Пульс умершего воркера уже истёк — ждать ещё grace незачем.
+        for username in usernames:
+            fanout.offline(username, grace=0)
 
-    @socketio.on("user_online")
-    def handle_user_online(data: dict[str, Any]):
-        username = payload_str(data, "username")
-        token = payload_str(data, "token")
+    presence.start_heartbeat(on_offline=reaped_offline)
 
+    # sid -> билет возобновления, выданный этому соединению.
+    sid_tickets: dict[str, str] = {}
+    # Сокеты, возобновлённые после закрытия за переполнение: курсор клиента неполон.
+    stale_sids: set[str] = set()
+
+    def token_error(username: str | None, token: str | None) -> str | None:
         token_data = auth_token_store.get(token) if token else None
         if not username or not token or not token_data:
-            emit("error", {"message": "Authentication required. Please log in again."})
-            return
+            return "Authentication required. Please log in again."
         if token_data["username"] != username:
-            emit("error", {"message": "Authentication error"})
-            return
+            return "Authentication error"
         if time.time() - token_data["created_at"] > auth_token_lifetime:
             auth_token_store.delete(token)
-            emit("error", {"message": "Token expired, please log in again"})
-            return
-        if not db.get_user(username):
-            emit("error", {"message": "User not found"})
-            return
+            return "Token expired, please log in again"
+        return None
 
-        sid = socket_sid()
-        user_sessions[sid] = username
-        if username not in user_connections:
-            user_connections[username] = set()
+    @socketio.on("connect")
+    def handle_connect(auth: dict[str, Any] | None = None):
+        """Аутентификация в рукопожатии: без валидного токена сокет не создаётся.
+
+        С билетом из ``session`` (переподключение в пределах TTL) проверка
+        пользователя в MySQL и ``update_last_seen`` пропускаются, а открытый чат
+        восстанавливается из билета.
+        """
+        retry_after = admission.admit_connect()
+        if retry_after is not None:
+            raise ConnectionRefusedError("Server busy", {"retry_after": retry_after})
 
-        was_offline = len(user_connections[username]) == 0
-        user_connections[username].add(sid)
+        auth = auth if isinstance(auth, dict) else {}
+        username = payload_str(auth, "username")
+        error = token_error(username, payload_str(auth, "token"))
+        if error or username is None:
+            raise ConnectionRefusedError(error or "Authentication required")
 
-        db.update_last_seen(username)
+        # Билет пока только смотрим: забираем его, когда отказов уже не будет, —
+        # иначе повтор после retry_after пошёл бы полным (дорогим) входом.
+        ticket = payload_str(auth, "ticket") or ""
+        resumed = session_tickets.peek(ticket)
+        if resumed and resumed.get("username") != username:
+            resumed = None
+        if resumed is None or session_tickets.take(ticket) is None:
+            # Без билета (или его только что забрало другое соединение) —
+            # полный вход; он идёт в MySQL, для него отдельный, более строгий лимит.
+            resumed = None
+            retry_after = admission.admit_bootstrap()
+            if retry_after is not None:
+                raise ConnectionRefusedError("Server busy", {"retry_after": retry_after})
+            if not db.get_user(username):
+                raise ConnectionRefusedError("User not found")
+
+        sid = socket_sid()
+        was_offline = presence.add(sid, username) == 0
+        join_room(user_room(username))
+        if resumed is None:
+            db.update_last_seen(username)
         if was_offline:
-            emit(
-                "user_status_changed",
-                {
-                    "username": username,
-                    "status": "online",
-                    "timestamp": datetime.now().isoformat(),
-                },
-                broadcast=True,
-            )
+            fanout.online(username)
+        room = resumed.get("room") if resumed else None
+        # Доступ к комнате из билета могли отозвать (исключение, бан) —
+        # проверяем, как при join; без доступа сессия возобновляется без чата.
+        if room and not db.user_can_access_room(username, room):
+            room = None
+        if room:
+            set_active_room(sid, room)
+        if resumed and resumed.get("stale"):
+            stale_sids.add(sid)
 
+        sid_tickets[sid] = session_tickets.issue(username, room)
+        emit(
+            "session",
+            {
+                "ticket": sid_tickets[sid],
+                "ttl": RESUME_TICKET_TTL_SEC,
+                "resumed": resumed is not None,
+            },
+        )
         app.logger.info(
-            f"{username} в сети (соединений: {len(user_connections[username])})"
+            f"{username} в сети (соединений: {presence.connection_count(username)}"
+            f"{', сессия возобновлена' if resumed else ''})"
         )
 
-        # Подписываем sid сразу на все доступные комнаты (приватные и группы).
-        try:
-            rooms_to_join: set[str] = set()
-            for rid in db.list_private_room_ids_for_user(username):
-                if rid:
-                    rooms_to_join.add(rid)
-            for row in db.get_user_rooms(username) or []:
-                room_id_value = row.get("room_id") if isinstance(row, dict) else None
-                if isinstance(room_id_value, str) and room_id_value:
-                    rooms_to_join.add(room_id_value)
-            for rid in rooms_to_join:
-                join_room(rid)
-        except Exception as exc:
-            app.logger.warning(
-                "Не удалось подключить сокет к комнатам %s: %s", username, exc
-            )
+    @socketio.on_error_default
+    def default_error_handler(error):
+        app.logger.error(f"Ошибка сокета: {error}", exc_info=True)
+        emit("error", {"message": "Server error"})
+
+    @socketio.on("user_online")
+    def handle_user_online(data: dict[str, Any]):
+        """Старый клиент: сокет уже аутентифицирован рукопожатием, проверяем совпадение."""
+        username = payload_str(data, "username")
+        error = token_error(username, payload_str(data, "token"))
+        if error:
+            emit("error", {"message": error})
+            return
+        if presence.username_for(socket_sid()) != username:
+            emit("error", {"message": "Authentication error"})
 
     @socketio.on("typing")
     def handle_typing(data: dict[str, Any]):
@@ -97,15 +145,13 @@ def register_presence_handlers(rt: SocketRuntime) -> None:
         username = payload_str(data, "username")
         if not room or not username:
             return
-        if not assert_socket_identity(user_sessions, username):
+        if not assert_socket_identity(presence, username):
             return
         if not db.user_can_access_room(username, room):
             return
-        emit(
-            "user_typing",
-            {"username": username, "room": room},
-            room=room,
-            include_self=False,
+        # Набор текста и его окончание делят ключ — в пачку попадёт последнее состояние.
+        emit_coalesced(
+            room, "user_typing", {"username": username, "room": room}, f"typing:{username}"
         )
 
     @socketio.on("stop_typing")
@@ -114,64 +160,113 @@ def register_presence_handlers(rt: SocketRuntime) -> None:
         username = payload_str(data, "username")
         if not room or not username:
             return
-        if not assert_socket_identity(user_sessions, username):
+        if not assert_socket_identity(presence, username):
             return
         if not db.user_can_access_room(username, room):
             return
-        emit(
-            "user_stop_typing",
-            {"username": username, "room": room},
-            room=room,
-            include_self=False,
+        emit_coalesced(
+            room, "user_stop_typing", {"username": username, "room": room}, f"typing:{username}"
         )
 
-    @socketio.on("join")
-    def handle_join(data: dict[str, Any]):
+    def open_room(data: dict[str, Any]) -> tuple[str, str] | None:
         username = payload_str(data, "username")
         room = payload_str(data, "room")
         if not room or not username:
             emit("error", {"message": "Missing required fields"})
-            return
-        if not assert_socket_identity(user_sessions, username):
-            return
+            return None
+        if not assert_socket_identity(presence, username):
+            return None
         if not db.user_can_access_room(username, room):
             emit("error", {"message": "No access to this chat"})
-            return
-        join_room(room)
+            return None
+        # Подписка только на открытый чат; об остальных сообщит inbox_update.
+        set_active_room(socket_sid(), room)
+        return username, room
 
+    def send_history(
+        username: str, room: str, *, full: bool = False, columns: bool = False
+    ) -> None:
+        # Номер берём до чтения истории: событие между ними клиент получит
+        # ещё раз, но не потеряет (повторы он отбрасывает по message_id).
+        head = room_event_head(room)
         blocked_users = db.get_blocked_users(username)
         filtered_messages = db.get_messages(
             room,
             limit=100,
             excluded_usernames=blocked_users,
         )
+        payload: dict[str, Any] = {"room": room}
+        if columns:
+            payload["message_table"] = message_table(filtered_messages)
+        else:
+            payload["messages"] = filtered_messages
+        if head is not None:
+            payload["epoch"], payload["seq"] = head
+        if full:
+            payload["full"] = True
+        emit("message_history", payload)
 
+    def sync_room(data: dict[str, Any]) -> None:
+        """Открыть комнату: с курсором клиента ``epoch``/``seq`` — только дельта.
+
+        Пустой ``room_replay`` значит «страница не изменилась». Если журнал комнаты
+        пропуск не покрывает, уходит полная ``message_history`` с ``full``;
+        с ``columns`` её страница приходит столбцами (``message_table``).
+        """
+        opened = open_room(data)
+        if not opened:
+            return
+        username, room = opened
+        epoch = payload_str(data, "epoch")
+        seq = data.get("seq")
+        columns = data.get("columns") is True
+        if socket_sid() in stale_sids:
+            # Часть событий до обрыва была отброшена — дельте по курсору верить нельзя.
+            stale_sids.discard(socket_sid())
+            send_history(username, room, full=True, columns=columns)
+            return
+        if not epoch or not isinstance(seq, int) or isinstance(seq, bool) or seq < 0:
+            send_history(username, room, columns=columns)
+            return
+        events = room_events_since(room, epoch, seq)
+        if events is None or len(events) > RESYNC_MAX_EVENTS:
+            send_history(username, room, full=True, columns=columns)
+            return
+        blocked = set(db.get_blocked_users(username)) if events else set()
         emit(
-            "message_history",
-            {"room": room, "messages": filtered_messages},
+            "room_replay",
+            {
+                "room": room,
+                "epoch": epoch,
+                "not_modified": not events,
+                "events": [
+                    {"event": event, "data": payload}
+                    for event, payload in events
+                    if not (event == "receive_message" and payload.get("username") in blocked)
+                ],
+            },
         )
 
+    @socketio.on("join")
+    def handle_join(data: dict[str, Any]):
+        sync_room(data)
+
+    @socketio.on("resync")
+    def handle_resync(data: dict[str, Any]):
+        """Переподключение с открытым чатом — тот же ``join`` с курсором."""
+        sync_room(data)
+
     @socketio.on("disconnect")
     def handle_disconnect(_reason=None):
         """``_reason`` is sent by python-socketio / Flask-SocketIO 5.6+."""
         sid = socket_sid()
-        if sid in user_sessions:
-            username = user_sessions[sid]
-            del user_sessions[sid]
-
-            if username in user_connections:
-                user_connections[username].discard(sid)
-                if len(user_connections[username]) == 0:
-                    del user_connections[username]
-                    db.update_last_seen(username)
-                    emit(
-                        "user_status_changed",
-                        {
-                            "username": username,
-                            "status": "offline",
-                            "timestamp": datetime.now().isoformat(),
-                            "last_seen": db.get_last_seen(username),
-                        },
-                        broadcast=True,
-                    )
-                    app.logger.info(f"{username} вышел из сети")
+        room = active_room(sid)
+        forget_sid(sid)
+        username, connections_left = presence.remove(sid)
+        ticket = sid_tickets.pop(sid, None)
+        stale_sids.discard(sid)
+        stale = pop_forced_disconnect(sid)
+        if ticket and username:
+            session_tickets.park(ticket, username, room, stale=stale)
+        if username and connections_left == 0:
+            fanout.offline(username)
@@ -1,11 +1,16 @@
 from collections.abc import Callable, Sequence
+from contextlib import AbstractContextManager
 from dataclasses import dataclass
 from typing import Any, NotRequired, Protocol, TypedDict, cast
 
 from flask import Flask, request
 from flask_socketio import SocketIO, emit
 
+from utils.admission import AdmissionControl
 from utils.auth_token_store import AuthTokenStore
+from utils.media_upload import ChunkedUploads
+from utils.presence_registry import PresenceRegistry
+from utils.session_tickets import SessionTicketStore
 
 
 def socket_sid() -> str:
@@ -18,15 +23,15 @@ def payload_str(data: dict[str, Any], key: str) -> str | None:
     return value if isinstance(value, str) and value else None
 
 
-def assert_socket_identity(user_sessions: dict[str, str], username: str) -> bool:
-    sid = socket_sid()
-    if sid not in user_sessions:
+def assert_socket_identity(presence: PresenceRegistry, username: str) -> bool:
+    session_user = presence.username_for(socket_sid())
+    if session_user is None:
         emit(
             "error",
             {"message": "Authentication required. Call user_online after login."},
         )
         return False
-    if user_sessions[sid] != username:
+    if session_user != username:
         emit("error", {"message": "Authentication error"})
         return False
     return True
@@ -34,7 +39,8 @@ def assert_socket_identity(user_sessions: dict[str, str], username: str) -> bool
 
 class MediaPayload(TypedDict):
     type: str
-    data: str
+    data: NotRequired[str]
+    upload_id: NotRequired[str]
     name: NotRequired[str]
 
 
@@ -47,6 +53,7 @@ class SendMessagePayload(TypedDict):
     media_meta: NotRequired[dict[str, Any]]
     replyTo: NotRequired[dict[str, Any]]
     forwarded: NotRequired[dict[str, Any]]
+    ack: NotRequired[bool]
     ttl_seconds: NotRequired[int]
 
 
@@ -54,8 +61,7 @@ class DbFacade(Protocol):
     def get_user(self, username: str) -> dict[str, Any] | None: ...
     def update_last_seen(self, username: str) -> bool: ...
     def get_last_seen(self, username: str) -> str | None: ...
-    def get_user_rooms(self, username: str) -> list[dict[str, Any]]: ...
-    def list_private_room_ids_for_user(self, username: str) -> list[str]: ...
+    def list_contact_usernames(self, username: str) -> list[str]: ...
     def get_messages(
         self,
         room_id: str,
@@ -68,7 +74,9 @@ class DbFacade(Protocol):
     def is_user_banned(self, username: str) -> bool: ...
     def can_user_post_in_room(self, username: str, room_id: str) -> bool: ...
     def create_message(self, message_data: dict[str, Any]) -> bool: ...
+    def remember_recent_message(self, saved_msg: dict[str, Any]) -> None: ...
     def get_message_by_id(self, message_id: str) -> dict[str, Any] | None: ...
+    def inbox_preview_from_row(self, row: dict[str, Any] | None) -> str: ...
     def toggle_reaction(self, message_id: str, username: str, emoji: str) -> bool: ...
     def get_message_reactions(self, message_id: str) -> dict[str, list[str]]: ...
     def add_message_read(self, message_id: str, username: str) -> bool: ...
@@ -84,6 +92,7 @@ class DbFacade(Protocol):
     def delete_message(self, message_id: str) -> bool: ...
     def pin_message(self, room_id: str, message_id: str, username: str) -> bool: ...
     def unpin_message(self, room_id: str, message_id: str) -> bool: ...
+    def transaction(self) -> AbstractContextManager[None]: ...
 
 
 @dataclass(frozen=True, slots=True)
@@ -94,12 +103,14 @@ class SocketRuntime:
     app: Flask
     db: DbFacade
     auth_token_store: AuthTokenStore
-    user_sessions: dict[str, str]
-    user_connections: dict[str, set[str]]
+    presence: PresenceRegistry
+    session_tickets: SessionTicketStore
+    admission: AdmissionControl
     check_rate_limit: Callable[[str], bool]
     sanitize_text: Callable[[str], str]
     validate_mime_type: Callable[[str, Sequence[str | None]], tuple[bool, str | None, str]]
     save_media_file: Callable[[str, str | None], str | None]
+    uploads: ChunkedUploads
     auth_token_lifetime: int
     max_message_length: int
     max_media_file_size: int
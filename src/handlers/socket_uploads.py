@@ -0,0 +1,93 @@
+"""Кусочная загрузка медиа по Socket.IO (см. ``utils.media_upload``).
+
+Все события отвечают через ack: успех — поля результата, отказ — ``{"error"}``.
+"""
+
+from typing import Any
+
+from handlers.socket_runtime import SocketRuntime, assert_socket_identity, payload_str
+from utils.media_upload import UploadError
+
+
+def register_upload_handlers(rt: SocketRuntime) -> None:
+    app = rt.app
+    socketio = rt.socketio
+    presence = rt.presence
+    uploads = rt.uploads
+
+    def upload_user(data: Any) -> str | None:
+        if not isinstance(data, dict):
+            return None
+        username = payload_str(data, "username")
+        if username is None or not assert_socket_identity(presence, username):
+            return None
+        return username
+
+    @socketio.on("upload_start")
+    def handle_upload_start(data: dict[str, Any]):
+        """``{"username", "type", "name", "mime", "size"}`` → ``{"upload_id", "chunk_size"}``."""
+        username = upload_user(data)
+        if username is None:
+            return {"error": "Authentication error"}
+        size = data.get("size")
+        media_type = payload_str(data, "type")
+        if not isinstance(size, int) or media_type is None:
+            return {"error": "Missing required fields"}
+        try:
+            return uploads.start(
+                username,
+                media_type,
+                payload_str(data, "name") or "file",
+                payload_str(data, "mime") or "",
+                size,
+            )
+        except UploadError as exc:
+            return {"error": str(exc)}
+
+    @socketio.on("upload_chunk")
+    def handle_upload_chunk(data: dict[str, Any]):
+        """``{"username", "upload_id", "index", "data": <bytes>}`` → ``{"received"}``."""
+        username = upload_user(data)
+        if username is None:
+            return {"error": "Authentication error"}
+        upload_id = payload_str(data, "upload_id")
+        index = data.get("index")
+        chunk = data.get("data")
+        if upload_id is None or not isinstance(index, int):
+            return {"error": "Missing required fields"}
+        if not isinstance(chunk, bytes | bytearray):
+            return {"error": "Chunk must be binary"}
+        try:
+            return {"received": uploads.chunk(username, upload_id, index, bytes(chunk))}
+        except UploadError as exc:
+            return {"error": str(exc)}
+        except OSError as exc:
+            app.logger.error("Ошибка записи куска загрузки %s: %s", upload_id, exc)
+            uploads.abort(username, upload_id)
+            return {"error": "Upload failed"}
+
+    @socketio.on("upload_finish")
+    def handle_upload_finish(data: dict[str, Any]):
+        """``{"username", "upload_id"}`` → ``{"upload_id", "path", "type", "name"}``."""
+        username = upload_user(data)
+        if username is None:
+            return {"error": "Authentication error"}
+        upload_id = payload_str(data, "upload_id")
+        if upload_id is None:
+            return {"error": "Missing required fields"}
+        try:
+            return {"upload_id": upload_id, **uploads.finish(username, upload_id)}
+        except UploadError as exc:
+            return {"error": str(exc)}
+        except OSError as exc:
+            app.logger.error("Ошибка завершения загрузки %s: %s", upload_id, exc)
+            uploads.abort(username, upload_id)
+            return {"error": "Upload failed"}
+
+    @socketio.on("upload_abort")
+    def handle_upload_abort(data: dict[str, Any]):
+        username = upload_user(data)
+        upload_id = payload_str(data, "upload_id") if username else None
+        if username is None or upload_id is None:
+            return {"ok": False}
+        return {"ok": uploads.abort(username, upload_id)}
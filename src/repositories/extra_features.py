@@ -2,6 +2,12 @@
 
 import json
 
+from repositories.media import (
+    OWNER_SCHEDULED,
+    add_media_ref_cursor,
+    release_media_refs_cursor,
+)
+
 
 def upsert_draft(get_db_cursor, logger, Error, username, room_id, draft_text):
     try:
@@ -128,6 +134,8 @@ def insert_scheduled_message(get_db_cursor, logger, Error, row):
                 ),
             )
             lid = cursor.lastrowid
+            if lid:
+                add_media_ref_cursor(cursor, OWNER_SCHEDULED, lid, row.get("media_path"))
             return int(lid) if lid else None
     except Error as error:
         logger.error(f"Ошибка вставки отложенного сообщения: {error}")
@@ -163,6 +171,8 @@ def mark_scheduled_sent(get_db_cursor, logger, Error, sched_id, sent_message_id)
                 """,
                 (sent_message_id, sched_id, sent_message_id),
             )
+            # У отправленного сообщения своя ссылка на файл.
+            release_media_refs_cursor(cursor, OWNER_SCHEDULED, [sched_id])
             return True
     except Error as error:
         logger.error(f"Ошибка отметки отложенного как отправленного: {error}")
@@ -173,6 +183,7 @@ def delete_scheduled_message(get_db_cursor, logger, Error, sched_id):
     try:
         with get_db_cursor() as (cursor, _):
             cursor.execute("DELETE FROM scheduled_messages WHERE id = %s", (sched_id,))
+            release_media_refs_cursor(cursor, OWNER_SCHEDULED, [sched_id])
             return True
     except Error as error:
         logger.error(f"Ошибка удаления строки отложенного: {error}")
@@ -274,7 +285,13 @@ def update_pending_scheduled(
                 """,
                 tuple(params),
             )
-            return cursor.rowcount > 0
+            updated = cursor.rowcount > 0
+            if updated and "media_path" in updates:
+                release_media_refs_cursor(cursor, OWNER_SCHEDULED, [sched_id])
+                add_media_ref_cursor(
+                    cursor, OWNER_SCHEDULED, sched_id, updates["media_path"]
+                )
+            return updated
     except Error as error:
         logger.error(f"Ошибка обновления отложенного: {error}")
         return False
@@ -290,7 +307,10 @@ def delete_pending_scheduled(get_db_cursor, logger, Error, sched_id, username):
                 """,
                 (sched_id, username),
             )
-            return cursor.rowcount > 0
+            deleted = cursor.rowcount > 0
+            if deleted:
+                release_media_refs_cursor(cursor, OWNER_SCHEDULED, [sched_id])
+            return deleted
     except Error as error:
         logger.error(f"Ошибка удаления отложенного: {error}")
         return False
@@ -0,0 +1,210 @@
+"""Учёт медиа по содержимому: ``media_objects`` (файлы) и ``media_refs`` (кто их использует).
+
+Файл лежит по пути ``/media/<aa>/<bb>/<sha256>.<ext>``; ``object_name`` —
+последний сегмент. Функции ``*_cursor`` вызываются внутри курсора владельца
+(создание/удаление сообщения и т. п.), чтобы ссылка менялась в той же
+транзакции, что и сама строка. Старые плоские ``/media/<uuid>.<ext>``
+ссылками не учитываются.
+"""
+
+import re
+
+CAS_PATH_RE = re.compile(
+    r"^/media/(?P<a>[0-9a-f]{2})/(?P<b>[0-9a-f]{2})/(?P<name>(?P<digest>[0-9a-f]{64})\.[a-z0-9]{1,8})$"
+)
+
+OWNER_MESSAGE = "message"
+OWNER_SCHEDULED = "scheduled"
+OWNER_AVATAR = "avatar"
+
+# Строки, без которых ссылка висит: владелец мог уйти каскадом по внешнему
+# ключу (удаление пользователя) мимо кода, который снимает ссылки.
+_OWNER_ROWS = {
+    OWNER_MESSAGE: "SELECT 1 FROM messages o WHERE o.message_id = r.owner_id",
+    OWNER_SCHEDULED: "SELECT 1 FROM scheduled_messages o WHERE o.id = r.owner_id",
+    OWNER_AVATAR: (
+        "SELECT 1 FROM user_profiles o"
+        " WHERE o.username = r.owner_id AND o.avatar_type = 'image'"
+    ),
+}
+
+
+def media_object_name(path):
+    """``<sha256>.<ext>`` для пути медиа по содержимому, иначе ``None``."""
+    if not isinstance(path, str):
+        return None
+    match = CAS_PATH_RE.match(path)
+    if not match:
+        return None
+    digest = match["digest"]
+    if match["a"] != digest[:2] or match["b"] != digest[2:4]:
+        return None
+    return match["name"]
+
+
+def add_media_ref_cursor(cursor, owner_type, owner_id, path):
+    name = media_object_name(path)
+    if name is None:
+        return
+    cursor.execute(
+        "INSERT IGNORE INTO media_refs (owner_type, owner_id, object_name) VALUES (%s, %s, %s)",
+        (owner_type, str(owner_id), name),
+    )
+    if cursor.rowcount:
+        cursor.execute(
+            "UPDATE media_objects SET ref_count = ref_count + 1 WHERE object_name = %s",
+            (name,),
+        )
+
+
+def release_media_refs_cursor(cursor, owner_type, owner_ids):
+    owner_ids = [str(owner_id) for owner_id in owner_ids]
+    if not owner_ids:
+        return
+    placeholders = ",".join(["%s"] * len(owner_ids))
+    cursor.execute(
+        f"""
+        SELECT object_name, COUNT(*) AS n FROM media_refs
+        WHERE owner_type = %s AND owner_id IN ({placeholders})
+        GROUP BY object_name
+        """,
+        (owner_type, *owner_ids),
+    )
+    released = [(row["object_name"], int(row["n"])) for row in cursor.fetchall()]
+    if not released:
+        return
+    cursor.execute(
+        f"DELETE FROM media_refs WHERE owner_type = %s AND owner_id IN ({placeholders})",
+        (owner_type, *owner_ids),
+    )
+    for name, count in released:
+        cursor.execute(
+            """
+            UPDATE media_objects
+            SET ref_count = IF(ref_count > %s, ref_count - %s, 0),
+                released_at = CURRENT_TIMESTAMP
+            WHERE object_name = %s
+            """,
+            (count, count, name),
+        )
+
+
+def register_media_object(get_db_cursor, logger, Error, path, size, uploaded_by=None):
+    """Записать сохранённый файл; повторная загрузка продлевает срок до сборки мусора.
+
+    ``uploaded_by`` запоминается в ``media_uploads``: чужой файл по хэшу
+    нельзя поставить себе аватаром (см. :func:`media_uploaded_by`).
+    """
+    name = media_object_name(path)
+    if name is None:
+        return False
+    try:
+        with get_db_cursor() as (cursor, _):
+            cursor.execute(
+                """
+                INSERT INTO media_objects (object_name, sha256, size)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE released_at = CURRENT_TIMESTAMP
+                """,
+                (name, name.split(".", 1)[0], int(size)),
+            )
+            if uploaded_by:
+                cursor.execute(
+                    "INSERT IGNORE INTO media_uploads (object_name, username) VALUES (%s, %s)",
+                    (name, uploaded_by),
+                )
+            return True
+    except Error as error:
+        logger.error(f"Ошибка учёта медиафайла {name}: {error}")
+        return False
+
+
+def media_uploaded_by(get_db_cursor, logger, Error, path, username):
+    """Загружал ли ``username`` файл ``path`` сам."""
+    name = media_object_name(path)
+    if name is None:
+        return False
+    try:
+        with get_db_cursor() as (cursor, _):
+            cursor.execute(
+                "SELECT 1 FROM media_uploads WHERE object_name = %s AND username = %s",
+                (name, username),
+            )
+            return cursor.fetchone() is not None
+    except Error as error:
+        logger.error(f"Ошибка проверки загрузки {name}: {error}")
+        return False
+
+
+def release_dangling_media_refs(get_db_cursor, logger, Error, limit=500):
+    """Снять ссылки, владельцев которых уже нет; вернуть число снятых."""
+    released = 0
+    try:
+        with get_db_cursor() as (cursor, _):
+            for owner_type, owner_rows in _OWNER_ROWS.items():
+                cursor.execute(
+                    f"""
+                    SELECT DISTINCT r.owner_id FROM media_refs r
+                    WHERE r.owner_type = %s AND NOT EXISTS ({owner_rows})
+                    LIMIT %s
+                    """,
+                    (owner_type, int(limit)),
+                )
+                owner_ids = [row["owner_id"] for row in cursor.fetchall()]
+                release_media_refs_cursor(cursor, owner_type, owner_ids)
+                released += len(owner_ids)
+            return released
+    except Error as error:
+        logger.error(f"Ошибка снятия висящих ссылок на медиа: {error}")
+        return released
+
+
+def replace_media_ref(get_db_cursor, logger, Error, owner_type, owner_id, path):
+    """Ссылка владельца — ровно на ``path`` (или ни на что при ``None``)."""
+    try:
+        with get_db_cursor() as (cursor, _):
+            release_media_refs_cursor(cursor, owner_type, [owner_id])
+            if path:
+                add_media_ref_cursor(cursor, owner_type, owner_id, path)
+            return True
+    except Error as error:
+        logger.error(f"Ошибка ссылки на медиа {owner_type}:{owner_id}: {error}")
+        return False
+
+
+def list_orphan_media(get_db_cursor, logger, Error, grace_sec, limit=200):
+    """Файлы без ссылок дольше ``grace_sec`` (свежие загрузки ещё ждут сообщения)."""
+    try:
+        with get_db_cursor() as (cursor, _):
+            cursor.execute(
+                """
+                SELECT object_name FROM media_objects
+                WHERE ref_count = 0
+                  AND released_at < CURRENT_TIMESTAMP - INTERVAL %s SECOND
+                LIMIT %s
+                """,
+                (int(grace_sec), int(limit)),
+            )
+            return [row["object_name"] for row in cursor.fetchall()]
+    except Error as error:
+        logger.error(f"Ошибка выборки неиспользуемых медиа: {error}")
+        return []
+
+
+def delete_orphan_media_object(get_db_cursor, logger, Error, object_name):
+    """Удалить строку, если ссылок так и нет; ``True`` — файл можно стирать."""
+    try:
+        with get_db_cursor() as (cursor, _):
+            cursor.execute(
+                "DELETE FROM media_objects WHERE object_name = %s AND ref_count = 0",
+                (object_name,),
+            )
+            if cursor.rowcount == 0:
+                return False
+            cursor.execute(
+                "DELETE FROM media_uploads WHERE object_name = %s", (object_name,)
+            )
+            return True
+    except Error as error:
+        logger.error(f"Ошибка удаления медиа {object_name}: {error}")
+        return False
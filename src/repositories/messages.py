@@ -2,13 +2,18 @@ import json
 import re
 from datetime import UTC, datetime, timedelta
 
+from repositories.media import (
+    OWNER_MESSAGE,
+    add_media_ref_cursor,
+    release_media_refs_cursor,
+)
 from repositories.rooms import room_ids_where_user_is_member_cursor
 from utils.json_helpers import parse_json_field
 from utils.room_access import (
     can_access_room_with_member_set,
     private_room_peer_username,
 )
-from utils.time_format import isoformat_utc_z
+from utils.time_format import as_utc
 
 
 def _fulltext_boolean_query(query_text):
@@ -250,6 +255,10 @@ def create_message(get_db_cursor, logger, Error, message_data):
                 "INSERT IGNORE INTO message_reads (message_id, username) VALUES (%s, %s)",
                 (message_data["id"], message_data["username"]),
             )
+            if media:
+                add_media_ref_cursor(
+                    cursor, OWNER_MESSAGE, message_data["id"], media.get("data")
+                )
         logger.info(
             f'Сообщение создано: {message_data["id"]}, комната {message_data["room"]}'
         )
@@ -259,6 +268,51 @@ def create_message(get_db_cursor, logger, Error, message_data):
         return False
 
 
+def _normalize_times(msg):
+    msg["timestamp"] = as_utc(msg.pop("created_at"))
+    for key in ("expires_at", "edited_at"):
+        if msg.get(key) is not None:
+            msg[key] = as_utc(msg[key])
+
+
+def hydrate_message_row(msg, *, reactions, read_by, reply_msg=None):
+    """Turn a ``messages`` row into the history item clients expect (in place).
+
+    ``timestamp``/``expires_at``/``edited_at`` become aware UTC ``datetime``
+    (:func:`utils.time_format.as_utc`): the app's JSON provider writes them as
+    UTC ``Z`` strings (see ``utils.json_provider``), and ``utils.recent_messages``
+    compares ``expires_at`` with an aware "now".
+    """
+    msg["reactions"] = reactions
+    msg["read_by"] = read_by
+
+    if msg.get("media_type"):
+        msg["media"] = {
+            "type": msg["media_type"],
+            "data": msg["media_data"],
+            "name": msg["media_name"],
+        }
+        mm = parse_json_field(msg.get("media_meta"))
+        if isinstance(mm, dict):
+            msg["media"]["meta"] = mm
+
+    if msg.get("reply_to_id") and reply_msg:
+        msg["replyTo"] = {
+            "id": reply_msg["message_id"],
+            "username": reply_msg["username"],
+            "text": reply_msg["text"],
+        }
+
+    if msg.get("forwarded_from"):
+        msg["forwarded"] = {
+            "from": msg["forwarded_from"],
+            "originalId": msg["forwarded_message_id"],
+        }
+
+    _normalize_times(msg)
+    return msg
+
+
 def get_messages(
     get_db_cursor,
     logger,
@@ -268,6 +322,7 @@ def get_messages(
     before_id=None,
     excluded_usernames=None,
 ):
+    """Hydrated page of room history (oldest first); ``None`` on DB error."""
     try:
         excluded = list(dict.fromkeys(un for un in (excluded_usernames or []) if un))
         excluded_sql = ""
@@ -322,45 +377,17 @@ def get_messages(
             )
 
         for msg in messages:
-            msg["reactions"] = reactions_by_message.get(msg["message_id"], {})
-            msg["read_by"] = reads_by_message.get(msg["message_id"], [])
-
-            if msg.get("media_type"):
-                msg["media"] = {
-                    "type": msg["media_type"],
-                    "data": msg["media_data"],
-                    "name": msg["media_name"],
-                }
-                mm = parse_json_field(msg.get("media_meta"))
-                if isinstance(mm, dict):
-                    msg["media"]["meta"] = mm
-
-            if msg.get("reply_to_id"):
-                reply_msg = reply_messages_by_id.get(msg["reply_to_id"])
-                if reply_msg:
-                    msg["replyTo"] = {
-                        "id": reply_msg["message_id"],
-                        "username": reply_msg["username"],
-                        "text": reply_msg["text"],
-                    }
-
-            if msg.get("forwarded_from"):
-                msg["forwarded"] = {
-                    "from": msg["forwarded_from"],
-                    "originalId": msg["forwarded_message_id"],
-                }
-
-            msg["timestamp"] = isoformat_utc_z(msg["created_at"])
-            if msg.get("expires_at"):
-                msg["expires_at"] = isoformat_utc_z(msg["expires_at"])
-            del msg["created_at"]
-            if msg.get("edited_at"):
-                msg["edited_at"] = isoformat_utc_z(msg["edited_at"])
+            hydrate_message_row(
+                msg,
+                reactions=reactions_by_message.get(msg["message_id"], {}),
+                read_by=reads_by_message.get(msg["message_id"], []),
+                reply_msg=reply_messages_by_id.get(msg.get("reply_to_id")),
+            )
 
         return messages
     except Error as error:
         logger.error(f"Ошибка загрузки сообщений комнаты {room_id}: {error}")
-        return []
+        return None
 
 
 def cleanup_expired_messages(get_db_cursor, logger, Error):
@@ -398,6 +425,7 @@ def cleanup_expired_messages(get_db_cursor, logger, Error):
                 f"DELETE FROM pinned_messages WHERE message_id IN ({placeholders})",
                 expired_ids,
             )
+            release_media_refs_cursor(cursor, OWNER_MESSAGE, expired_ids)
             cursor.execute(
                 f"DELETE FROM messages WHERE message_id IN ({placeholders})",
                 expired_ids,
@@ -470,9 +498,7 @@ def search_messages_global(
                     "room": room_id,
                     "username": row["username"],
                     "text": row["text"],
-                    "timestamp": isoformat_utc_z(row["created_at"])
-                    if row.get("created_at")
-                    else None,
+                    "timestamp": row.get("created_at"),
                 }
             )
             if len(results) >= min(max(int(limit), 1), 200):
@@ -615,9 +641,7 @@ def search_messages_advanced(
                     "username": row["username"],
                     "text": row["text"],
                     "media_type": row.get("media_type"),
-                    "timestamp": isoformat_utc_z(row["created_at"])
-                    if row.get("created_at")
-                    else None,
+                    "timestamp": row.get("created_at"),
                 }
             )
             if len(results) >= lim:
@@ -661,6 +685,7 @@ def delete_message(get_db_cursor, logger, Error, message_id):
                 "UPDATE messages SET reply_to_id = NULL WHERE reply_to_id = %s",
                 (message_id,),
             )
+            release_media_refs_cursor(cursor, OWNER_MESSAGE, [message_id])
             cursor.execute("DELETE FROM messages WHERE message_id = %s", (message_id,))
             logger.info(f"Сообщение удалено из БД: {message_id}")
             return True
@@ -698,11 +723,14 @@ def unpin_message(get_db_cursor, logger, Error, room_id, message_id):
 
 
 def get_pinned_messages(get_db_cursor, logger, Error, room_id):
+    """Закрепы комнаты; ``None`` при ошибке БД, чтобы кэш не запомнил пустой список."""
     try:
         with get_db_cursor() as (cursor, _):
             cursor.execute(
                 """
-                SELECT m.*, p.pinned_by, p.pinned_at
+                SELECT m.message_id, m.room_id, m.username, m.text,
+                       m.media_type, m.media_name, m.expires_at, m.edited,
+                       m.edited_at, m.created_at, p.pinned_by, p.pinned_at
                 FROM pinned_messages p
                 JOIN messages m ON p.message_id = m.message_id
                 WHERE p.room_id = %s
@@ -712,24 +740,13 @@ def get_pinned_messages(get_db_cursor, logger, Error, room_id):
             )
             messages = cursor.fetchall()
 
+        # Без media_data: полоске закрепов нужен только текст и тип вложения.
         for msg in messages:
-            if msg.get("media_type"):
-                msg["media"] = {
-                    "type": msg["media_type"],
-                    "data": msg["media_data"],
-                    "name": msg["media_name"],
-                }
-            msg["timestamp"] = isoformat_utc_z(msg["created_at"])
-            msg["pinned_at"] = isoformat_utc_z(msg["pinned_at"])
-            if msg.get("expires_at"):
-                msg["expires_at"] = isoformat_utc_z(msg["expires_at"])
-            if msg.get("edited_at"):
-                msg["edited_at"] = isoformat_utc_z(msg["edited_at"])
-            del msg["created_at"]
+            _normalize_times(msg)
         return messages
     except Error as error:
         logger.error(f"Ошибка списка закреплённых для {room_id}: {error}")
-        return []
+        return None
 
 
 def is_message_pinned(get_db_cursor, logger, Error, room_id, message_id):
@@ -61,6 +61,25 @@ def list_room_audience_usernames(get_db_cursor, logger, Error, room_id):
     return list_room_member_usernames(get_db_cursor, logger, Error, room_id)
 
 
+def list_room_peer_usernames(get_db_cursor, logger, Error, username):
+    """Логины всех, кто состоит хотя бы в одной общей группе с пользователем."""
+    try:
+        with get_db_cursor() as (cursor, _):
+            cursor.execute(
+                """
+                SELECT DISTINCT peer.username
+                FROM room_members me
+                JOIN room_members peer ON peer.room_id = me.room_id
+                WHERE me.username = %s AND peer.username != %s
+                """,
+                (username, username),
+            )
+            return [row["username"] for row in cursor.fetchall()]
+    except Error as error:
+        logger.error(f"Ошибка списка соседей по комнатам для {username}: {error}")
+        return []
+
+
 def is_room_member(get_db_cursor, logger, Error, room_id, username):
     try:
         with get_db_cursor() as (cursor, _):
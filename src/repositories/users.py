@@ -1,3 +1,10 @@
+from repositories.media import (
+    OWNER_AVATAR,
+    add_media_ref_cursor,
+    release_media_refs_cursor,
+)
+
+
 def create_user(get_db_cursor, logger, Error, username, password_hash):
     try:
         with get_db_cursor() as (cursor, _):
@@ -63,6 +70,31 @@ def get_user_profile(get_db_cursor, logger, Error, username):
         return None
 
 
+def list_user_cards(get_db_cursor, logger, Error, usernames):
+    """Map username -> profile fields plus last_seen for many users in one query."""
+    unique = list(dict.fromkeys(un for un in usernames if un))
+    if not unique:
+        return {}
+    placeholders = ",".join(["%s"] * len(unique))
+    try:
+        with get_db_cursor() as (cursor, _):
+            cursor.execute(
+                f"""
+                SELECT u.username, u.last_seen,
+                       p.bio, p.avatar, p.avatar_type, p.nickname
+                FROM users u
+                LEFT JOIN user_profiles p ON p.username = u.username
+                WHERE u.username IN ({placeholders})
+                """,
+                unique,
+            )
+            rows = cursor.fetchall()
+        return {row["username"]: row for row in rows}
+    except Error as error:
+        logger.error(f"Ошибка пакетной загрузки профилей: {error}")
+        return {}
+
+
 def upsert_user_profile(
     get_db_cursor,
     logger,
@@ -93,6 +125,9 @@ def upsert_user_profile(
                     nickname or username,
                 ),
             )
+            release_media_refs_cursor(cursor, OWNER_AVATAR, [username])
+            if avatar_type == "image":
+                add_media_ref_cursor(cursor, OWNER_AVATAR, username, avatar)
             return True
     except Error as error:
         logger.error(f"РћС€РёР±РєР° СЃРѕС…СЂР°РЅРµРЅРёСЏ РїСЂРѕС„РёР»СЏ {username}: {error}")
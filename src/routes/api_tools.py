@@ -1,21 +1,43 @@
 import os
 import re
-from datetime import datetime
+from datetime import UTC, datetime
 
 from flask import Blueprint, current_app, jsonify, request
 
 import db
+from repositories.media import media_object_name
 from utils.auth_helpers import require_auth_user
+from utils.http_cache import conditional_json, not_modified
 from utils.http_parse import json_body, query_int
+from utils.profile_cache import cards_etag
 from utils.room_access_db import user_can_access_room
+from utils.room_delivery import emit_to_users
+from utils.time_format import isoformat_utc_z
 
 DEFAULT_AVATAR = ""
+MAX_PROFILE_BATCH = 100
+
+
+def _profile_payload(username: str, card: dict | None) -> dict:
+    card = card or {}
+    return {
+        "avatar": card.get("avatar") or DEFAULT_AVATAR,
+        "avatarType": card.get("avatar_type") or "emoji",
+        "bio": card.get("bio") or "",
+        "nickname": card.get("nickname") or username,
+    }
 
 
 def _is_safe_avatar_media_path(path: str) -> bool:
-    """Uploaded avatars: /media/av_<sanitized_user>_<12hex>.<ext>"""
+    """Uploaded avatars: /media/<aa>/<bb>/<sha256>.<ext> (older: /media/av_<user>_<12hex>.<ext>).
+
+    Only the shape is checked; who uploaded a content-addressed file is
+    ``db.media_uploaded_by``.
+    """
     if not path or not path.startswith("/media/") or len(path) > 500:
         return False
+    if media_object_name(path):
+        return path.rsplit(".", 1)[-1] in ("jpg", "png", "webp", "gif")
     name = path[7:]
     if ".." in name or "/" in name or "\\" in name:
         return False
@@ -25,6 +47,7 @@ def _is_safe_avatar_media_path(path: str) -> bool:
 
 
 def _delete_avatar_file(media_dir: str, media_path: str) -> None:
+    """Старые ``av_*`` файлы принадлежат одному профилю; файлы по хэшу — через ссылки."""
     if not media_dir or not media_path.startswith("/media/"):
         return
     name = media_path.rsplit("/", 1)[-1]
@@ -59,14 +82,11 @@ def create_api_tools_bp(media_dir: str | None = None):
         if not user_can_access_room(username, room_id):
             return jsonify({"success": False, "message": "Access denied"}), 403
         filtered = db.list_room_messages_for_viewer(room_id, username, limit)
-        for m in filtered:
-            if m.get("created_at"):
-                m["created_at"] = m["created_at"].isoformat()
         return jsonify(
             {
                 "success": True,
                 "room": room_id,
-                "exported_at": datetime.now().isoformat(),
+                "exported_at": datetime.now(UTC),
                 "messages": filtered,
             }
         )
@@ -197,19 +217,42 @@ def create_api_tools_bp(media_dir: str | None = None):
 
     @api_tools_bp.route("/profile/<username>", methods=["GET"])
     def get_profile(username):
-        profile = db.get_user_profile(username)
-        if not profile:
+        etag = cards_etag([username], {})
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        card = db.get_user_cards([username]).get(username)
+        return conditional_json(_profile_payload(username, card), etag)
+
+    @api_tools_bp.route("/profiles", methods=["GET"])
+    def get_profiles_batch():
+        """Profiles, last_seen and online status for ``?usernames=a,b,c`` in one query."""
+        _, err = require_auth_user()
+        if err:
+            return err
+        raw = request.args.get("usernames") or ""
+        names = list(dict.fromkeys(u.strip() for u in raw.split(",") if u.strip()))
+        if not names:
+            return jsonify({"success": True, "profiles": {}})
+        if len(names) > MAX_PROFILE_BATCH:
             return jsonify(
-                {"avatar": DEFAULT_AVATAR, "avatarType": "emoji", "bio": "", "nickname": username}
-            )
-        return jsonify(
-            {
-                "avatar": profile.get("avatar") or DEFAULT_AVATAR,
-                "avatarType": profile.get("avatar_type") or "emoji",
-                "bio": profile.get("bio") or "",
-                "nickname": profile.get("nickname") or username,
-            }
-        )
+                {"success": False, "message": "Too many usernames"}
+            ), 400
+
+        presence = current_app.extensions.get("nebula_presence")
+        online = presence.online_many(names) if presence else dict.fromkeys(names, False)
+        etag = cards_etag(names, online)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        profiles = {}
+        for un, card in db.get_user_cards(names).items():
+            if card is None:
+                continue
+            item = _profile_payload(un, card)
+            item["last_seen"] = isoformat_utc_z(card.get("last_seen"))
+            item["online"] = online.get(un, False)
+            profiles[un] = item
+        return conditional_json({"success": True, "profiles": profiles}, etag)
 
     @api_tools_bp.route("/profile", methods=["POST"])
     def update_profile():
@@ -228,8 +271,19 @@ def create_api_tools_bp(media_dir: str | None = None):
         avatar_val = data.get("avatar")
         avatar = (avatar_val or "").strip() if avatar_val is not None else ""
 
+        old = db.get_user_profile(username)
+        old_avatar = (old or {}).get("avatar") or ""
+        old_type = ((old or {}).get("avatar_type") or "emoji").strip().lower()
+
         if avatar_type == "image":
-            if not _is_safe_avatar_media_path(avatar):
+            # Файл по хэшу может быть чужим вложением: аватаром — только свой
+            # (или уже стоящий).
+            unchanged = old_type == "image" and avatar == old_avatar
+            if not _is_safe_avatar_media_path(avatar) or (
+                media_object_name(avatar)
+                and not unchanged
+                and not db.media_uploaded_by(avatar, username)
+            ):
                 return jsonify(
                     {"success": False, "message": "Invalid avatar image path"}
                 ), 400
@@ -237,10 +291,6 @@ def create_api_tools_bp(media_dir: str | None = None):
             if len(avatar) > 32:
                 avatar = avatar[:32]
 
-        old = db.get_user_profile(username)
-        old_avatar = (old or {}).get("avatar") or ""
-        old_type = ((old or {}).get("avatar_type") or "emoji").strip().lower()
-
         if db.upsert_user_profile(
             username,
             bio=data.get("bio"),
@@ -259,7 +309,11 @@ def create_api_tools_bp(media_dir: str | None = None):
                     if at not in ("emoji", "image"):
                         at = "emoji"
                     av_out = (prof.get("avatar") or "").strip() or DEFAULT_AVATAR
-                    socketio.emit(
+                    # Только тем, кто видит пользователя в своих чатах, и его устройствам.
+                    emit_to_users(
+                        socketio,
+                        current_app,
+                        [username, *db.list_contact_usernames(username)],
                         "user_profile_updated",
                         {
                             "username": username,
@@ -267,7 +321,6 @@ def create_api_tools_bp(media_dir: str | None = None):
                             "avatarType": at,
                             "nickname": (prof.get("nickname") or "").strip() or username,
                         },
-                        namespace="/",
                     )
             except Exception:
                 current_app.logger.warning(
@@ -12,23 +12,26 @@ from schemas.chat import (
     UpdateScheduledMessageBody,
 )
 from utils.auth_helpers import require_auth_user
+from utils.http_cache import conditional_json, not_modified
 from utils.http_parse import json_body
 from utils.json_helpers import parse_json_field
+from utils.pinned_cache import pinned_etag
+from utils.presence_registry import MemoryPresenceRegistry, PresenceRegistry
 from utils.pydantic_validation import validate_body
 from utils.room_access_db import user_can_access_room
 from utils.room_delivery import clear_room_audience_cache
 
 chat_api_bp = Blueprint("chat_api", __name__, url_prefix="/api")
-_user_connections_ref = {}
+_presence_ref: PresenceRegistry = MemoryPresenceRegistry()
 DEFAULT_USERS_LIMIT = 80
 MAX_USERS_LIMIT = 500
 DEFAULT_AVATAR = ""
 
 
-def bind_user_connections(user_connections):
-    """Wire live presence map from the app factory."""
-    global _user_connections_ref
-    _user_connections_ref = user_connections
+def bind_presence(presence: PresenceRegistry):
+    """Wire the live presence registry from the app factory."""
+    global _presence_ref
+    _presence_ref = presence
 
 
 @chat_api_bp.route("/inbox", methods=["GET"])
@@ -63,14 +66,14 @@ def get_users():
         limit=limit,
     )
 
+    online = _presence_ref.online_many(row["username"] for row in user_rows)
     users_with_status = []
     for row in user_rows:
         un = row["username"]
-        is_online = bool(_user_connections_ref.get(un))
         users_with_status.append(
             {
                 "username": un,
-                "online": is_online,
+                "online": online.get(un, False),
                 "nickname": row.get("nickname"),
                 "avatar": row.get("avatar") or DEFAULT_AVATAR,
                 "avatarType": row.get("avatarType") or "emoji",
@@ -180,8 +183,11 @@ def get_pinned(room_id):
         return err
     if not user_can_access_room(viewer, room_id):
         return jsonify({"success": False, "message": "Access denied"}), 403
+    etag = pinned_etag(room_id)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
     pinned = db.get_pinned_messages(room_id)
-    return jsonify({"pinned": pinned})
+    return conditional_json({"pinned": pinned}, etag)
 
 
 @chat_api_bp.route("/pin", methods=["POST"])
@@ -1,6 +1,4 @@
 import os
-import re
-import uuid
 
 from flask import Blueprint, abort, jsonify, request, send_from_directory
 
@@ -10,10 +8,26 @@ from config import (
     MEDIA_EXT_MAP,
     MEDIA_MIME_BY_EXT,
 )
+from utils import recent_messages
 from utils.auth_helpers import require_auth_user
+from utils.facade_cache import facade_cache
 from utils.http_parse import query_int
+from utils.json_provider import json_backend
+from utils.media import (
+    MediaTooLarge,
+    classify_media_name,
+    iter_file_chunks,
+    media_store_stats,
+    run_media_io,
+    safe_media_ext,
+    write_media_stream,
+)
+from utils.outbound_batch import outbound_batch_stats
 from utils.roles import normalize_user_role
 from utils.room_access_db import user_can_access_room
+from utils.room_delivery import active_room_stats
+from utils.room_events import room_event_stats
+from utils.socket_serializer import socket_serializer_stats
 
 
 def _safe_static_path(static_folder, filename):
@@ -74,8 +88,7 @@ def create_system_bp(
     media_dir,
     max_media_file_size,
     auth_token_store,
-    user_sessions,
-    user_connections,
+    presence,
     message_timestamps,
 ):
     system_bp = Blueprint("system_api", __name__)
@@ -123,28 +136,31 @@ def create_system_bp(
             media_type = "file"
 
         try:
-            ext = os.path.splitext(file.filename)[1] or ".bin"
+            ext = safe_media_ext(os.path.splitext(file.filename)[1])
             mime = file.content_type or "application/octet-stream"
             ext = MEDIA_EXT_MAP.get(mime, ext)
-            filename = f"{uuid.uuid4().hex}{ext}"
-            filepath = os.path.join(media_dir, filename)
-            file.save(filepath)
-            if os.path.getsize(filepath) > max_media_file_size:
-                os.remove(filepath)
-                return jsonify(
-                    {"success": False, "message": "File too large (max 20 MB)"}
-                ), 400
-            app.logger.info(
-                f"Загрузка файла: {uploader} → {filename} ({media_type})"
+            # Копия кусками во временный файл с лимитом на каждом куске.
+            path, size = run_media_io(
+                write_media_stream,
+                iter_file_chunks(file.stream),
+                media_dir,
+                ext,
+                max_media_file_size,
             )
+            db.register_media_object(path, size, uploader)
+            app.logger.info(f"Загрузка файла: {uploader} → {path} ({media_type})")
             return jsonify(
                 {
                     "success": True,
-                    "path": f"/media/{filename}",
+                    "path": path,
                     "type": media_type,
                     "name": file.filename,
                 }
             )
+        except MediaTooLarge:
+            return jsonify(
+                {"success": False, "message": "File too large (max 20 MB)"}
+            ), 400
         except Exception as error:
             app.logger.error(f"Ошибка загрузки файла: {error}", exc_info=True)
             return jsonify({"success": False, "message": "Upload failed"}), 500
@@ -172,47 +188,50 @@ def create_system_bp(
                 }
             ), 400
 
-        raw = file.stream.read(MAX_AVATAR_FILE_SIZE + 1)
-        if len(raw) > MAX_AVATAR_FILE_SIZE:
-            return jsonify(
-                {"success": False, "message": "Image too large (max 2 MB)"}
-            ), 400
-
-        ext = AVATAR_IMAGE_MIMES[mime]
-        safe_user = re.sub(r"[^a-zA-Z0-9_]", "_", uploader)[:32] or "user"
-        filename = f"av_{safe_user}_{uuid.uuid4().hex[:12]}{ext}"
-        filepath = os.path.join(media_dir, filename)
         try:
-            with open(filepath, "wb") as out:
-                out.write(raw)
-            app.logger.info(f"Загрузка аватара: {uploader} → {filename}")
+            path, size = run_media_io(
+                write_media_stream,
+                iter_file_chunks(file.stream),
+                media_dir,
+                AVATAR_IMAGE_MIMES[mime],
+                MAX_AVATAR_FILE_SIZE,
+            )
+            db.register_media_object(path, size, uploader)
+            app.logger.info(f"Загрузка аватара: {uploader} → {path}")
             return jsonify(
                 {
                     "success": True,
-                    "path": f"/media/{filename}",
+                    "path": path,
                     "avatarType": "image",
                 }
             )
+        except MediaTooLarge:
+            return jsonify(
+                {"success": False, "message": "Image too large (max 2 MB)"}
+            ), 400
         except OSError as error:
             app.logger.error(f"Ошибка загрузки аватара: {error}", exc_info=True)
             return jsonify({"success": False, "message": "Upload failed"}), 500
 
-    @system_bp.route("/media/<filename>")
+    @system_bp.route("/media/<path:filename>")
     def serve_media(filename):
-        if not filename or ".." in filename or "/" in filename or "\\" in filename:
+        kind = classify_media_name(filename)
+        if kind is None:
             abort(404)
         ext = os.path.splitext(filename)[1].lower()
         mimetype = MEDIA_MIME_BY_EXT.get(ext)
+        # Имя по хэшу содержимого никогда не укажет на другой файл — кэш навсегда;
+        # старым плоским именам (uuid) — умеренный, как раньше.
         resp = send_from_directory(
             media_dir,
             filename,
             conditional=True,
             mimetype=mimetype,
+            max_age=31536000 if kind == "cas" else 3600,
         )
-        # Медиа может обновляться под тем же именем редко, но обычно уникально (uuid).
-        # Дадим умеренный кэш, чтобы не мешать демонстрации и тестам.
         resp.cache_control.public = True
-        resp.cache_control.max_age = 3600
+        if kind == "cas":
+            _apply_cache_headers(resp, immutable=True)
         return resp
 
     @system_bp.route("/health")
@@ -254,7 +273,54 @@ def create_system_bp(
         if err:
             return err
         role = normalize_user_role(db.get_user_role(username))
-        return jsonify({"success": True, "username": username, "role": role})
+        return jsonify(
+            {
+                "success": True,
+                "username": username,
+                "role": role,
+                "socket_serializers": app.extensions.get(
+                    "nebula_socket_serializers", ["json"]
+                ),
+            }
+        )
+
+    @system_bp.route("/api/admin/cache_stats", methods=["GET"])
+    def cache_stats():
+        """Hit/miss/latency of cached db facade functions (per worker)."""
+        username, err = require_auth_user()
+        if err:
+            return err
+        if db.get_user_role(username) != "admin":
+            return jsonify({"success": False, "message": "Administrators only"}), 403
+        return jsonify(
+            {
+                "success": True,
+                "pid": os.getpid(),
+                **facade_cache.stats(),
+                "single_flight": db.read_flight_stats(),
+                "recent_messages": recent_messages.stats(),
+                "emit_locks": app.extensions["nebula_socketio_emit_lock"].stats(),
+                "socket_write_locks": app.extensions["nebula_socket_write_lock"].stats(),
+                "active_rooms": active_room_stats(),
+                "admission": app.extensions["nebula_admission"].stats(),
+                "room_events": room_event_stats(),
+                "outbound_batch": outbound_batch_stats(),
+                "socket_serializer": socket_serializer_stats(),
+                "json_backend": json_backend(),
+                "uploads": app.extensions["nebula_uploads"].stats(),
+                "media_store": media_store_stats(),
+                "slow_consumers": (
+                    backpressure.stats()
+                    if (backpressure := app.extensions.get("nebula_backpressure"))
+                    else None
+                ),
+                "socket_events": (
+                    dispatcher.stats()
+                    if (dispatcher := app.extensions.get("nebula_socket_dispatcher"))
+                    else None
+                ),
+            }
+        )
 
     @system_bp.route("/api/clear_cache", methods=["POST"])
     def clear_cache():
@@ -265,9 +331,9 @@ def create_system_bp(
             return jsonify({"success": False, "message": "Administrators only"}), 403
 
         auth_token_store.clear_all()
-        user_sessions.clear()
-        user_connections.clear()
+        presence.clear_all()
         message_timestamps.clear()
+        facade_cache.clear()
         app.logger.warning("Кэш сессий и токенов полностью очищен.")
         return jsonify({"success": True, "message": "Cache cleared"})
 
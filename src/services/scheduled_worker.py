@@ -1,26 +1,47 @@
-"""Background delivery of scheduled messages (Socket.IO broadcast)."""
+"""Background delivery of scheduled messages (Socket.IO broadcast).
+
+With several workers every process starts this loop, but only the holder of a
+short Redis lease does the work on each tick; emits reach clients of all
+workers through the Socket.IO message queue.
+"""
 
 import os
+import socket
 import threading
 import time
+import uuid
 
 import db
 from utils.json_helpers import parse_json_field
+from utils.media import (
+    MEDIA_ORPHAN_GRACE_SEC,
+    collect_orphan_media,
+    sweep_media_staging,
+)
 from utils.message_payload import serialize_saved_message
-from utils.room_delivery import ensure_online_members_in_room
+from utils.room_delivery import emit_inbox_update
+from utils.room_events import publish_room_event
 
 
 def _emit_saved_message(socketio, app, saved_msg, sender_username):
     room = saved_msg["room_id"]
-    ensure_online_members_in_room(socketio, app, room)
     message_to_send = serialize_saved_message(
         saved_msg,
         read_by_username=sender_username,
         get_message_by_id=db.get_message_by_id,
     )
 
-    socketio.emit(
-        "receive_message", message_to_send, room=room, namespace="/"
+    publish_room_event(room, "receive_message", message_to_send)
+    emit_inbox_update(
+        socketio,
+        room,
+        {
+            "message_id": saved_msg["message_id"],
+            "username": sender_username,
+            "created_at": message_to_send.get("timestamp"),
+            "preview": db.inbox_preview_from_row(saved_msg),
+            "unread": 1,
+        },
     )
 
 
@@ -78,10 +99,48 @@ def _process_one_scheduled(app, socketio, row):
     saved_msg = db.get_message_by_id(message_id)
     if not saved_msg:
         return
+    db.remember_recent_message(saved_msg)
     _emit_saved_message(socketio, app, saved_msg, username)
     db.mark_scheduled_sent(sched_id, message_id)
 
 
+LEADER_KEY = "nebula:scheduled_worker:leader"
+# Файлы без ссылок (см. utils.media.collect_orphan_media) — раз в час, лидером.
+MEDIA_GC_INTERVAL_SEC = 3600
+
+
+def _build_leader_check(app, lease_sec):
+    """Return ``is_leader()``; without Redis (one process) always leader."""
+    redis_url = app.config.get("REDIS_URL")
+    if not redis_url:
+        return lambda: True
+    try:
+        import redis
+
+        client = redis.from_url(redis_url)
+    except Exception as exc:
+        app.logger.warning("Redis для воркера отложенных сообщений недоступен: %s", exc)
+        return lambda: True
+
+    token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}".encode()
+
+    def is_leader():
+        try:
+            if client.set(LEADER_KEY, token, nx=True, ex=lease_sec):
+                return True
+            if client.get(LEADER_KEY) == token:
+                client.expire(LEADER_KEY, lease_sec)
+                return True
+            return False
+        except Exception as exc:
+            # Обработка идемпотентна (message_id = msg_scheduled_<id>), поэтому при
+            # недоступном Redis лучше сделать работу дважды, чем не сделать вовсе.
+            app.logger.warning("Не удалось проверить лидерство воркера: %s", exc)
+            return True
+
+    return is_leader
+
+
 def start_scheduled_worker(app, socketio, interval_sec=12):
     """Run periodic checks in a daemon thread."""
 
@@ -91,27 +150,37 @@ def start_scheduled_worker(app, socketio, interval_sec=12):
     if app.debug and os.environ.get("WERKZEUG_RUN_MAIN") != "true":
         return
 
+    is_leader = _build_leader_check(app, lease_sec=max(30, interval_sec * 3))
+
+    media_root = app.extensions.get("nebula_media_root")
+    uploads = app.extensions.get("nebula_uploads")
+
     def loop():
         first = True
+        next_media_gc = 0.0
         while True:
             try:
                 if not first:
                     time.sleep(interval_sec)
                 first = False
+                # Сессии загрузок — в памяти своего процесса: чистит каждый воркер.
+                if uploads is not None:
+                    uploads.sweep()
+                if not is_leader():
+                    continue
                 with app.app_context():
                     removed = db.cleanup_expired_messages()
                     for row in removed:
                         rid = row.get("room_id")
-                        if rid:
-                            ensure_online_members_in_room(socketio, app, rid)
-                        socketio.emit(
+                        if not rid:
+                            continue
+                        publish_room_event(
+                            rid,
                             "message_deleted",
-                            {
-                                "message_id": row["message_id"],
-                                "room": rid,
-                            },
-                            room=rid,
-                            namespace="/",
+                            {"message_id": row["message_id"], "room": rid},
+                        )
+                        emit_inbox_update(
+                            socketio, rid, {"message_id": row["message_id"], "deleted": True}
                         )
                     rows = db.fetch_due_scheduled(25)
                     for row in rows:
@@ -121,6 +190,20 @@ def start_scheduled_worker(app, socketio, interval_sec=12):
                             app.logger.error(
                                 "Ошибка воркера отложенных сообщений: %s", exc, exc_info=True
                             )
+                    if media_root and time.monotonic() >= next_media_gc:
+                        next_media_gc = time.monotonic() + MEDIA_GC_INTERVAL_SEC
+                        db.release_dangling_media_refs()
+                        removed_media = collect_orphan_media(
+                            media_root,
+                            app.logger,
+                            db.list_orphan_media(MEDIA_ORPHAN_GRACE_SEC),
+                            db.delete_orphan_media_object,
+                        )
+                        sweep_media_staging(media_root, app.logger)
+                        if removed_media:
+                            app.logger.info(
+                                "Удалено неиспользуемых медиафайлов: %s", removed_media
+                            )
             except Exception as exc:
                 app.logger.error("Цикл воркера отложенных сообщений: %s", exc, exc_info=True)
 
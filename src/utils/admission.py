@@ -0,0 +1,80 @@
+"""Admission control for socket connections after restarts (token buckets).
+
+После рестарта все клиенты переподключаются одновременно. Два ведра на
+процесс сглаживают волну: ``connect`` — любые рукопожатия, ``bootstrap`` —
+полные подключения без билета возобновления (они ходят в MySQL). Клиент
+сверх лимита получает отказ с ``retry_after`` — окном, за которое ведро
+пропустит всех, кому уже отказали (очередь ``backlog`` убывает со скоростью
+ведра). Клиент выбирает момент повтора равномерно внутри окна (full jitter),
+поэтому повторная волна растягивается на всё окно, а не приходит разом.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+
+MAX_RETRY_AFTER_SEC = 30.0
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, burst: float) -> None:
+        self.rate = max(0.001, float(rate_per_sec))
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        # Сколько отказанных клиентов ещё должны вернуться (оценка).
+        self._backlog = 0.0
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> float:
+        """Взять жетон; вернуть 0 или за сколько секунд ведро разберёт очередь отказов."""
+        with self._lock:
+            now = time.monotonic()
+            refill = (now - self._updated) * self.rate
+            self._tokens = min(self.burst, self._tokens + refill)
+            self._backlog = max(0.0, self._backlog - refill)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.admitted += 1
+                return 0.0
+            self.rejected += 1
+            self._backlog += 1
+            return max(1 - self._tokens, self._backlog) / self.rate
+
+    def stats(self) -> dict[str, float | int]:
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": round(self._tokens, 2),
+                "backlog": round(self._backlog, 2),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+
+def retry_after_window(wait: float) -> float:
+    """Окно повтора для клиента: момент внутри него он выбирает сам, случайно."""
+    return round(min(MAX_RETRY_AFTER_SEC, max(1.0, wait)), 2)
+
+
+class AdmissionControl:
+    def __init__(self, connect_rate: float, bootstrap_rate: float) -> None:
+        self.connect = TokenBucket(connect_rate, connect_rate * 2)
+        self.bootstrap = TokenBucket(bootstrap_rate, bootstrap_rate * 2)
+
+    def admit_connect(self) -> float | None:
+        """``None`` — пропустить, иначе ``retry_after`` в секундах."""
+        wait = self.connect.try_acquire()
+        return retry_after_window(wait) if wait else None
+
+    def admit_bootstrap(self) -> float | None:
+        wait = self.bootstrap.try_acquire()
+        return retry_after_window(wait) if wait else None
+
+    def stats(self) -> dict[str, dict[str, float | int]]:
+        return {"connect": self.connect.stats(), "bootstrap": self.bootstrap.stats()}
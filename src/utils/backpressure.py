@@ -0,0 +1,260 @@
+"""Ограничение исходящей очереди медленных клиентов (backpressure).
+
+Engine.IO складывает пакеты каждого соединения в неограниченную очередь: клиент
+на плохой мобильной связи или зависший long-polling копит там тысячи событий и
+держит память, пока остальные участники комнаты давно всё получили. Перед
+отправкой каждого пакета смотрим глубину очереди получателя:
+
+* ``EPHEMERAL_DEPTH`` — отбрасываем эфемерное (набор текста, присутствие);
+* ``STATE_DEPTH`` — отбрасываем и восстановимые состояния (реакции, прочтения,
+  пачки, ``inbox_update``); когда очередь рассосётся, клиенту уходит
+  ``resync_required`` — он перечитывает открытый чат целиком;
+* ``DISCONNECT_DEPTH`` — очередь сбрасывается, соединение закрывается; после
+  переподключения первая синхронизация комнаты будет полной.
+
+Сообщения, правки и удаления до последнего порога не отбрасываются.
+
+Публичного API для этого в python-socketio нет: ограничитель встаёт на
+``Server._send_eio_packet`` (через него идёт вся рассылка менеджера) и читает
+``queue`` сокетов Engine.IO. Оба места проверяются при установке — без них
+ограничитель не ставится. ``install_socket_serializer`` должен стоять раньше
+(он сам проверяет порядок): тогда здесь виден текст JSON-кадра и имя события
+известно для любого получателя.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from typing import Any
+
+EPHEMERAL_DEPTH = 64
+STATE_DEPTH = 256
+DISCONNECT_DEPTH = 1024
+
+EPHEMERAL_EVENTS = frozenset(
+    {"user_typing", "user_stop_typing", "presence_batch", "user_status_changed"}
+)
+STATE_EVENTS = frozenset(
+    {
+        "batch",
+        "reaction_updated",
+        "message_read",
+        "message_read_batch",
+        "inbox_update",
+        "user_profile_updated",
+    }
+)
+
+# 2["event", ...] или 2/ns,["event", ...] (с id подтверждения между ними).
+_EVENT_RE = re.compile(r'^2(?:/[^,]*,)?\d*\["([^"]+)"')
+
+# Как часто проверять отставших, которым давно ничего не отправлялось.
+RECOVERY_CHECK_SEC = 5.0
+
+_installed: OutboundBackpressure | None = None
+
+
+def _event_name(data: Any) -> str | None:
+    if not isinstance(data, str):
+        return None
+    match = _EVENT_RE.match(data[:128])
+    return match.group(1) if match else None
+
+
+class OutboundBackpressure:
+    def __init__(self, srv: Any, logger: Any = None) -> None:
+        self._srv = srv
+        self._logger = logger
+        self._lock = threading.Lock()
+        # eio_sid -> {"dropped", "max_depth"}
+        self._per_sid: dict[str, dict[str, int]] = {}
+        self._lagging: set[str] = set()
+        self._closing: set[str] = set()
+        # Socket.IO sid, закрытые из-за переполнения (их билет помечается устаревшим).
+        self._forced_sids: set[str] = set()
+        self.dropped_ephemeral = 0
+        self.dropped_state = 0
+        self.resync_hints = 0
+        self.disconnects = 0
+
+    def depth(self, eio_sid: str) -> int:
+        return _queue_depth(self._srv.eio.sockets.get(eio_sid))
+
+    def admit(self, eio_sid: str, data: Any) -> bool:
+        """Решить, ставить ли пакет в очередь соединения ``eio_sid``."""
+        depth = self.depth(eio_sid)
+        if depth < EPHEMERAL_DEPTH:
+            if eio_sid in self._lagging and depth < EPHEMERAL_DEPTH // 2:
+                self._recovered(eio_sid)
+            return True
+        event = _event_name(data)
+        with self._lock:
+            st = self._per_sid.setdefault(eio_sid, {"dropped": 0, "max_depth": 0})
+            st["max_depth"] = max(st["max_depth"], depth)
+            if depth >= DISCONNECT_DEPTH:
+                st["dropped"] += 1
+                start_close = eio_sid not in self._closing
+                self._closing.add(eio_sid)
+            elif event in EPHEMERAL_EVENTS:
+                st["dropped"] += 1
+                self.dropped_ephemeral += 1
+                return False
+            elif depth >= STATE_DEPTH and event in STATE_EVENTS:
+                st["dropped"] += 1
+                self.dropped_state += 1
+                self._lagging.add(eio_sid)
+                return False
+            else:
+                return True
+        if start_close:
+            self._srv.start_background_task(self._force_close, eio_sid, depth)
+        return False
+
+    def sweep_lagging(self) -> int:
+        """Подсказать ``resync_required`` отставшим, чья очередь уже рассосалась.
+
+        В ``admit`` это происходит на следующем пакете получателю, но в тихой
+        комнате следующего пакета можно ждать долго — поэтому то же самое
+        делают :meth:`stats` и фоновая проверка раз в ``RECOVERY_CHECK_SEC``.
+        """
+        sockets = self._srv.eio.sockets
+        with self._lock:
+            self._lagging &= set(sockets)
+            lagging = list(self._lagging)
+        recovered = 0
+        for eio_sid in lagging:
+            if _queue_depth(sockets.get(eio_sid)) < EPHEMERAL_DEPTH // 2:
+                recovered += self._recovered(eio_sid)
+        return recovered
+
+    def _recovered(self, eio_sid: str) -> bool:
+        with self._lock:
+            if eio_sid not in self._lagging:
+                return False
+            self._lagging.discard(eio_sid)
+            self.resync_hints += 1
+        try:
+            sid = self._srv.manager.sid_from_eio_sid(eio_sid, "/")
+        except Exception:
+            sid = None
+        if sid is None:
+            return False
+        # Получатель в этом процессе: через очередь сообщений не гоняем.
+        self._srv.emit(
+            "resync_required", {"reason": "slow_consumer"}, to=sid, ignore_queue=True
+        )
+        return True
+
+    def _recovery_loop(self) -> None:
+        while True:
+            self._srv.sleep(RECOVERY_CHECK_SEC)
+            try:
+                self.sweep_lagging()
+            except Exception as exc:
+                if self._logger is not None:
+                    self._logger.warning("Проверка медленных клиентов не удалась: %s", exc)
+
+    def _force_close(self, eio_sid: str, depth: int) -> None:
+        sock = self._srv.eio.sockets.get(eio_sid)
+        try:
+            sid = self._srv.manager.sid_from_eio_sid(eio_sid, "/")
+        except Exception:
+            sid = None
+        with self._lock:
+            self.disconnects += 1
+            self._lagging.discard(eio_sid)
+            if sid:
+                self._forced_sids.add(sid)
+        if self._logger is not None:
+            self._logger.warning(
+                "Медленный клиент %s: очередь %s пакетов, соединение закрыто", eio_sid, depth
+            )
+        if sock is None:
+            return
+        # Копить уже нечего: клиент переподключится и синхронизируется заново.
+        with sock.queue.mutex:
+            sock.queue.queue.clear()
+        sock.close(wait=False, abort=True)
+        with self._lock:
+            self._closing.discard(eio_sid)
+            self._per_sid.pop(eio_sid, None)
+
+    def pop_forced(self, sid: str) -> bool:
+        with self._lock:
+            if sid in self._forced_sids:
+                self._forced_sids.discard(sid)
+                return True
+            return False
+
+    def stats(self, top: int = 10) -> dict[str, Any]:
+        self.sweep_lagging()
+        sockets = dict(self._srv.eio.sockets)
+        depths = sorted(
+            ((eio_sid, _queue_depth(sock)) for eio_sid, sock in sockets.items()),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        with self._lock:
+            for eio_sid in [s for s in self._per_sid if s not in sockets]:
+                del self._per_sid[eio_sid]
+            self._lagging &= set(sockets)
+            return {
+                "limits": {
+                    "ephemeral": EPHEMERAL_DEPTH,
+                    "state": STATE_DEPTH,
+                    "disconnect": DISCONNECT_DEPTH,
+                },
+                "connections": len(sockets),
+                "lagging": len(self._lagging),
+                "dropped_ephemeral": self.dropped_ephemeral,
+                "dropped_state": self.dropped_state,
+                "resync_hints": self.resync_hints,
+                "disconnects": self.disconnects,
+                "deepest": [
+                    {"sid": eio_sid, "depth": depth, **self._per_sid.get(eio_sid, {})}
+                    for eio_sid, depth in depths[:top]
+                    if depth
+                ],
+            }
+
+
+def _queue_depth(sock: Any) -> int:
+    queue = getattr(sock, "queue", None)
+    return queue.qsize() if queue is not None else 0
+
+
+def backpressure_installed(srv: Any) -> bool:
+    return _installed is not None and _installed._srv is srv
+
+
+def install_backpressure(socketio: Any, logger: Any = None) -> OutboundBackpressure | None:
+    """Пропускать исходящие пакеты сервера Socket.IO через ``OutboundBackpressure``.
+
+    ``None`` — у этой версии python-socketio нет нужных внутренностей
+    (см. описание модуля): сервер работает без ограничителя.
+    """
+    global _installed
+    srv = socketio.server
+    send_eio_packet = getattr(srv, "_send_eio_packet", None)
+    if not callable(send_eio_packet) or not isinstance(
+        getattr(srv.eio, "sockets", None), dict
+    ):
+        if logger is not None:
+            logger.warning("Ограничение очереди медленных клиентов недоступно в этой версии python-socketio")
+        return None
+    guard = OutboundBackpressure(srv, logger)
+
+    def _send_eio_packet(eio_sid, eio_pkt):
+        if guard.admit(eio_sid, eio_pkt.data):
+            send_eio_packet(eio_sid, eio_pkt)
+
+    srv._send_eio_packet = _send_eio_packet
+    _installed = guard
+    srv.start_background_task(guard._recovery_loop)
+    return guard
+
+
+def pop_forced_disconnect(sid: str) -> bool:
+    """Соединение ``sid`` закрыто из-за переполнения очереди (флаг снимается)."""
+    return _installed.pop_forced(sid) if _installed is not None else False
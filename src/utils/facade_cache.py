@@ -0,0 +1,541 @@
+"""Двухуровневый кэш для функций фасада ``db``.
+
+Первый уровень — LRU в памяти процесса с TTL, второй — Redis (если задан
+``REDIS_URL``), общий для всех воркеров. Подключается декоратором::
+
+    @facade_cache.cached(ttl=60, tags=lambda room_id: [f"room:{room_id}"])
+    def get_room_row(room_id): ...
+
+Возможности:
+
+* теги (``room:<id>``, ``user:<name>``) — ``invalidate_tags`` сбрасывает все
+  записи с тегом локально, в Redis и (через pub/sub) в остальных процессах;
+* склейка одновременных промахов по одному ключу (``SingleFlight``);
+* stale-while-revalidate: в течение ``stale_ttl`` после истечения TTL
+  отдаётся старое значение, а обновление идёт в фоне;
+* ограничение числа записей и метрики hit/miss/latency по функциям
+  (``stats()``, см. ``/api/admin/cache_stats``).
+
+Значения из кэша общие для всех вызывающих — менять их на месте нельзя.
+``None`` не кэшируется: репозитории возвращают его и при ошибке БД.
+
+В Redis значения лежат в JSON (``json_default`` из ``utils.json_provider``),
+а не в pickle: содержимое общего Redis не исполняется при чтении. ``datetime``
+кодируется отдельным объектом и читается обратно как ``datetime`` (наивный
+остаётся наивным), кортежи возвращаются списками.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterable, Mapping
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any
+
+from utils.json_provider import json_default
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "nebula:fc:"
+INVALIDATION_CHANNEL = f"{KEY_PREFIX}invalidate"
+FACADE_CACHE_MAX_ENTRIES = 20000
+REDIS_RETRY_DELAY_SEC = 5
+
+_PROCESS_ID = uuid.uuid4().hex
+_MISSING = object()
+_DATETIME_KEY = "$datetime"
+
+
+def _encode_default(obj: Any) -> Any:
+    if isinstance(obj, datetime):
+        return {_DATETIME_KEY: obj.isoformat()}
+    return json_default(obj)
+
+
+def _decode_object(obj: dict[str, Any]) -> Any:
+    if len(obj) == 1 and _DATETIME_KEY in obj:
+        return datetime.fromisoformat(obj[_DATETIME_KEY])
+    return obj
+
+
+@dataclass
+class _Entry:
+    value: Any
+    stored_at: float
+    ttl: float
+    stale_ttl: float
+    tags: tuple[str, ...]
+
+    def age(self, now: float) -> float:
+        return now - self.stored_at
+
+
+@dataclass
+class FunctionStats:
+    hits: int = 0
+    redis_hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    loads: int = 0
+    load_errors: int = 0
+    load_time_total_ms: float = 0.0
+    load_time_max_ms: float = 0.0
+
+    def record_load(self, elapsed_sec: float, ok: bool) -> None:
+        ms = elapsed_sec * 1000.0
+        self.loads += 1
+        if not ok:
+            self.load_errors += 1
+        self.load_time_total_ms += ms
+        self.load_time_max_ms = max(self.load_time_max_ms, ms)
+
+    def as_dict(self) -> dict[str, Any]:
+        out: dict[str, Any] = asdict(self)
+        lookups = self.hits + self.redis_hits + self.stale_hits + self.misses
+        out["hit_ratio"] = (
+            round((lookups - self.misses) / lookups, 4) if lookups else None
+        )
+        out["load_time_avg_ms"] = (
+            round(self.load_time_total_ms / self.loads, 3) if self.loads else None
+        )
+        out["load_time_total_ms"] = round(self.load_time_total_ms, 3)
+        out["load_time_max_ms"] = round(self.load_time_max_ms, 3)
+        return out
+
+
+class FacadeCache:
+    def __init__(self, max_entries: int = FACADE_CACHE_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._tag_index: dict[str, set[str]] = {}
+        self._tag_generation: dict[str, int] = {}
+        self._flight = SingleFlight()
+        self._stats: dict[str, FunctionStats] = {}
+        self._ttl_hint: dict[str, tuple[float, float]] = {}
+        self._redis: Any = None
+        self._subscriber: threading.Thread | None = None
+        self._listeners: list[Callable[[list[str] | None], None]] = []
+
+    # --- Redis -----------------------------------------------------------
+
+    def configure_redis(self, redis_url: str | None, app_logger=None) -> bool:
+        """Включить второй уровень и межпроцессную инвалидацию."""
+        log = app_logger or logger
+        if not redis_url:
+            return False
+        try:
+            import redis
+
+            client = redis.from_url(redis_url)
+            client.ping()
+        except Exception as e:
+            log.warning("Redis для кэша фасада БД недоступен, только память: %s", e)
+            return False
+        self._redis = client
+        if self._subscriber is None:
+            self._subscriber = threading.Thread(
+                target=self._listen_invalidations,
+                name="facade-cache-invalidation",
+                daemon=True,
+            )
+            self._subscriber.start()
+        return True
+
+    def _listen_invalidations(self) -> None:
+        while True:
+            client = self._redis
+            if client is None:
+                return
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                for message in pubsub.listen():
+                    self._apply_remote_invalidation(message.get("data"))
+            except Exception as e:
+                logger.warning("Подписка на инвалидацию кэша прервана: %s", e)
+                time.sleep(REDIS_RETRY_DELAY_SEC)
+
+    def _apply_remote_invalidation(self, raw: Any) -> None:
+        try:
+            payload = json.loads(raw)
+        except (TypeError, ValueError):
+            return
+        if not isinstance(payload, dict) or payload.get("origin") == _PROCESS_ID:
+            return
+        if payload.get("clear"):
+            self._clear_local()
+            return
+        tags = payload.get("tags")
+        if isinstance(tags, list):
+            self._invalidate_local([t for t in tags if isinstance(t, str)])
+
+    def _redis_get(self, key: str) -> tuple[Any, float, tuple[str, ...]] | None:
+        if self._redis is None:
+            return None
+        try:
+            raw = self._redis.get(KEY_PREFIX + key)
+            if raw is None:
+                return None
+            value, stored_wall, tags = json.loads(raw, object_hook=_decode_object)
+            return value, stored_wall, tuple(tags)
+        except Exception as e:
+            logger.warning("Чтение кэша фасада из Redis не удалось: %s", e)
+            return None
+
+    def _redis_set(self, key: str, entry: _Entry) -> None:
+        if self._redis is None:
+            return
+        expire = max(1, int(entry.ttl + entry.stale_ttl))
+        try:
+            raw = json.dumps(
+                [entry.value, time.time(), list(entry.tags)],
+                default=_encode_default,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.set(KEY_PREFIX + key, raw, ex=expire)
+            for tag in entry.tags:
+                tag_key = f"{KEY_PREFIX}tag:{tag}"
+                pipe.sadd(tag_key, key)
+                pipe.expire(tag_key, expire)
+            pipe.execute()
+        except Exception as e:
+            logger.warning("Запись кэша фасада в Redis не удалась: %s", e)
+
+    def _redis_invalidate(self, tags: list[str]) -> None:
+        if self._redis is None:
+            return
+        try:
+            for tag in tags:
+                tag_key = f"{KEY_PREFIX}tag:{tag}"
+                keys = [KEY_PREFIX + k.decode() for k in self._redis.smembers(tag_key)]
+                self._redis.delete(tag_key, *keys)
+            self._redis.publish(
+                INVALIDATION_CHANNEL,
+                json.dumps({"origin": _PROCESS_ID, "tags": tags}),
+            )
+        except Exception as e:
+            logger.warning("Инвалидация кэша фасада в Redis не удалась: %s", e)
+
+    # --- локальный уровень -----------------------------------------------
+
+    def _stats_for(self, name: str) -> FunctionStats:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats.setdefault(name, FunctionStats())
+        return stats
+
+    def _generation(self, tags: tuple[str, ...]) -> tuple[int, ...]:
+        return tuple(self._tag_generation.get(t, 0) for t in tags)
+
+    def _store_locked(self, key: str, entry: _Entry) -> None:
+        self._drop_locked(key)
+        self._entries[key] = entry
+        for tag in entry.tags:
+            self._tag_index.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._drop_locked(oldest)
+
+    def _drop_locked(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+
+    def _invalidate_local(self, tags: list[str]) -> None:
+        with self._lock:
+            for tag in tags:
+                self._tag_generation[tag] = self._tag_generation.get(tag, 0) + 1
+                for key in list(self._tag_index.get(tag, ())):
+                    self._drop_locked(key)
+        self._notify(tags)
+
+    def _notify(self, tags: list[str] | None) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(tags)
+            except Exception:
+                logger.warning("Слушатель инвалидации кэша упал", exc_info=True)
+
+    def _clear_local(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tag_index.clear()
+            for tag in list(self._tag_generation):
+                self._tag_generation[tag] += 1
+        self._notify(None)
+
+    def _lookup(self, name: str, key: str) -> tuple[Any, bool]:
+        """(значение, устарело ли) или (_MISSING, False)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = entry.age(now)
+                if age < entry.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats_for(name).hits += 1
+                    return entry.value, False
+                if age < entry.ttl + entry.stale_ttl:
+                    self._stats_for(name).stale_hits += 1
+                    return entry.value, True
+                self._drop_locked(key)
+
+        remote = self._redis_get(key)
+        if remote is None:
+            return _MISSING, False
+        value, stored_wall, tags = remote
+        age = max(0.0, time.time() - stored_wall)
+        with self._lock:
+            ttl, stale_ttl = self._ttl_hint.get(name, (0.0, 0.0))
+            if age >= ttl + stale_ttl:
+                return _MISSING, False
+            self._store_locked(key, _Entry(value, now - age, ttl, stale_ttl, tags))
+            if age < ttl:
+                self._stats_for(name).redis_hits += 1
+                return value, False
+            self._stats_for(name).stale_hits += 1
+            return value, True
+
+    def _load(
+        self,
+        name: str,
+        key: str,
+        tags: tuple[str, ...],
+        ttl: float,
+        stale_ttl: float,
+        loader: Callable[[], Any],
+    ) -> Any:
+        """Загрузить значение; одновременные промахи по ключу ждут один вызов."""
+        with self._lock:
+            generation = self._generation(tags)
+
+        def load_and_store() -> Any:
+            started = time.monotonic()
+            try:
+                value = loader()
+            except BaseException:
+                with self._lock:
+                    self._stats_for(name).record_load(time.monotonic() - started, False)
+                raise
+            entry = None
+            with self._lock:
+                self._stats_for(name).record_load(time.monotonic() - started, True)
+                # Пока шла загрузка, тег сбросили — старое значение не кэшируем.
+                if value is not None and self._generation(tags) == generation:
+                    entry = _Entry(value, started, ttl, stale_ttl, tags)
+                    self._store_locked(key, entry)
+            if entry is not None:
+                self._redis_set(key, entry)
+            return value
+
+        # Загрузку, начатую до инвалидации тега, не ждём: токен-поколение другое.
+        value, shared = self._flight.do(key, load_and_store, token=generation)
+        if shared:
+            with self._lock:
+                self._stats_for(name).coalesced += 1
+        return value
+
+    def _refresh_in_background(self, *args: Any) -> None:
+        def run() -> None:
+            try:
+                self._load(*args)
+            except Exception:
+                logger.warning("Фоновое обновление кэша фасада не удалось", exc_info=True)
+
+        threading.Thread(target=run, name="facade-cache-refresh", daemon=True).start()
+
+    # --- публичный API ---------------------------------------------------
+
+    @staticmethod
+    def _make_key(name: str, args: tuple, kwargs: Mapping[str, Any]) -> str:
+        if kwargs:
+            return f"{name}:{args!r}:{sorted(kwargs.items())!r}"
+        return f"{name}:{args!r}"
+
+    def cached(
+        self,
+        *,
+        ttl: float,
+        stale_ttl: float = 0.0,
+        tags: Callable[..., Iterable[str]] | None = None,
+        name: str | None = None,
+    ) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """Кэшировать функцию целиком; ключ — имя функции и ``repr`` аргументов."""
+
+        def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+            fname = name or fn.__name__
+            self._ttl_hint[fname] = (float(ttl), float(stale_ttl))
+
+            @functools.wraps(fn)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                key = self._make_key(fname, args, kwargs)
+                value, stale = self._lookup(fname, key)
+                if value is not _MISSING:
+                    if stale and not self._flight.in_flight(key):
+                        self._refresh_in_background(
+                            fname,
+                            key,
+                            tuple(tags(*args, **kwargs)) if tags else (),
+                            ttl,
+                            stale_ttl,
+                            functools.partial(fn, *args, **kwargs),
+                        )
+                    return value
+                with self._lock:
+                    self._stats_for(fname).misses += 1
+                return self._load(
+                    fname,
+                    key,
+                    tuple(tags(*args, **kwargs)) if tags else (),
+                    ttl,
+                    stale_ttl,
+                    functools.partial(fn, *args, **kwargs),
+                )
+
+            wrapper.uncached = fn  # type: ignore[attr-defined]
+            return wrapper
+
+        return decorator
+
+    def cached_batch(
+        self,
+        *,
+        ttl: float,
+        tags: Callable[[Any], Iterable[str]] | None = None,
+        name: str | None = None,
+    ) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """Кэш для функций вида ``fn(ids) -> {id: row}`` с отдельной записью на id.
+
+        Промахи догружаются одним вызовом ``fn``; отсутствующие id не кэшируются.
+        """
+
+        def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+            fname = name or fn.__name__
+            self._ttl_hint[fname] = (float(ttl), 0.0)
+
+            @functools.wraps(fn)
+            def wrapper(ids: Iterable[Hashable]) -> dict[Any, Any]:
+                unique = list(dict.fromkeys(i for i in ids if i))
+                out: dict[Any, Any] = {}
+                missing = []
+                for item in unique:
+                    value, stale = self._lookup(fname, f"{fname}:{item!r}")
+                    if value is _MISSING or stale:
+                        missing.append(item)
+                    else:
+                        out[item] = value
+                if not missing:
+                    return out
+
+                item_tags = {i: tuple(tags(i)) if tags else () for i in missing}
+                with self._lock:
+                    self._stats_for(fname).misses += len(missing)
+                    generations = {i: self._generation(item_tags[i]) for i in missing}
+                started = time.monotonic()
+                try:
+                    loaded = fn(missing) or {}
+                except BaseException:
+                    with self._lock:
+                        self._stats_for(fname).record_load(
+                            time.monotonic() - started, False
+                        )
+                    raise
+                stored = []
+                with self._lock:
+                    self._stats_for(fname).record_load(time.monotonic() - started, True)
+                    for item in missing:
+                        value = loaded.get(item)
+                        if value is None:
+                            continue
+                        out[item] = value
+                        if self._generation(item_tags[item]) != generations[item]:
+                            continue
+                        entry = _Entry(value, started, ttl, 0.0, item_tags[item])
+                        self._store_locked(f"{fname}:{item!r}", entry)
+                        stored.append((f"{fname}:{item!r}", entry))
+                for key, entry in stored:
+                    self._redis_set(key, entry)
+                return out
+
+            wrapper.uncached = fn  # type: ignore[attr-defined]
+            return wrapper
+
+        return decorator
+
+    def invalidate_tags(self, *tags: str, local: bool = True) -> None:
+        """Сбросить записи с любым из тегов во всех процессах.
+
+        ``local=False`` — только в остальных процессах: свою копию вызывающий
+        уже обновил сам (см. ``utils.recent_messages``).
+        """
+        tag_list = [t for t in dict.fromkeys(tags) if t]
+        if not tag_list:
+            return
+        if local:
+            self._invalidate_local(tag_list)
+        self._redis_invalidate(tag_list)
+
+    def add_invalidation_listener(
+        self, listener: Callable[[list[str] | None], None]
+    ) -> None:
+        """Подписать внешний кэш на инвалидацию тегов (``None`` — сброс всего)."""
+        self._listeners.append(listener)
+
+    def clear(self) -> None:
+        self._clear_local()
+        if self._redis is None:
+            return
+        try:
+            batch: list[bytes] = []
+            for key in self._redis.scan_iter(match=f"{KEY_PREFIX}*", count=500):
+                batch.append(key)
+                if len(batch) >= 500:
+                    self._redis.delete(*batch)
+                    batch.clear()
+            if batch:
+                self._redis.delete(*batch)
+            self._redis.publish(
+                INVALIDATION_CHANNEL, json.dumps({"origin": _PROCESS_ID, "clear": True})
+            )
+        except Exception as e:
+            logger.warning("Очистка кэша фасада в Redis не удалась: %s", e)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "tags": len(self._tag_index),
+                "redis": self._redis is not None,
+                "functions": {
+                    name: stats.as_dict() for name, stats in sorted(self._stats.items())
+                },
+            }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+facade_cache = FacadeCache()
+cached = facade_cache.cached
+cached_batch = facade_cache.cached_batch
+invalidate_tags = facade_cache.invalidate_tags
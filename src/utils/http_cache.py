@@ -0,0 +1,19 @@
+"""Conditional JSON responses (weak ETag + 304) for cached API reads."""
+
+from flask import current_app, jsonify
+
+
+def _revalidate_headers(resp, etag: str):
+    resp.set_etag(etag, weak=True)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
+
+
+def conditional_json(payload: dict, etag: str):
+    """JSON с ETag; клиент обязан перепроверять (no-cache), но получает 304."""
+    return _revalidate_headers(jsonify(payload), etag)
+
+
+def not_modified(etag: str):
+    return _revalidate_headers(current_app.response_class(status=304), etag)
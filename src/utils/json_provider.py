@@ -0,0 +1,111 @@
+"""JSON для Flask (``app.json``) и Socket.IO: orjson, если установлен, иначе stdlib.
+
+``datetime`` кодируются сразу в ISO-8601 UTC с ``Z`` — так же, как
+``isoformat_utc_z`` (наивные значения из MySQL считаются UTC), поэтому
+репозиторий может отдавать строки БД с ``datetime`` как есть, без поштучного
+форматирования каждого поля. Без orjson работает тот же ``default`` поверх
+стандартного ``json``.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import decimal
+import json
+import uuid
+from datetime import date, datetime
+from typing import Any, cast
+
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+
+from utils.time_format import isoformat_utc_z
+
+orjson: Any
+try:
+    import orjson as _orjson
+
+    orjson = _orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+_ORJSON_OPTIONS = (
+    orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+    if orjson is not None
+    else 0
+)
+
+
+def json_default(obj: Any) -> Any:
+    """Типы вне JSON: даты, ``Decimal``/``UUID`` — строкой, датаклассы — словарём."""
+    if isinstance(obj, datetime):
+        return isoformat_utc_z(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal | uuid.UUID):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Компактный JSON в UTF-8."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_default, option=_ORJSON_OPTIONS)
+    return json.dumps(
+        obj, default=json_default, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class SocketJSON:
+    """Модуль ``json`` для python-socketio/engineio (нужны только ``dumps``/``loads``).
+
+    Пакеты Socket.IO и так компактны, поэтому ``separators`` и прочие
+    аргументы stdlib для orjson не нужны.
+    """
+
+    @staticmethod
+    def dumps(obj: Any, **kwargs: Any) -> str:
+        if orjson is not None:
+            return orjson.dumps(obj, default=json_default, option=_ORJSON_OPTIONS).decode()
+        kwargs.setdefault("default", json_default)
+        return json.dumps(obj, **kwargs)
+
+    @staticmethod
+    def loads(s: str | bytes, **kwargs: Any) -> Any:
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """``app.json`` с orjson: ``jsonify`` кодирует прямо в байты ответа.
+
+    Ключи не сортируются (клиенту порядок не важен, а сортировка стоит времени
+    на больших ответах вроде экспорта чата). Отступы в debug — через stdlib.
+    """
+
+    default = staticmethod(json_default)
+    sort_keys = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=json_default, option=_ORJSON_OPTIONS).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return SocketJSON.loads(s, **kwargs)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return cast(Response, super().response(*args, **kwargs))
+        obj = self._prepare_response_obj(args, kwargs)
+        response_class: Any = self._app.response_class
+        return response_class(dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+
+
+def json_backend() -> str:
+    return "orjson" if orjson is not None else "json"
@@ -1,25 +1,257 @@
+"""Запись медиа на диск: по содержимому, потоково и с лимитом размера.
+
+Файл называется своим SHA-256 и лежит в ``<media>/<aa>/<bb>/<sha256><ext>``
+(два уровня каталогов — чтобы в одном не копились миллионы файлов). Такой же
+файл, загруженный повторно, на диск второй раз не пишется: временная копия
+удаляется, ссылка указывает на уже лежащий. Имя меняется вместе с
+содержимым, поэтому ``/media`` отдаётся с ``immutable``, а учёт ссылок
+(``repositories/media.py``) позволяет удалять файлы, которые больше никто не
+использует (:func:`collect_orphan_media`).
+
+Файл пишется во временный ``.part`` в соседнем каталоге ``<media>.staging``
+(та же файловая система, но вне ``/media``) и переименовывается только
+целиком — обрыв или превышение лимита не оставляют обрезанных файлов, а
+недописанное не отдаётся наружу. Data-URL
+декодируется кусками. Под gevent (Gunicorn с gevent-websocket) запись уходит
+в нативный пул потоков хаба и не держит цикл событий; без gevent она идёт
+прямо в потоке обработчика — он и так занят только этим запросом.
+
+Учёт в ``media_objects`` — дело вызывающего (``db.register_media_object``):
+этот модуль работает только с файлами.
+"""
+
+from __future__ import annotations
+
 import base64
 import binascii
+import hashlib
 import os
-import uuid
+import re
+import tempfile
+import time
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any, TypeVar
 
 from config import MAX_MEDIA_FILE_SIZE, MEDIA_EXT_MAP
 
+T = TypeVar("T")
+
+# Символов base64 за шаг (кратно 4): 192 КиБ данных.
+DECODE_CHUNK_CHARS = 256 * 1024
+COPY_CHUNK_SIZE = 256 * 1024
+# Файл без ссылок живёт столько после загрузки или последнего освобождения:
+# загруженное вложение ещё может ждать отправки (или отложенного сообщения).
+MEDIA_ORPHAN_GRACE_SEC = 24 * 3600
+# Недописанный ``.part`` без изменений дольше этого — остаток упавшего процесса.
+MEDIA_STAGING_GRACE_SEC = 3600
+MEDIA_STAGING_SUFFIX = ".staging"
+
+_EXT_RE = re.compile(r"^\.[a-z0-9]{1,8}$")
+# Путь внутри каталога медиа: старое плоское имя или ``<aa>/<bb>/<sha256><ext>``.
+_MEDIA_NAME_RE = re.compile(
+    r"^(?:[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]{1,8}|[A-Za-z0-9_.-]+)$"
+)
+_CAS_NAME_RE = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.")
+
+_stats = {"stored": 0, "deduplicated": 0, "collected": 0, "stale_parts": 0}
+
+
+class MediaTooLarge(ValueError):
+    """Файл превысил лимит при записи (временный файл уже удалён)."""
+
+
+def media_staging_dir(media_dir: str) -> str:
+    """Каталог временных файлов рядом с ``media_dir``: ``os.replace`` оттуда атомарен."""
+    return os.path.normpath(media_dir) + MEDIA_STAGING_SUFFIX
+
 
 def ensure_media_dir(media_dir):
     if not os.path.exists(media_dir):
         os.makedirs(media_dir)
+    os.makedirs(media_staging_dir(media_dir), exist_ok=True)
+
+
+def _gevent_threadpool() -> Any:
+    try:
+        from gevent import get_hub, monkey
+    except ImportError:
+        return None
+    if not monkey.is_module_patched("threading"):
+        return None
+    return get_hub().threadpool
+
+
+def run_media_io(fn: Callable[..., T], *args: Any) -> T:
+    """Выполнить ``fn``: под gevent — в пуле потоков хаба, иначе — на месте.
+
+    Без gevent отдельный пул ничего не даёт: поток обработчика всё равно
+    ждал бы результата, а на загрузку уходило бы два потока вместо одного.
+    """
+    pool = _gevent_threadpool()
+    if pool is not None:
+        return pool.apply(fn, args)
+    return fn(*args)
+
+
+def safe_media_ext(ext: str) -> str:
+    """Расширение из имени клиента годится в путь, только если это ``.[a-z0-9]{1,8}``."""
+    ext = (ext or "").lower()
+    return ext if _EXT_RE.match(ext) else ".bin"
+
+
+def media_relpath(digest: str, ext: str = "") -> str:
+    """``<aa>/<bb>/<sha256><ext>`` — путь внутри каталога медиа."""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def commit_media_file(tmp_path: str, media_dir: str, digest: str, ext: str) -> str:
+    """Поставить готовый временный файл на место по хэшу; вернуть ``/media/...``.
+
+    Если такой файл уже есть, временный удаляется, а у существующего
+    обновляется mtime — сборщик мусора не снесёт его из-под новой ссылки.
+    """
+    relpath = media_relpath(digest, ext)
+    target = os.path.join(media_dir, relpath)
+    if os.path.exists(target):
+        os.remove(tmp_path)
+        os.utime(target)
+        _stats["deduplicated"] += 1
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_path, target)
+        _stats["stored"] += 1
+    return f"/media/{relpath}"
+
 
+def write_media_stream(
+    chunks: Iterable[bytes], media_dir: str, ext: str, max_size: int
+) -> tuple[str, int]:
+    """Записать поток кусков в ``media_dir``; вернуть ``/media/...`` и размер.
 
-def save_media_file(media_data, media_dir, logger):
-    """Save media to disk and return `/media/...` path."""
+    Лимит проверяется до записи каждого куска: лишнее на диск не попадает.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=media_staging_dir(media_dir), suffix=".part")
+    written = 0
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in chunks:
+                written += len(chunk)
+                if written > max_size:
+                    raise MediaTooLarge(written)
+                digest.update(chunk)
+                out.write(chunk)
+        path = commit_media_file(tmp_path, media_dir, digest.hexdigest(), ext)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return path, written
+
+
+def collect_orphan_media(
+    media_dir: str,
+    logger: Any,
+    orphans: Iterable[str],
+    forget: Callable[[str], bool],
+    grace_sec: float = MEDIA_ORPHAN_GRACE_SEC,
+) -> int:
+    """Удалить файлы ``orphans``, на которые дольше ``grace_sec`` никто не ссылается.
+
+    ``forget(name)`` снимает объект с учёта и говорит, можно ли стирать файл
+    (``db.delete_orphan_media_object``).
+    """
+    removed = 0
+    for name in orphans:
+        path = os.path.join(media_dir, media_relpath(name))
+        if not forget(name):
+            continue
+        try:
+            # Файл мог только что прийти повторно (commit_media_file обновил mtime).
+            if time.time() - os.path.getmtime(path) < grace_sec:
+                continue
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            logger.warning("Не удалось удалить неиспользуемый медиафайл %s: %s", name, exc)
+    _stats["collected"] += removed
+    return removed
+
+
+def sweep_media_staging(
+    media_dir: str, logger: Any, grace_sec: float = MEDIA_STAGING_GRACE_SEC
+) -> int:
+    """Удалить ``.part``, которые дольше ``grace_sec`` никто не дописывает."""
+    staging = media_staging_dir(media_dir)
+    removed = 0
+    try:
+        entries = list(os.scandir(staging))
+    except FileNotFoundError:
+        return 0
+    deadline = time.time() - grace_sec
+    for entry in entries:
+        if not entry.name.endswith(".part"):
+            continue
+        try:
+            if entry.stat().st_mtime >= deadline:
+                continue
+            os.remove(entry.path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            logger.warning("Не удалось удалить временный файл %s: %s", entry.path, exc)
+    _stats["stale_parts"] += removed
+    return removed
+
+
+def classify_media_name(name: str) -> str | None:
+    """``"cas"``, ``"legacy"`` или ``None``, если так файл из ``/media`` не отдаётся."""
+    if not name or ".." in name or not _MEDIA_NAME_RE.match(name):
+        return None
+    # Скрытые и недописанные файлы (в том числе от старых версий, писавших
+    # ``.part`` прямо в каталог медиа) наружу не отдаются.
+    if name.startswith(".") or name.endswith(".part"):
+        return None
+    return "cas" if _CAS_NAME_RE.match(name) else "legacy"
+
+
+def media_store_stats() -> dict[str, int]:
+    return dict(_stats)
+
+
+def iter_file_chunks(stream: Any, chunk_size: int = COPY_CHUNK_SIZE) -> Iterator[bytes]:
+    while chunk := stream.read(chunk_size):
+        yield chunk
+
+
+def iter_base64_chunks(
+    text: str, start: int, end: int, chunk_chars: int = DECODE_CHUNK_CHARS
+) -> Iterator[bytes]:
+    """Декодировать ``text[start:end]`` по кускам, не копируя строку целиком."""
+    for pos in range(start, end, chunk_chars):
+        yield base64.b64decode(text[pos : min(pos + chunk_chars, end)], validate=True)
+
+
+def save_media_file(media_data, media_dir, logger, on_stored=None):
+    """Save media to disk and return `/media/...` path.
+
+    ``on_stored(path, size)`` is called once the file is in place.
+    """
     if not media_data or not media_data.startswith("data:"):
         return media_data
 
     try:
-        header, data = media_data.split(",", 1)
-        encoded_data = data.strip()
-        estimated_size = (len(encoded_data) * 3) // 4
+        comma = media_data.index(",")
+        header = media_data[:comma]
+        end = len(media_data)
+        while end > comma + 1 and media_data[end - 1].isspace():
+            end -= 1
+        estimated_size = ((end - comma - 1) * 3) // 4
         if estimated_size > MAX_MEDIA_FILE_SIZE + 3:
             logger.error(
                 "Rejected media save: estimated decoded size %s exceeds maximum %s",
@@ -28,14 +260,6 @@ def save_media_file(media_data, media_dir, logger):
             )
             return None
 
-        file_data = base64.b64decode(encoded_data, validate=True)
-        if len(file_data) > MAX_MEDIA_FILE_SIZE:
-            logger.error(
-                "Rejected media save: decoded size %s exceeds maximum %s",
-                len(file_data),
-                MAX_MEDIA_FILE_SIZE,
-            )
-            return None
         mime = (
             header.split(":")[1].split(";")[0]
             if ":" in header
@@ -43,14 +267,24 @@ def save_media_file(media_data, media_dir, logger):
         )
         ext = MEDIA_EXT_MAP.get(mime, ".bin")
 
-        filename = f"{uuid.uuid4().hex}{ext}"
-        filepath = os.path.join(media_dir, filename)
-
-        with open(filepath, "wb") as file_stream:
-            file_stream.write(file_data)
-
-        logger.info("Media file saved: %s (%s bytes)", filename, len(file_data))
-        return f"/media/{filename}"
+        path, size = run_media_io(
+            write_media_stream,
+            iter_base64_chunks(media_data, comma + 1, end),
+            media_dir,
+            ext,
+            MAX_MEDIA_FILE_SIZE,
+        )
+        if on_stored is not None:
+            on_stored(path, size)
+        logger.info("Media file saved: %s", path)
+        return path
+    except MediaTooLarge as exc:
+        logger.error(
+            "Rejected media save: decoded size %s exceeds maximum %s",
+            exc.args[0],
+            MAX_MEDIA_FILE_SIZE,
+        )
+        return None
     except (ValueError, IndexError, binascii.Error) as exc:
         logger.error("Invalid media data URL: %s", exc)
         return None
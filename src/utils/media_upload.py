@@ -0,0 +1,320 @@
+"""Загрузка медиа кусками по Socket.IO: ``upload_start`` → ``upload_chunk``… → ``upload_finish``.
+
+Вместо data-URL в ``send_message`` (base64 целиком в памяти, декодирование в
+обработчике) клиент шлёт бинарные куски до ``chunk_size``: каждый сразу
+дописывается во временный файл в ``<media>.staging``, размер проверяется на
+каждом куске, тип — по сигнатуре первого куска. Готовый файл ставится в
+каталог медиа по SHA-256 (``utils.media``), а сообщение ссылается на него
+по ``upload_id`` (см. :meth:`ChunkedUploads.claim`). В памяти процесса
+одновременно лежит не больше одного куска на загрузку.
+
+Сессии живут в памяти процесса, как и соединение Socket.IO (sticky-сессии):
+загрузка и сообщение со ссылкой на неё приходят в один воркер.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import IO, Any
+
+from config import ALLOWED_MIME_PATTERNS, MEDIA_EXT_MAP
+from utils.media import commit_media_file, media_staging_dir
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_TTL_SEC = 30 * 60
+MAX_UPLOADS_PER_USER = 4
+
+_FILE_EXT_BY_MIME = {
+    "application/pdf": ".pdf",
+    "application/msword": ".doc",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "text/plain": ".txt",
+    "audio/wav": ".wav",
+    "video/ogg": ".ogv",
+}
+
+
+class UploadError(Exception):
+    """Отказ в загрузке; текст уходит клиенту в ack."""
+
+
+def sniff_mime(head: bytes) -> str | None:
+    """Тип файла по сигнатуре первых байт; ``None`` — формат не распознан."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "audio/wav"
+    if head[4:8] == b"ftyp":
+        return "video/mp4"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "video/webm"
+    if head.startswith(b"OggS"):
+        return "audio/ogg"
+    if head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "audio/mpeg"
+    if head.startswith(b"%PDF-"):
+        return "application/pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    if head.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+        return "application/msword"
+    return None
+
+
+def _looks_like_text(head: bytes) -> bool:
+    if b"\x00" in head:
+        return False
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as exc:
+        # Кусок мог разрезать многобайтный символ на самом конце.
+        return exc.start >= len(head) - 3
+    return True
+
+
+# Один контейнер — разные типы медиа: webm/ogg бывают и видео, и голосом.
+_SNIFF_ALIASES = {
+    "video/webm": ("video/webm", "audio/webm"),
+    "audio/ogg": ("audio/ogg", "video/ogg"),
+}
+
+
+def resolve_upload_mime(media_type: str, declared: str, head: bytes) -> str:
+    """Тип по первому куску, согласованный с ``media_type``; иначе :class:`UploadError`."""
+    allowed = ALLOWED_MIME_PATTERNS.get(media_type, [])
+    sniffed = sniff_mime(head)
+    if sniffed is None:
+        if declared == "text/plain" and declared in allowed and _looks_like_text(head):
+            return declared
+        raise UploadError("Could not validate file type")
+    candidates = _SNIFF_ALIASES.get(sniffed, (sniffed,))
+    if declared in candidates and declared in allowed:
+        return declared
+    for mime in candidates:
+        if mime in allowed:
+            return mime
+    raise UploadError(f"File type not allowed: {sniffed}")
+
+
+@dataclass(slots=True)
+class _Upload:
+    upload_id: str
+    username: str
+    media_type: str
+    name: str
+    declared_mime: str
+    size: int
+    tmp_path: str
+    stream: IO[bytes]
+    touched: float
+    received: int = 0
+    next_index: int = 0
+    mime: str | None = None
+    path: str | None = None
+    digest: Any = field(default_factory=hashlib.sha256)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class ChunkedUploads:
+    """Сессии кусочных загрузок одного процесса (потокобезопасно)."""
+
+    def __init__(
+        self,
+        media_dir: str,
+        max_size: int,
+        logger: Any,
+        *,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        ttl_sec: float = UPLOAD_TTL_SEC,
+        max_per_user: int = MAX_UPLOADS_PER_USER,
+        on_stored: Callable[[str, int, str], Any] | None = None,
+    ) -> None:
+        self.media_dir = media_dir
+        self.on_stored = on_stored
+        self.tmp_dir = media_staging_dir(media_dir)
+        self.max_size = int(max_size)
+        self.chunk_size = int(chunk_size)
+        self.ttl_sec = float(ttl_sec)
+        self.max_per_user = int(max_per_user)
+        self.logger = logger
+        self._uploads: dict[str, _Upload] = {}
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "finished": 0, "claimed": 0, "rejected": 0, "expired": 0}
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def start(self, username: str, media_type: str, name: str, mime: str, size: int) -> dict[str, Any]:
+        mime = mime.split(";", 1)[0].strip().lower()
+        if media_type not in ALLOWED_MIME_PATTERNS:
+            raise self._reject("Media type not allowed")
+        if mime and mime not in ALLOWED_MIME_PATTERNS[media_type]:
+            raise self._reject(f"File type not allowed: {mime}")
+        if size <= 0:
+            raise self._reject("Empty file")
+        if size > self.max_size:
+            raise self._reject("Media file too large")
+        self.sweep()
+        with self._lock:
+            active = sum(1 for up in self._uploads.values() if up.username == username)
+            if active >= self.max_per_user:
+                raise self._reject("Too many uploads in progress")
+            upload_id = f"up_{secrets.token_hex(12)}"
+            tmp_path = os.path.join(self.tmp_dir, f"{upload_id}.part")
+            now = time.monotonic()
+            self._uploads[upload_id] = _Upload(
+                upload_id=upload_id,
+                username=username,
+                media_type=media_type,
+                name=name[:255],
+                declared_mime=mime,
+                size=size,
+                tmp_path=tmp_path,
+                stream=open(tmp_path, "wb"),
+                touched=now,
+            )
+            self._stats["started"] += 1
+        return {"upload_id": upload_id, "chunk_size": self.chunk_size}
+
+    def chunk(self, username: str, upload_id: str, index: int, data: bytes) -> int:
+        """Дописать кусок ``index`` (строго по порядку); вернуть принятое число байт."""
+        up = self._get(username, upload_id)
+        with up.lock:
+            if up.path is not None or up.stream.closed:
+                raise UploadError("Upload already finished")
+            if index != up.next_index:
+                raise UploadError(f"Expected chunk {up.next_index}")
+            # Нарушение протокола или лимита: сессию не продолжить, файл удаляется.
+            if not data or len(data) > self.chunk_size:
+                self._discard(up)
+                raise self._reject("Invalid chunk size")
+            if up.received + len(data) > up.size:
+                self._discard(up)
+                raise self._reject("Media file too large")
+            if index == 0:
+                try:
+                    up.mime = resolve_upload_mime(up.media_type, up.declared_mime, data[:64])
+                except UploadError as exc:
+                    self._discard(up)
+                    raise self._reject(str(exc)) from None
+            up.digest.update(data)
+            up.stream.write(data)
+            up.received += len(data)
+            up.next_index += 1
+            up.touched = time.monotonic()
+            return up.received
+
+    def finish(self, username: str, upload_id: str) -> dict[str, Any]:
+        up = self._get(username, upload_id)
+        with up.lock:
+            if up.path is None:
+                if up.received != up.size:
+                    raise UploadError(f"Incomplete upload: {up.received} of {up.size} bytes")
+                up.stream.close()
+                ext = (
+                    MEDIA_EXT_MAP.get(up.mime or "")
+                    or _FILE_EXT_BY_MIME.get(up.mime or "")
+                    or ".bin"
+                )
+                up.path = commit_media_file(
+                    up.tmp_path, self.media_dir, up.digest.hexdigest(), ext
+                )
+                if self.on_stored is not None:
+                    self.on_stored(up.path, up.size, up.username)
+                up.touched = time.monotonic()
+                self._stats["finished"] += 1
+                self.logger.info(
+                    "Кусочная загрузка: %s → %s (%s байт)", username, up.path, up.size
+                )
+            return {"path": up.path, "type": up.media_type, "name": up.name}
+
+    def peek(self, username: str, upload_id: str) -> dict[str, Any] | None:
+        """Завершённая загрузка без изъятия — для проверок до :meth:`claim`."""
+        with self._lock:
+            up = self._finished(username, upload_id)
+        return None if up is None else self._describe(up)
+
+    def claim(self, username: str, upload_id: str) -> dict[str, Any] | None:
+        """Забрать завершённую загрузку для сообщения (один раз)."""
+        with self._lock:
+            up = self._finished(username, upload_id)
+            if up is None:
+                return None
+            del self._uploads[upload_id]
+            self._stats["claimed"] += 1
+        return self._describe(up)
+
+    def abort(self, username: str, upload_id: str) -> bool:
+        with self._lock:
+            up = self._uploads.get(upload_id)
+            if up is None or up.username != username:
+                return False
+        with up.lock:
+            self._discard(up)
+        return True
+
+    def sweep(self) -> int:
+        """Убрать брошенные загрузки: незавершённые и незабранные дольше TTL.
+
+        Вызывается из ``start`` и периодически из ``services.scheduled_worker``.
+        """
+        deadline = time.monotonic() - self.ttl_sec
+        with self._lock:
+            stale = [up for up in self._uploads.values() if up.touched < deadline]
+        for up in stale:
+            with up.lock:
+                self._discard(up)
+        self._stats["expired"] += len(stale)
+        return len(stale)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            active = len(self._uploads)
+        return {"active": active, "chunk_size": self.chunk_size, **self._stats}
+
+    def _get(self, username: str, upload_id: str) -> _Upload:
+        with self._lock:
+            up = self._uploads.get(upload_id)
+        if up is None or up.username != username:
+            raise UploadError("Unknown upload")
+        return up
+
+    def _finished(self, username: str, upload_id: str) -> _Upload | None:
+        up = self._uploads.get(upload_id)
+        if up is None or up.username != username or up.path is None:
+            return None
+        return up
+
+    @staticmethod
+    def _describe(up: _Upload) -> dict[str, Any]:
+        return {"path": up.path, "type": up.media_type, "name": up.name, "mime": up.mime}
+
+    def _reject(self, message: str) -> UploadError:
+        self._stats["rejected"] += 1
+        return UploadError(message)
+
+    def _discard(self, up: _Upload) -> None:
+        with self._lock:
+            self._uploads.pop(up.upload_id, None)
+        if not up.stream.closed:
+            up.stream.close()
+        if up.path is not None:
+            # Готовый файл может быть общим с другими сообщениями: без ссылок
+            # его уберёт collect_orphan_media.
+            return
+        try:
+            os.remove(up.tmp_path)
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            self.logger.warning("Не удалось удалить файл загрузки %s: %s", up.tmp_path, exc)
@@ -62,3 +62,17 @@ def serialize_saved_message(
         payload["forwarded"] = forwarded
 
     return payload
+
+
+def message_table(messages: list[dict[str, Any]]) -> dict[str, Any]:
+    """Страница истории столбцами: имена полей один раз, дальше — строки значений.
+
+    Ключи сообщений (``message_id``, ``username``, ``timestamp``, …) иначе
+    повторяются в каждом элементе. Отсутствующее поле в строке — ``None``.
+    """
+    columns: dict[str, int] = {}
+    for message in messages:
+        for key in message:
+            columns.setdefault(key, len(columns))
+    rows = [[message.get(key) for key in columns] for message in messages]
+    return {"columns": list(columns), "rows": rows}
@@ -0,0 +1,166 @@
+"""Склейка мелких событий комнаты в один пакет ``batch``.
+
+Набор текста, отметки о прочтении и реакции в живой группе идут десятками в
+секунду, и каждое было отдельным кадром Socket.IO для каждого участника. Здесь
+такие события копятся по комнате в течение ``SOCKET_COALESCE_MS`` и уходят
+одним ``batch``; повторы по одному ключу сливаются (последнее состояние набора
+текста пользователя, последние ``read_by``/реакции сообщения). Срочные события
+(новое сообщение, правка, удаление) буфер не проходят.
+
+Буфер ведётся по комнате, а не по sid: все эмиты адресованы комнате, и каждый
+её участник получил бы одинаковую пачку (событие с ``skip_sid`` исключается из
+пачки только для этого соединения).
+
+Номер ``seq`` событие из пачки получает только при отправке (``stamp``,
+см. ``utils.room_events``): слитые или заменённые события в журнал не
+попадают, и клиент не ждёт номера, который никогда не придёт. Пачка
+комнаты нумеруется и рассылается под замком этой комнаты, а перед срочным
+событием комнаты накопленное досылается сразу (:func:`flush_room`) — номера
+в порядке отправки идут подряд.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Callable
+from contextlib import nullcontext
+from typing import Any
+
+Merge = Callable[[dict[str, Any], dict[str, Any]], dict[str, Any]]
+# (событие, данные) -> данные с номером; вызывается под замком комнаты.
+Stamp = Callable[[str, dict[str, Any]], dict[str, Any]]
+_Item = tuple[str, dict[str, Any], str | None, Stamp | None]
+
+_socketio: Any = None
+_room_locks: Any = None
+_window_sec = 0.0
+_lock = threading.Lock()
+# room -> {key: (event, data, skip_sid, stamp)}; порядок — по последнему обновлению ключа.
+_pending: dict[str, dict[str, _Item]] = {}
+_wake = threading.Event()
+_started = False
+_stats = {"pushed": 0, "merged": 0, "batches": 0, "events_sent": 0}
+
+
+def bind_outbound_batch(socketio: Any, window_ms: int, room_locks: Any = None) -> None:
+    """Wire the Socket.IO server and room lock from the app factory; ``window_ms=0`` disables batching."""
+    global _socketio, _room_locks, _window_sec
+    _socketio = socketio
+    _room_locks = room_locks
+    _window_sec = max(0, window_ms) / 1000
+    with _lock:
+        _pending.clear()
+
+
+def emit_coalesced(
+    room_id: str,
+    event: str,
+    data: dict[str, Any],
+    key: str,
+    merge: Merge | None = None,
+    skip_sid: str | None = None,
+    stamp: Stamp | None = None,
+) -> None:
+    """Отправить ``event`` в комнату в ближайшем ``batch``; тот же ``key`` заменяет прежнее.
+
+    ``merge(old, new)`` — вместо замены объединить с ещё не отправленным.
+    ``skip_sid`` — соединение, которому это событие не шлём.
+    ``stamp`` — пронумеровать событие при отправке (без окна — сразу, тогда
+    вызывающий держит замок комнаты).
+    """
+    if _socketio is None:
+        return
+    if not _window_sec:
+        if stamp is not None:
+            data = stamp(event, data)
+        _socketio.emit(event, data, to=room_id, namespace="/", skip_sid=skip_sid)
+        return
+    with _lock:
+        _stats["pushed"] += 1
+        room = _pending.setdefault(room_id, {})
+        old = room.pop(key, None)
+        if old is not None:
+            _stats["merged"] += 1
+            if merge is not None and old[0] == event:
+                data = merge(old[1], data)
+            # Слитое событие несёт и чужое изменение — пропускаем, только если оба от него.
+            if old[2] != skip_sid:
+                skip_sid = None
+        room[key] = (event, data, skip_sid, stamp)
+    _wake.set()
+
+
+def _send_batch(room_id: str, items: list[tuple[str, dict[str, Any], str | None]]) -> None:
+    events = [{"event": event, "data": data} for event, data, _ in items]
+    skipped = list(dict.fromkeys(skip for _, _, skip in items if skip))
+    _socketio.emit(
+        "batch",
+        {"room": room_id, "events": events},
+        to=room_id,
+        namespace="/",
+        skip_sid=skipped or None,
+    )
+    for sid in skipped:
+        own = [{"event": event, "data": data} for event, data, skip in items if skip != sid]
+        if own:
+            _socketio.emit("batch", {"room": room_id, "events": own}, to=sid, namespace="/")
+
+
+def flush_room(room_id: str) -> int:
+    """Разослать пачку одной комнаты сейчас; вызывать под замком этой комнаты."""
+    with _lock:
+        items = _pending.pop(room_id, None)
+    if not items:
+        return 0
+    _send_batch(
+        room_id,
+        [
+            (event, stamp(event, data) if stamp is not None else data, skip_sid)
+            for event, data, skip_sid, stamp in items.values()
+        ],
+    )
+    with _lock:
+        _stats["batches"] += 1
+        _stats["events_sent"] += len(items)
+    return len(items)
+
+
+def flush_outbound() -> int:
+    """Разослать все накопленные пачки; вернуть число отправленных событий."""
+    with _lock:
+        room_ids = list(_pending)
+    sent = 0
+    for room_id in room_ids:
+        with _room_locks.hold([room_id]) if _room_locks is not None else nullcontext():
+            sent += flush_room(room_id)
+    return sent
+
+
+def start_outbound_flusher(app: Any) -> None:
+    """Фоновый поток: после первого события ждёт окно и рассылает пачки."""
+    global _started
+    if _started or not _window_sec:
+        return
+    _started = True
+
+    def loop() -> None:
+        while True:
+            _wake.wait()
+            time.sleep(_window_sec)
+            _wake.clear()
+            try:
+                flush_outbound()
+            except Exception:
+                app.logger.warning("Рассылка пачки событий не удалась", exc_info=True)
+
+    threading.Thread(target=loop, name="outbound-batch", daemon=True).start()
+
+
+def outbound_batch_stats() -> dict[str, Any]:
+    with _lock:
+        return {
+            "window_ms": round(_window_sec * 1000),
+            "pending_rooms": len(_pending),
+            **_stats,
+        }
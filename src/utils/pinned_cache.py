@@ -0,0 +1,111 @@
+"""Кэш закреплённых сообщений по комнатам.
+
+Список закрепов читается при каждом открытии чата, а меняется редко, поэтому
+держим его в памяти до явной инвалидации (pin/unpin, правка, удаление или
+истечение TTL сообщения). Обратный индекс ``message_id -> room_id`` позволяет
+сбросить нужную комнату, когда вызывающий знает только id сообщения.
+
+Другие воркеры узнают об изменениях через шину инвалидации ``facade_cache``:
+pin/unpin публикуют тег ``pinned:<room_id>``, правка и удаление — уже
+существующий ``message:<id>`` (см. :func:`on_invalidate`). Версия комнаты
+растёт и от таких удалённых сбросов, поэтому ETag закрепов меняется во всех
+процессах. ``PINNED_CACHE_TTL_SEC`` остаётся страховкой на случай без Redis.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from collections.abc import Callable, Iterable
+from typing import Any
+
+PINNED_CACHE_TTL_SEC = 300
+
+PINNED_TAG_PREFIX = "pinned:"
+MESSAGE_TAG_PREFIX = "message:"
+
+_EPOCH = uuid.uuid4().hex[:8]
+_lock = threading.Lock()
+_pinned: dict[str, tuple[float, list[dict[str, Any]]]] = {}
+_versions: dict[str, int] = {}
+_room_by_message: dict[str, str] = {}
+
+
+def _drop_room_locked(room_id: str) -> None:
+    cached = _pinned.pop(room_id, None)
+    if cached:
+        for msg in cached[1]:
+            _room_by_message.pop(msg["message_id"], None)
+    _versions[room_id] = _versions.get(room_id, 0) + 1
+
+
+def pinned_tag(room_id: str) -> str:
+    return f"{PINNED_TAG_PREFIX}{room_id}"
+
+
+def invalidate_pinned(room_id: str) -> None:
+    if not room_id:
+        return
+    with _lock:
+        _drop_room_locked(room_id)
+
+
+def invalidate_pinned_messages(message_ids: Iterable[str]) -> None:
+    """Сбросить комнаты, в закрепах которых есть хотя бы одно из сообщений."""
+    with _lock:
+        rooms = {_room_by_message.get(mid) for mid in message_ids if mid}
+        for room_id in rooms:
+            if room_id:
+                _drop_room_locked(room_id)
+
+
+def get_pinned(
+    room_id: str, load: Callable[[str], list[dict[str, Any]] | None]
+) -> list[dict[str, Any]] | None:
+    now = time.monotonic()
+    with _lock:
+        cached = _pinned.get(room_id)
+        if cached and now - cached[0] < PINNED_CACHE_TTL_SEC:
+            return cached[1]
+        version_before = _versions.get(room_id, 0)
+
+    rows = load(room_id)
+    if rows is None:
+        return None
+    with _lock:
+        # Закрепы поменялись, пока шёл запрос, — не кладём в кэш старый список.
+        if _versions.get(room_id, 0) == version_before:
+            _pinned[room_id] = (now, rows)
+            for msg in rows:
+                _room_by_message[msg["message_id"]] = room_id
+    return rows
+
+
+def pinned_etag(room_id: str) -> str:
+    window = int(time.time() // PINNED_CACHE_TTL_SEC)
+    return f"{_EPOCH}-{window}-{_versions.get(room_id, 0)}-{room_id}"
+
+
+def on_invalidate(tags: list[str] | None) -> None:
+    """Слушатель шины ``facade_cache``: изменения, сделанные другим воркером."""
+    if tags is None:
+        clear_pinned_cache()
+        return
+    message_ids = []
+    for tag in tags:
+        if tag.startswith(PINNED_TAG_PREFIX):
+            invalidate_pinned(tag[len(PINNED_TAG_PREFIX) :])
+        elif tag.startswith(MESSAGE_TAG_PREFIX):
+            message_ids.append(tag[len(MESSAGE_TAG_PREFIX) :])
+    if message_ids:
+        invalidate_pinned_messages(message_ids)
+
+
+def clear_pinned_cache() -> None:
+    global _EPOCH
+    with _lock:
+        _pinned.clear()
+        _room_by_message.clear()
+        # Версии комнат без записей не менялись — новая эпоха сбивает все ETag.
+        _EPOCH = uuid.uuid4().hex[:8]
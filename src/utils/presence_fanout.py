@@ -0,0 +1,112 @@
+"""Рассылка смены онлайн-статуса только контактам, пачками и без «дребезга».
+
+Раньше каждое подключение и отключение уходило ``broadcast=True`` всем сокетам:
+при волне переподключений это O(N²) событий. Теперь:
+
+* изменение получает только тот, кто делит с пользователем группу или личный
+  чат (``db.list_contact_usernames``), — в личную комнату ``user:<логин>``;
+* уход в офлайн откладывается на ``PRESENCE_OFFLINE_GRACE_SEC``: если
+  пользователь за это время вернулся, не рассылается ни «offline», ни «online»;
+* изменения копятся и раз в ``PRESENCE_BATCH_INTERVAL_SEC`` уходят одним
+  событием ``presence_batch`` на получателя.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Callable
+from datetime import datetime
+from typing import Any
+
+from utils.room_delivery import user_room
+
+PRESENCE_OFFLINE_GRACE_SEC = 10
+PRESENCE_BATCH_INTERVAL_SEC = 2
+
+
+class PresenceFanout:
+    def __init__(
+        self,
+        socketio: Any,
+        db: Any,
+        is_online: Callable[[str], bool],
+        logger: Any = None,
+    ) -> None:
+        self._socketio = socketio
+        self._db = db
+        self._is_online = is_online
+        self._logger = logger
+        self._lock = threading.Lock()
+        # логин -> (статус, время события); последний статус побеждает.
+        self._changes: dict[str, tuple[str, str]] = {}
+        # логин -> момент, когда офлайн станет окончательным.
+        self._pending_offline: dict[str, float] = {}
+        self._started = False
+
+    def online(self, username: str) -> None:
+        with self._lock:
+            if self._pending_offline.pop(username, None) is not None:
+                # Быстрое переподключение: для контактов пользователь не уходил.
+                return
+            self._changes[username] = ("online", datetime.now().isoformat())
+
+    def offline(self, username: str, *, grace: float = PRESENCE_OFFLINE_GRACE_SEC) -> None:
+        with self._lock:
+            if self._changes.get(username, ("",))[0] == "online":
+                # Пришёл и ушёл между рассылками — контакты ничего не увидят.
+                del self._changes[username]
+                return
+            self._pending_offline[username] = time.monotonic() + grace
+
+    def flush(self) -> int:
+        """Разослать накопленное; вернуть число отправленных ``presence_batch``."""
+        now = time.monotonic()
+        with self._lock:
+            due = [un for un, at in self._pending_offline.items() if at <= now]
+            for un in due:
+                del self._pending_offline[un]
+            changes, self._changes = self._changes, {}
+
+        for un in due:
+            # Мог переподключиться к другому воркеру — тогда офлайна не было.
+            if not self._is_online(un):
+                self._db.update_last_seen(un)
+                changes[un] = ("offline", datetime.now().isoformat())
+        if not changes:
+            return 0
+
+        per_recipient: dict[str, list[dict[str, Any]]] = {}
+        for un, (status, ts) in changes.items():
+            change: dict[str, Any] = {"username": un, "status": status, "timestamp": ts}
+            if status == "offline":
+                change["last_seen"] = self._db.get_last_seen(un)
+            for recipient in self._db.list_contact_usernames(un):
+                per_recipient.setdefault(recipient, []).append(change)
+            if status == "offline" and self._logger is not None:
+                self._logger.info(f"{un} вышел из сети")
+
+        for recipient, items in per_recipient.items():
+            self._socketio.emit(
+                "presence_batch",
+                {"changes": items},
+                to=user_room(recipient),
+                namespace="/",
+            )
+        return len(per_recipient)
+
+    def start(self) -> None:
+        if self._started:
+            return
+        self._started = True
+
+        def loop() -> None:
+            stop = threading.Event()
+            while not stop.wait(PRESENCE_BATCH_INTERVAL_SEC):
+                try:
+                    self.flush()
+                except Exception:
+                    if self._logger is not None:
+                        self._logger.warning("Presence fan-out failed", exc_info=True)
+
+        threading.Thread(target=loop, name="presence-fanout", daemon=True).start()
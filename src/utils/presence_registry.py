@@ -0,0 +1,291 @@
+"""Presence registry: who is online, in memory or in Redis (shared across workers).
+
+``sid`` живёт в одном процессе, поэтому связь ``sid -> логин`` и список
+локальных sid пользователя всегда хранятся в памяти воркера. Общим должен быть
+только ответ «онлайн ли пользователь»: в Redis это хэш
+``nebula:presence:user:<логин>`` (поле — sid, значение — id воркера), его
+размер — число соединений на всех воркерах.
+
+Каждый воркер продлевает ключ-пульс ``nebula:presence:worker:<id>``. Если
+процесс умер, не закрыв сокеты, пульс истекает, и любой живой воркер удаляет
+его sid из хэшей пользователей и сообщает, кто после этого ушёл в офлайн.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+import uuid
+from collections.abc import Callable, Iterable
+from typing import Protocol
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "nebula:presence:"
+HEARTBEAT_INTERVAL_SEC = 10
+HEARTBEAT_TTL_SEC = 35
+
+
+class PresenceRegistry(Protocol):
+    def add(self, sid: str, username: str) -> int:
+        """Register ``sid``; return the user's connection count *before* it."""
+
+    def remove(self, sid: str) -> tuple[str | None, int]:
+        """Forget ``sid``; return ``(username, connections left)``."""
+
+    def username_for(self, sid: str) -> str | None: ...
+
+    def is_online(self, username: str) -> bool: ...
+
+    def online_many(self, usernames: Iterable[str]) -> dict[str, bool]: ...
+
+    def connection_count(self, username: str) -> int: ...
+
+    def local_sids(self, username: str) -> list[str]: ...
+
+    def has_local_sessions(self) -> bool: ...
+
+    def clear_all(self) -> None: ...
+
+    def start_heartbeat(
+        self, on_offline: Callable[[list[str]], None] | None = None
+    ) -> None: ...
+
+
+class _LocalSessions:
+    """sid текущего процесса (общая часть обоих бэкендов)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._sessions: dict[str, str] = {}
+        self._sids: dict[str, set[str]] = {}
+
+    def username_for(self, sid: str) -> str | None:
+        return self._sessions.get(sid)
+
+    def local_sids(self, username: str) -> list[str]:
+        with self._lock:
+            return list(self._sids.get(username, ()))
+
+    def has_local_sessions(self) -> bool:
+        return bool(self._sessions)
+
+    def _bind_local(self, sid: str, username: str) -> str | None:
+        """Привязать sid; вернуть прежний логин, если sid сменил пользователя."""
+        with self._lock:
+            previous = self._sessions.get(sid)
+            if previous is not None and previous != username:
+                self._unbind_locked(sid, previous)
+            self._sessions[sid] = username
+            self._sids.setdefault(username, set()).add(sid)
+            return previous if previous != username else None
+
+    def _unbind_local(self, sid: str) -> tuple[str | None, bool]:
+        """Отвязать sid; вернуть ``(логин, остались ли у него sid здесь)``."""
+        with self._lock:
+            username = self._sessions.get(sid)
+            if username is None:
+                return None, False
+            self._unbind_locked(sid, username)
+            return username, username in self._sids
+
+    def _unbind_locked(self, sid: str, username: str) -> None:
+        self._sessions.pop(sid, None)
+        sids = self._sids.get(username)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._sids[username]
+
+    def _clear_local(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+            self._sids.clear()
+
+
+class MemoryPresenceRegistry(_LocalSessions):
+    def add(self, sid: str, username: str) -> int:
+        with self._lock:
+            sids = self._sids.get(username, ())
+            before = len(sids) - (1 if sid in sids else 0)
+            self._bind_local(sid, username)
+        return before
+
+    def remove(self, sid: str) -> tuple[str | None, int]:
+        username, _ = self._unbind_local(sid)
+        if username is None:
+            return None, 0
+        return username, self.connection_count(username)
+
+    def is_online(self, username: str) -> bool:
+        return bool(self._sids.get(username))
+
+    def online_many(self, usernames: Iterable[str]) -> dict[str, bool]:
+        return {un: self.is_online(un) for un in usernames}
+
+    def connection_count(self, username: str) -> int:
+        return len(self._sids.get(username, ()))
+
+    def clear_all(self) -> None:
+        self._clear_local()
+
+    def start_heartbeat(
+        self, on_offline: Callable[[list[str]], None] | None = None
+    ) -> None:
+        _ = on_offline
+
+
+class RedisPresenceRegistry(_LocalSessions):
+    def __init__(self, url: str) -> None:
+        super().__init__()
+        import redis
+
+        self._r = redis.from_url(url, decode_responses=True)
+        # from_url соединяется лениво: без ping недоступный Redis всплыл бы
+        # только на первом connect, а не здесь (запасной вариант — память).
+        self._r.ping()
+        self._prefix = KEY_PREFIX
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._heartbeat_started = False
+
+    def _user_key(self, username: str) -> str:
+        return f"{self._prefix}user:{username}"
+
+    def _worker_key(self, worker_id: str) -> str:
+        return f"{self._prefix}worker:{worker_id}"
+
+    def _worker_users_key(self, worker_id: str) -> str:
+        return f"{self._prefix}worker_users:{worker_id}"
+
+    @property
+    def _workers_key(self) -> str:
+        return f"{self._prefix}workers"
+
+    def add(self, sid: str, username: str) -> int:
+        previous = self._bind_local(sid, username)
+        pipe = self._r.pipeline(transaction=True)
+        if previous is not None:
+            pipe.hdel(self._user_key(previous), sid)
+        pipe.hexists(self._user_key(username), sid)
+        pipe.hlen(self._user_key(username))
+        pipe.hset(self._user_key(username), sid, self.worker_id)
+        pipe.sadd(self._worker_users_key(self.worker_id), username)
+        res = pipe.execute()
+        offset = 1 if previous is not None else 0
+        already, before = bool(res[offset]), int(res[offset + 1])
+        return before - 1 if already else before
+
+    def remove(self, sid: str) -> tuple[str | None, int]:
+        username, still_local = self._unbind_local(sid)
+        if username is None:
+            return None, 0
+        pipe = self._r.pipeline(transaction=True)
+        pipe.hdel(self._user_key(username), sid)
+        pipe.hlen(self._user_key(username))
+        if not still_local:
+            pipe.srem(self._worker_users_key(self.worker_id), username)
+        res = pipe.execute()
+        return username, int(res[1])
+
+    def is_online(self, username: str) -> bool:
+        return bool(self._r.exists(self._user_key(username)))
+
+    def online_many(self, usernames: Iterable[str]) -> dict[str, bool]:
+        names = list(dict.fromkeys(usernames))
+        if not names:
+            return {}
+        pipe = self._r.pipeline(transaction=False)
+        for un in names:
+            pipe.exists(self._user_key(un))
+        return {un: bool(v) for un, v in zip(names, pipe.execute(), strict=True)}
+
+    def connection_count(self, username: str) -> int:
+        return int(self._r.hlen(self._user_key(username)))
+
+    def clear_all(self) -> None:
+        self._clear_local()
+        pattern = f"{self._prefix}*"
+        batch: list[str] = []
+        for key in self._r.scan_iter(match=pattern, count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                self._r.delete(*batch)
+                batch.clear()
+        if batch:
+            self._r.delete(*batch)
+        self._beat()
+
+    def _beat(self) -> None:
+        pipe = self._r.pipeline(transaction=False)
+        pipe.set(self._worker_key(self.worker_id), "1", ex=HEARTBEAT_TTL_SEC)
+        pipe.sadd(self._workers_key, self.worker_id)
+        pipe.execute()
+
+    def reap_dead_workers(self) -> list[str]:
+        """Убрать sid воркеров без пульса; вернуть ушедших в офлайн."""
+        went_offline: list[str] = []
+        for worker_id in self._r.smembers(self._workers_key):
+            if worker_id == self.worker_id or self._r.exists(
+                self._worker_key(worker_id)
+            ):
+                continue
+            # SREM — «захват»: мёртвого воркера разбирает только один живой.
+            if not self._r.srem(self._workers_key, worker_id):
+                continue
+            users_key = self._worker_users_key(worker_id)
+            for username in self._r.smembers(users_key):
+                user_key = self._user_key(username)
+                dead = [
+                    sid
+                    for sid, owner in self._r.hgetall(user_key).items()
+                    if owner == worker_id
+                ]
+                if not dead:
+                    continue
+                pipe = self._r.pipeline(transaction=True)
+                pipe.hdel(user_key, *dead)
+                pipe.hlen(user_key)
+                if int(pipe.execute()[1]) == 0:
+                    went_offline.append(username)
+            self._r.delete(users_key)
+        return went_offline
+
+    def start_heartbeat(
+        self, on_offline: Callable[[list[str]], None] | None = None
+    ) -> None:
+        if self._heartbeat_started:
+            return
+        self._heartbeat_started = True
+        try:
+            self._beat()
+        except Exception as e:
+            logger.warning("Presence heartbeat failed: %s", e)
+
+        def loop() -> None:
+            stop = threading.Event()
+            while not stop.wait(HEARTBEAT_INTERVAL_SEC):
+                try:
+                    self._beat()
+                    went_offline = self.reap_dead_workers()
+                    if went_offline and on_offline is not None:
+                        on_offline(went_offline)
+                except Exception as e:
+                    logger.warning("Presence heartbeat failed: %s", e)
+
+        threading.Thread(target=loop, name="presence-heartbeat", daemon=True).start()
+
+
+def build_presence_registry(redis_url: str | None, app_logger) -> PresenceRegistry:
+    if redis_url:
+        try:
+            registry = RedisPresenceRegistry(redis_url)
+            app_logger.info(
+                "Онлайн-статусы: Redis (%s)",
+                redis_url.split("@")[-1] if "@" in redis_url else redis_url,
+            )
+            return registry
+        except Exception as e:
+            app_logger.warning("Redis для онлайн-статусов недоступен, используется память: %s", e)
+    return MemoryPresenceRegistry()
@@ -0,0 +1,119 @@
+"""Кэш карточек пользователей (профиль + last_seen) с версией на пользователя.
+
+Версия растёт при каждом изменении профиля или ``last_seen``. Из версий
+собирается ETag пакетного ``/api/profiles``: повторный запрос того же списка
+отвечает 304, не трогая ни кэш, ни MySQL. Изменения, сделанные другим
+процессом, приходят по шине инвалидации ``facade_cache`` (тег
+``profile:<username>``, см. :func:`on_invalidate`) и так же поднимают версию.
+Без Redis они видны не позже чем через ``PROFILE_CACHE_TTL_SEC`` — на этот
+интервал ограничены и время жизни карточки, и «окно» ETag.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Mapping
+from typing import Any
+
+PROFILE_CACHE_TTL_SEC = 60
+PROFILE_CACHE_MAX_ENTRIES = 10000
+
+PROFILE_TAG_PREFIX = "profile:"
+
+# После рестарта версии снова начинаются с нуля; эпоха процесса не даёт ETag
+# предыдущего процесса случайно совпасть с новым.
+_EPOCH = uuid.uuid4().hex[:8]
+_lock = threading.Lock()
+_cards: OrderedDict[str, tuple[float, dict[str, Any] | None]] = OrderedDict()
+_versions: dict[str, int] = {}
+
+
+def profile_tag(username: str) -> str:
+    return f"{PROFILE_TAG_PREFIX}{username}"
+
+
+def profile_version(username: str) -> int:
+    return _versions.get(username, 0)
+
+
+def bump_profile_version(username: str) -> int:
+    """Отметить карточку устаревшей (профиль или last_seen изменились)."""
+    if not username:
+        return 0
+    with _lock:
+        version = _versions.get(username, 0) + 1
+        _versions[username] = version
+        _cards.pop(username, None)
+    return version
+
+
+def get_user_cards(
+    usernames: Iterable[str],
+    load: Callable[[list[str]], Mapping[str, dict[str, Any]]],
+) -> dict[str, dict[str, Any] | None]:
+    """Карточки из кэша; промахи догружаются одним вызовом ``load``.
+
+    Несуществующие логины кэшируются как ``None`` (negative cache), чтобы
+    список с «мёртвыми» собеседниками не ходил в БД на каждый рендер.
+    """
+    names = list(dict.fromkeys(un for un in usernames if un))
+    now = time.monotonic()
+    out: dict[str, dict[str, Any] | None] = {}
+    missing: list[str] = []
+    with _lock:
+        for un in names:
+            cached = _cards.get(un)
+            if cached and now - cached[0] < PROFILE_CACHE_TTL_SEC:
+                _cards.move_to_end(un)
+                out[un] = cached[1]
+            else:
+                missing.append(un)
+        versions_before = {un: _versions.get(un, 0) for un in missing}
+
+    if not missing:
+        return out
+
+    loaded = load(missing) or {}
+    with _lock:
+        for un in missing:
+            card = loaded.get(un)
+            out[un] = card
+            # Профиль поменялся, пока шёл запрос, — не кладём в кэш старые данные.
+            if _versions.get(un, 0) != versions_before[un]:
+                continue
+            _cards[un] = (now, card)
+            _cards.move_to_end(un)
+        while len(_cards) > PROFILE_CACHE_MAX_ENTRIES:
+            _cards.popitem(last=False)
+    return out
+
+
+def cards_etag(usernames: Iterable[str], online: Mapping[str, bool]) -> str:
+    """Слабый валидатор набора карточек: версии, онлайн-статусы и окно TTL."""
+    window = int(time.time() // PROFILE_CACHE_TTL_SEC)
+    digest = hashlib.sha1(f"{_EPOCH}:{window}".encode(), usedforsecurity=False)
+    for un in sorted(dict.fromkeys(un for un in usernames if un)):
+        flag = "1" if online.get(un) else "0"
+        digest.update(f"|{un}:{profile_version(un)}:{flag}".encode())
+    return digest.hexdigest()
+
+
+def on_invalidate(tags: list[str] | None) -> None:
+    """Слушатель шины ``facade_cache``: профиль поменял другой воркер."""
+    if tags is None:
+        clear_profile_cache()
+        return
+    for tag in tags:
+        if tag.startswith(PROFILE_TAG_PREFIX):
+            bump_profile_version(tag[len(PROFILE_TAG_PREFIX) :])
+
+
+def clear_profile_cache() -> None:
+    global _EPOCH
+    with _lock:
+        _cards.clear()
+        _EPOCH = uuid.uuid4().hex[:8]
@@ -0,0 +1,344 @@
+"""Кольцевой буфер последних сообщений активных комнат.
+
+Первая страница истории — самое частое чтение (``join`` берёт 100 сообщений,
+``/api/messages`` — 50). Для комнаты, которую недавно читали, держим последние
+``RECENT_MESSAGES_PER_ROOM`` уже гидрированных сообщений (как их отдаёт
+``repositories.messages.get_messages``) и отвечаем из памяти. Новые сообщения
+дописываются, правки, удаления, реакции и прочтения патчатся на месте; комнаты
+вытесняются по LRU после ``RECENT_ROOMS_MAX``.
+
+Буфер — локальный для процесса. Другие воркеры узнают об изменениях через
+шину инвалидации ``facade_cache`` (теги ``room_messages:<id>`` и
+``message:<id>``) и просто сбрасывают свою копию комнаты.
+
+Сообщения в буфере не меняются на месте — патч подменяет словарь целиком,
+поэтому отданные страницы можно сериализовать без блокировки.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterable
+from datetime import UTC, datetime
+from typing import Any
+
+RECENT_MESSAGES_PER_ROOM = 100
+RECENT_ROOMS_MAX = 2000
+
+ROOM_TAG_PREFIX = "room_messages:"
+MESSAGE_TAG_PREFIX = "message:"
+
+
+class _RoomBuffer:
+    __slots__ = ("messages", "complete")
+
+    def __init__(self, messages: Iterable[dict[str, Any]], complete: bool) -> None:
+        self.messages: deque[dict[str, Any]] = deque(
+            messages, maxlen=RECENT_MESSAGES_PER_ROOM
+        )
+        # True — в комнате нет сообщений старше буфера, короткий буфер = вся история.
+        self.complete = complete
+
+
+_lock = threading.Lock()
+_rooms: OrderedDict[str, _RoomBuffer] = OrderedDict()
+_room_by_message: dict[str, str] = {}
+# id сообщения, на которое отвечают, -> комната ответа (сам оригинал может быть
+# старше буфера, а правка/удаление должны обновить цитаты в ответах).
+_room_by_reply_target: dict[str, str] = {}
+_versions: dict[str, int] = {}
+# Записи в сообщения, комнату которых процесс не знает (их нет в буфере).
+_unplaced_writes = 0
+
+
+def room_tag(room_id: str) -> str:
+    return f"{ROOM_TAG_PREFIX}{room_id}"
+
+
+def message_tag(message_id: str) -> str:
+    return f"{MESSAGE_TAG_PREFIX}{message_id}"
+
+
+def _is_expired(msg: dict[str, Any], now: datetime) -> bool:
+    expires_at = msg.get("expires_at")
+    if not expires_at:
+        return False
+    if not isinstance(expires_at, datetime):
+        try:
+            expires_at = datetime.fromisoformat(str(expires_at).replace("Z", "+00:00"))
+        except ValueError:
+            return False
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=UTC)
+    return expires_at <= now
+
+
+def _bump_locked(room_id: str) -> None:
+    _versions[room_id] = _versions.get(room_id, 0) + 1
+
+
+def _bump_unplaced_locked() -> None:
+    global _unplaced_writes
+    _unplaced_writes += 1
+
+
+def write_generation(room_id: str) -> tuple[int, int]:
+    """Меняется после каждой записи в комнату (своей или пришедшей по шине).
+
+    Входит в ключ single-flight чтения истории (``db.get_messages``): запрос,
+    пришедший после записи, не присоединяется к чтению, начатому до неё.
+    Запись в сообщение вне буфера (комната неизвестна) меняет поколение всех
+    комнат.
+    """
+    with _lock:
+        return _unplaced_writes, _versions.get(room_id, 0)
+
+
+def _index_locked(room_id: str, msg: dict[str, Any]) -> None:
+    _room_by_message[msg["message_id"]] = room_id
+    reply_id = (msg.get("replyTo") or {}).get("id")
+    if reply_id:
+        _room_by_reply_target[reply_id] = room_id
+
+
+def _unindex_locked(room_id: str, msg: dict[str, Any]) -> None:
+    _room_by_message.pop(msg["message_id"], None)
+    reply_id = (msg.get("replyTo") or {}).get("id")
+    if reply_id and _room_by_reply_target.get(reply_id) == room_id:
+        # Другие ответы на тот же оригинал в этой комнате ещё могут быть в буфере.
+        buf = _rooms.get(room_id)
+        if buf is None or not any(
+            (m.get("replyTo") or {}).get("id") == reply_id
+            for m in buf.messages
+            if m is not msg
+        ):
+            del _room_by_reply_target[reply_id]
+
+
+def _drop_room_locked(room_id: str) -> None:
+    buf = _rooms.pop(room_id, None)
+    if buf is not None:
+        for msg in buf.messages:
+            _unindex_locked(room_id, msg)
+    _bump_locked(room_id)
+
+
+def _page_locked(room_id: str, buf: _RoomBuffer, limit: int) -> list[dict[str, Any]] | None:
+    now = datetime.now(UTC)
+    expired = [m for m in buf.messages if _is_expired(m, now)]
+    for msg in expired:
+        buf.messages.remove(msg)
+        _unindex_locked(room_id, msg)
+    if len(buf.messages) < limit and not buf.complete:
+        return None
+    return list(buf.messages)[-limit:] if limit else []
+
+
+def first_page(
+    room_id: str,
+    limit: int,
+    load: Callable[[str, int], list[dict[str, Any]] | None],
+) -> list[dict[str, Any]] | None:
+    """Последние ``limit`` сообщений комнаты (от старых к новым).
+
+    При промахе буфер заполняется вызовом ``load(room_id, RECENT_MESSAGES_PER_ROOM)``.
+    ``None`` — ответить из буфера нельзя (слишком большой ``limit`` или ошибка БД).
+    """
+    if limit > RECENT_MESSAGES_PER_ROOM:
+        return None
+    with _lock:
+        buf = _rooms.get(room_id)
+        if buf is not None:
+            _rooms.move_to_end(room_id)
+            page = _page_locked(room_id, buf, limit)
+            if page is not None:
+                return page
+        generation_before = (_unplaced_writes, _versions.get(room_id, 0))
+
+    rows = load(room_id, RECENT_MESSAGES_PER_ROOM)
+    if rows is None:
+        return None
+    with _lock:
+        # Пока шла загрузка, комнату (или сообщение вне буферов) поменяли —
+        # буфер соберёт следующий запрос.
+        if (_unplaced_writes, _versions.get(room_id, 0)) == generation_before:
+            _drop_room_locked(room_id)
+            buf = _RoomBuffer(rows, complete=len(rows) < RECENT_MESSAGES_PER_ROOM)
+            _rooms[room_id] = buf
+            for msg in buf.messages:
+                _index_locked(room_id, msg)
+            while len(_rooms) > RECENT_ROOMS_MAX:
+                _drop_room_locked(next(iter(_rooms)))
+    now = datetime.now(UTC)
+    return [m for m in rows if not _is_expired(m, now)][-limit:] if limit else []
+
+
+def find(message_id: str) -> dict[str, Any] | None:
+    with _lock:
+        room_id = _room_by_message.get(message_id)
+        buf = _rooms.get(room_id) if room_id else None
+        if buf is None:
+            return None
+        for msg in buf.messages:
+            if msg["message_id"] == message_id:
+                return msg
+    return None
+
+
+def append(room_id: str, msg: dict[str, Any]) -> None:
+    """Дописать новое сообщение, если буфер комнаты сейчас в памяти."""
+    with _lock:
+        _bump_locked(room_id)
+        buf = _rooms.get(room_id)
+        if buf is None or msg["message_id"] in _room_by_message:
+            return
+        if len(buf.messages) == buf.messages.maxlen:
+            _unindex_locked(room_id, buf.messages.popleft())
+            buf.complete = False
+        buf.messages.append(msg)
+        _index_locked(room_id, msg)
+
+
+def _patch(
+    message_id: str, patch: Callable[[dict[str, Any]], dict[str, Any] | None]
+) -> None:
+    """Подменить сообщение результатом ``patch(copy)``; ``None`` — удалить."""
+    with _lock:
+        room_id = _room_by_message.get(message_id)
+        buf = _rooms.get(room_id) if room_id else None
+        if room_id is None or buf is None:
+            _bump_unplaced_locked()
+            return
+        _bump_locked(room_id)
+        items = buf.messages
+        for i, msg in enumerate(items):
+            if msg["message_id"] != message_id:
+                continue
+            updated = patch(dict(msg))
+            if updated is None:
+                del items[i]
+                _unindex_locked(room_id, msg)
+            else:
+                items[i] = updated
+            break
+
+
+def _patch_replies(
+    message_id: str, patch: Callable[[dict[str, Any]], dict[str, Any]]
+) -> None:
+    with _lock:
+        room_id = _room_by_message.get(message_id) or _room_by_reply_target.get(
+            message_id
+        )
+        buf = _rooms.get(room_id) if room_id else None
+        if room_id is None or buf is None:
+            return
+        _bump_locked(room_id)
+        items = buf.messages
+        for i, msg in enumerate(items):
+            if (msg.get("replyTo") or {}).get("id") == message_id:
+                items[i] = patch(dict(msg))
+
+
+def edit_message(message_id: str, new_text: str, edited_at: datetime | None) -> None:
+    def patch(msg: dict[str, Any]) -> dict[str, Any]:
+        msg.update(text=new_text, edited=True, edited_at=edited_at)
+        return msg
+
+    def patch_reply(msg: dict[str, Any]) -> dict[str, Any]:
+        msg["replyTo"] = {**msg["replyTo"], "text": new_text}
+        return msg
+
+    _patch_replies(message_id, patch_reply)
+    _patch(message_id, patch)
+
+
+def remove_message(message_id: str) -> None:
+    def unlink_reply(msg: dict[str, Any]) -> dict[str, Any]:
+        # delete_message обнуляет reply_to_id у ответов — повторяем это в буфере.
+        msg.pop("replyTo", None)
+        msg["reply_to_id"] = None
+        return msg
+
+    _patch_replies(message_id, unlink_reply)
+    _patch(message_id, lambda _msg: None)
+    with _lock:
+        _room_by_reply_target.pop(message_id, None)
+
+
+def toggle_reaction(message_id: str, username: str, emoji: str) -> None:
+    def patch(msg: dict[str, Any]) -> dict[str, Any]:
+        reactions = {k: list(v) for k, v in (msg.get("reactions") or {}).items()}
+        users = reactions.setdefault(emoji, [])
+        if username in users:
+            users.remove(username)
+            if not users:
+                del reactions[emoji]
+        else:
+            users.append(username)
+        msg["reactions"] = reactions
+        return msg
+
+    _patch(message_id, patch)
+
+
+def add_reader(message_id: str, username: str) -> None:
+    def patch(msg: dict[str, Any]) -> dict[str, Any]:
+        if username not in (msg.get("read_by") or []):
+            msg["read_by"] = [*(msg.get("read_by") or []), username]
+        return msg
+
+    _patch(message_id, patch)
+
+
+def set_readers(message_id: str, read_by: list[str]) -> None:
+    def patch(msg: dict[str, Any]) -> dict[str, Any]:
+        msg["read_by"] = list(read_by)
+        return msg
+
+    _patch(message_id, patch)
+
+
+def drop_room(room_id: str) -> None:
+    with _lock:
+        _drop_room_locked(room_id)
+
+
+def drop_rooms_with_messages(message_ids: Iterable[str]) -> None:
+    with _lock:
+        rooms = {_room_by_message.get(mid) for mid in message_ids}
+        for room_id in rooms:
+            if room_id:
+                _drop_room_locked(room_id)
+            else:
+                _bump_unplaced_locked()
+
+
+def on_invalidate(tags: list[str] | None) -> None:
+    """Слушатель шины ``facade_cache``: изменения, сделанные другим воркером."""
+    if tags is None:
+        clear_recent_messages()
+        return
+    for tag in tags:
+        if tag.startswith(ROOM_TAG_PREFIX):
+            drop_room(tag[len(ROOM_TAG_PREFIX) :])
+        elif tag.startswith(MESSAGE_TAG_PREFIX):
+            drop_rooms_with_messages([tag[len(MESSAGE_TAG_PREFIX) :]])
+
+
+def stats() -> dict[str, int]:
+    with _lock:
+        return {
+            "rooms": len(_rooms),
+            "messages": len(_room_by_message),
+            "max_rooms": RECENT_ROOMS_MAX,
+            "per_room": RECENT_MESSAGES_PER_ROOM,
+        }
+
+
+def clear_recent_messages() -> None:
+    with _lock:
+        for room_id in list(_rooms):
+            _drop_room_locked(room_id)
+        _bump_unplaced_locked()
@@ -1,22 +1,40 @@
-"""Подключение онлайн-сокетов участников комнаты для доставки серверных событий.
-
-Без этого ``socketio.emit(event, room=room_id)`` не дойдёт до тех пользователей,
-чей ``sid`` ещё не был подключён к соответствующей Socket.IO-комнате (например,
-после `connect`, но до первого `join` по конкретной комнате, либо в случае
-отложенной отправки, когда автор сообщения не держит чат открытым).
+"""Доставка серверных событий участникам комнаты.
+
+Сокет подписан только на личную комнату ``user:<логин>`` и на чат, открытый
+сейчас (``join`` -> ``set_active_room``; прежний открытый чат при этом
+покидается). Пользователь в сотнях чатов при подключении ни во что больше не
+входит, а сервер хранит по одной-две комнаты на sid.
+
+События открытого чата (сообщения, реакции, правки, набор текста) — один
+``emit(to=room)``. Остальным участникам уходит лёгкое ``inbox_update`` в личные
+комнаты (``emit_inbox_update``): клиенту достаточно его, чтобы поднять счётчик
+непрочитанного и обновить превью в списке чатов. Раз в
+``ROOM_RECONCILE_INTERVAL_SEC`` сверка (``reconcile_room_subscriptions``)
+убирает из комнат sid, потерявшие доступ, и возвращает выпавшие.
 """
 
 from __future__ import annotations
 
+import threading
 import time
 from collections.abc import Iterable
 from typing import Any
 
 import db
+from utils.facade_cache import facade_cache
 
 ROOM_AUDIENCE_CACHE_TTL_SEC = 10
+ROOM_RECONCILE_INTERVAL_SEC = 300
+USER_ROOM_PREFIX = "user:"
 _room_audience_cache: dict[str, tuple[float, list[str]]] = {}
 
+_socketio: Any = None
+_presence: Any = None
+_active_lock = threading.Lock()
+# Открытый сейчас чат каждого sid этого воркера (и обратный индекс).
+_active_room_by_sid: dict[str, str] = {}
+_active_sids_by_room: dict[str, set[str]] = {}
+
 
 def _iter_private_party_usernames(room_id: str) -> Iterable[str]:
     prefix = "private_"
@@ -46,6 +64,24 @@ def clear_room_audience_cache(room_id: str | None = None) -> None:
     _room_audience_cache.clear()
 
 
+def _on_facade_invalidate(tags: list[str] | None) -> None:
+    """Состав группы поменяли (возможно, в другом воркере) — сбросить аудиторию."""
+    if tags is None:
+        clear_room_audience_cache()
+        return
+    for tag in tags:
+        if tag.startswith("room:"):
+            clear_room_audience_cache(tag[len("room:") :])
+
+
+facade_cache.add_invalidation_listener(_on_facade_invalidate)
+
+
+def user_room(username: str) -> str:
+    """Личная Socket.IO-комната всех устройств пользователя."""
+    return f"{USER_ROOM_PREFIX}{username}"
+
+
 def room_audience_usernames(room_id: str) -> list[str]:
     """Логины всех предполагаемых получателей сообщений в комнате."""
     if not room_id:
@@ -57,22 +93,133 @@ def room_audience_usernames(room_id: str) -> list[str]:
     return []
 
 
-def ensure_online_members_in_room(socketio: Any, app: Any, room_id: str) -> None:
-    """Все онлайн-сокеты получателей комнаты подключаются к Socket.IO-комнате.
+def bind_room_delivery(socketio: Any, presence: Any) -> None:
+    """Wire the Socket.IO server and presence registry from the app factory."""
+    global _socketio, _presence
+    _socketio = socketio
+    _presence = presence
+    with _active_lock:
+        _active_room_by_sid.clear()
+        _active_sids_by_room.clear()
 
-    Безопасно вызывать повторно: ``enter_room`` идемпотентен для уже подписанных sid.
-    """
-    if not room_id:
-        return
-    user_connections = app.extensions.get("nebula_user_connections") or {}
-    if not any(user_connections.values()):
-        return
-    usernames = room_audience_usernames(room_id)
-    if not usernames:
+
+def _unlink_active_locked(sid: str) -> str | None:
+    room_id = _active_room_by_sid.pop(sid, None)
+    if room_id is not None:
+        sids = _active_sids_by_room.get(room_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del _active_sids_by_room[room_id]
+    return room_id
+
+
+def set_active_room(sid: str, room_id: str) -> None:
+    """Сокет открыл комнату: подписать на неё и отписать от прежней."""
+    if _socketio is None:
         return
-    for uname in usernames:
-        for sid in list(user_connections.get(uname, ())):
+    with _active_lock:
+        previous = _unlink_active_locked(sid)
+        _active_room_by_sid[sid] = room_id
+        _active_sids_by_room.setdefault(room_id, set()).add(sid)
+    srv = _socketio.server
+    if previous and previous != room_id:
+        srv.leave_room(sid, previous, namespace="/")
+    srv.enter_room(sid, room_id, namespace="/")
+
+
+def active_room(sid: str) -> str | None:
+    return _active_room_by_sid.get(sid)
+
+
+def forget_sid(sid: str) -> None:
+    with _active_lock:
+        _unlink_active_locked(sid)
+
+
+def active_room_stats() -> dict[str, int]:
+    with _active_lock:
+        return {
+            "active_sids": len(_active_room_by_sid),
+            "active_rooms": len(_active_sids_by_room),
+        }
+
+
+def _desired_local_sids(room_id: str) -> set[str]:
+    """Сокеты этого воркера, у которых комната открыта и ещё есть к ней доступ."""
+    with _active_lock:
+        sids = list(_active_sids_by_room.get(room_id, ()))
+    if not sids:
+        return set()
+    audience = set(room_audience_usernames(room_id))
+    manager = _socketio.server.manager
+    return {
+        sid
+        for sid in sids
+        if _presence.username_for(sid) in audience and manager.is_connected(sid, "/")
+    }
+
+
+def reconcile_room_subscriptions() -> dict[str, int]:
+    """Сверить Socket.IO-комнаты этого воркера с открытыми комнатами сокетов.
+
+    Убирает sid, потерявшие доступ (или открывшие другую комнату без
+    ``leave``), и возвращает тех, кто выпал из комнаты по ошибке.
+    """
+    entered = left = 0
+    if _socketio is None or _presence is None:
+        return {"rooms": 0, "entered": 0, "left": 0}
+    srv = _socketio.server
+    manager = srv.manager
+    with _active_lock:
+        active_rooms = set(_active_sids_by_room)
+    rooms = active_rooms | {
+        r
+        for r in list(manager.rooms.get("/", {}))
+        if isinstance(r, str) and r.startswith(("room_", "private_"))
+    }
+    for room_id in rooms:
+        clear_room_audience_cache(room_id)
+        desired = _desired_local_sids(room_id)
+        current = {sid for sid, _eio_sid in manager.get_participants("/", room_id)}
+        for sid in desired - current:
+            srv.enter_room(sid, room_id, namespace="/")
+            entered += 1
+        for sid in current - desired:
+            srv.leave_room(sid, room_id, namespace="/")
+            left += 1
+    return {"rooms": len(rooms), "entered": entered, "left": left}
+
+
+def start_room_reconciler(app: Any, interval_sec: int = ROOM_RECONCILE_INTERVAL_SEC) -> None:
+    def loop() -> None:
+        while True:
+            time.sleep(interval_sec)
             try:
-                socketio.server.enter_room(sid, room_id, namespace="/")
+                with app.app_context():
+                    result = reconcile_room_subscriptions()
+                if result["entered"] or result["left"]:
+                    app.logger.info("Сверка подписок на комнаты: %s", result)
             except Exception:
-                pass
+                app.logger.warning("Сверка подписок на комнаты не удалась", exc_info=True)
+
+    threading.Thread(target=loop, name="room-reconciler", daemon=True).start()
+
+
+def emit_to_users(
+    socketio: Any, app: Any, usernames: Iterable[str], event: str, payload: Any
+) -> None:
+    """Одно событие всем устройствам перечисленных пользователей (без broadcast)."""
+    _ = app
+    targets = [user_room(un) for un in dict.fromkeys(usernames) if un]
+    if not targets:
+        return
+    socketio.emit(event, payload, to=targets, namespace="/")
+
+
+def emit_inbox_update(socketio: Any, room_id: str, payload: dict[str, Any]) -> None:
+    """Дельта для списка чатов всем участникам комнаты (открыт чат или нет)."""
+    targets = [user_room(un) for un in room_audience_usernames(room_id)]
+    if not targets:
+        return
+    socketio.emit("inbox_update", {"room": room_id, **payload}, to=targets, namespace="/")
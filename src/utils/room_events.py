@@ -0,0 +1,316 @@
+"""Журнал событий комнаты с порядковыми номерами: догонка после обрыва связи.
+
+Каждое событие открытого чата (новое сообщение, правка, удаление, реакция,
+отметка о прочтении, закрепление) получает в своей комнате номер ``seq`` и метку ``epoch`` и
+попадает в ограниченный журнал (``ROOM_EVENT_LOG_SIZE`` последних событий; в
+памяти или в Redis — общий для всех воркеров). Клиент помнит последний
+увиденный номер и после переподключения шлёт ``resync`` (а при возврате в
+недавно открытый чат — ``join`` с тем же курсором): сервер досылает только
+пропущенное. Если журнал этого не покрывает (разрыв длиннее журнала,
+другая ``epoch`` после рестарта или вытеснения комнаты), клиент получает
+обычную ``message_history``.
+"""
+
+from __future__ import annotations
+
+import json
+import secrets
+import threading
+from collections import OrderedDict, deque
+from functools import partial
+from typing import Any, Protocol
+
+from utils.outbound_batch import Merge, emit_coalesced, flush_room
+
+KEY_PREFIX = "nebula:roomlog:"
+ROOM_EVENT_LOG_SIZE = 256
+ROOM_EVENT_LOG_MAX_ROOMS = 5000
+ROOM_EVENT_LOG_TTL_SEC = 24 * 3600
+
+RoomEvent = tuple[str, dict[str, Any]]
+
+
+class RoomEventLog(Protocol):
+    def append(self, room_id: str, event: str, payload: dict[str, Any]) -> dict[str, Any]:
+        """Присвоить событию номер; вернуть payload с ``room``, ``seq`` и ``epoch``."""
+
+    def head(self, room_id: str) -> tuple[str, int]:
+        """``(epoch, seq)`` последнего события комнаты."""
+
+    def since(self, room_id: str, epoch: str, seq: int) -> list[RoomEvent] | None:
+        """События после ``seq`` или None, если журнал их уже не покрывает."""
+
+    def stats(self) -> dict[str, Any]: ...
+
+    def clear_all(self) -> None: ...
+
+
+def _new_epoch() -> str:
+    return secrets.token_hex(4)
+
+
+def _stamp(room_id: str, payload: dict[str, Any], epoch: str, seq: int) -> dict[str, Any]:
+    return {"room": room_id, **payload, "seq": seq, "epoch": epoch}
+
+
+class _RoomLog:
+    __slots__ = ("epoch", "seq", "events")
+
+    def __init__(self, size: int) -> None:
+        self.epoch = _new_epoch()
+        self.seq = 0
+        self.events: deque[tuple[int, str, dict[str, Any]]] = deque(maxlen=size)
+
+
+class MemoryRoomEventLog:
+    def __init__(
+        self, size: int = ROOM_EVENT_LOG_SIZE, max_rooms: int = ROOM_EVENT_LOG_MAX_ROOMS
+    ) -> None:
+        self._size = size
+        self._max_rooms = max_rooms
+        self._lock = threading.Lock()
+        self._rooms: OrderedDict[str, _RoomLog] = OrderedDict()
+        self.appended = 0
+        self.gaps = 0
+
+    def _room_locked(self, room_id: str) -> _RoomLog:
+        log = self._rooms.get(room_id)
+        if log is None:
+            # Вытесненная комната начнёт новую epoch — клиенты перечитают историю.
+            log = self._rooms[room_id] = _RoomLog(self._size)
+            while len(self._rooms) > self._max_rooms:
+                self._rooms.popitem(last=False)
+        else:
+            self._rooms.move_to_end(room_id)
+        return log
+
+    def append(self, room_id: str, event: str, payload: dict[str, Any]) -> dict[str, Any]:
+        with self._lock:
+            log = self._room_locked(room_id)
+            log.seq += 1
+            data = _stamp(room_id, payload, log.epoch, log.seq)
+            log.events.append((log.seq, event, data))
+            self.appended += 1
+            return data
+
+    def head(self, room_id: str) -> tuple[str, int]:
+        with self._lock:
+            log = self._room_locked(room_id)
+            return log.epoch, log.seq
+
+    def since(self, room_id: str, epoch: str, seq: int) -> list[RoomEvent] | None:
+        with self._lock:
+            log = self._rooms.get(room_id)
+            if log is None or log.epoch != epoch or seq > log.seq:
+                self.gaps += 1
+                return None
+            if seq == log.seq:
+                return []
+            if not log.events or log.events[0][0] > seq + 1:
+                self.gaps += 1
+                return None
+            return [(event, data) for s, event, data in log.events if s > seq]
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "rooms": len(self._rooms),
+                "appended": self.appended,
+                "gaps": self.gaps,
+            }
+
+    def clear_all(self) -> None:
+        with self._lock:
+            self._rooms.clear()
+
+
+# KEYS: meta, events; ARGV: epoch для новой комнаты, событие (JSON), размер, TTL.
+_APPEND_LUA = """
+local epoch = redis.call('HGET', KEYS[1], 'epoch')
+if not epoch then
+  epoch = ARGV[1]
+  redis.call('HSET', KEYS[1], 'epoch', epoch, 'seq', 0)
+end
+local seq = redis.call('HINCRBY', KEYS[1], 'seq', 1)
+redis.call('ZADD', KEYS[2], seq, seq .. ':' .. ARGV[2])
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -(tonumber(ARGV[3]) + 1))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return {epoch, seq}
+"""
+
+
+class RedisRoomEventLog:
+    def __init__(self, url: str, size: int = ROOM_EVENT_LOG_SIZE) -> None:
+        import redis
+
+        self._r = redis.from_url(url, decode_responses=True)
+        self._r.ping()
+        self._size = size
+        self._append = self._r.register_script(_APPEND_LUA)
+        self.appended = 0
+        self.gaps = 0
+
+    def _keys(self, room_id: str) -> tuple[str, str]:
+        return f"{KEY_PREFIX}{room_id}:meta", f"{KEY_PREFIX}{room_id}:events"
+
+    def append(self, room_id: str, event: str, payload: dict[str, Any]) -> dict[str, Any]:
+        raw = json.dumps({"event": event, "data": payload}, default=str)
+        epoch, seq = self._append(
+            keys=list(self._keys(room_id)),
+            args=[_new_epoch(), raw, self._size, ROOM_EVENT_LOG_TTL_SEC],
+        )
+        self.appended += 1
+        return _stamp(room_id, payload, str(epoch), int(seq))
+
+    def head(self, room_id: str) -> tuple[str, int]:
+        meta_key, _ = self._keys(room_id)
+        if self._r.hsetnx(meta_key, "epoch", _new_epoch()):
+            self._r.expire(meta_key, ROOM_EVENT_LOG_TTL_SEC)
+        epoch, seq = self._r.hmget(meta_key, "epoch", "seq")
+        return str(epoch), int(seq or 0)
+
+    def since(self, room_id: str, epoch: str, seq: int) -> list[RoomEvent] | None:
+        meta_key, events_key = self._keys(room_id)
+        cur_epoch, cur_seq = self._r.hmget(meta_key, "epoch", "seq")
+        head = int(cur_seq or 0)
+        if cur_epoch != epoch or seq > head:
+            self.gaps += 1
+            return None
+        if seq == head:
+            return []
+        out: list[RoomEvent] = []
+        expected = seq + 1
+        for member, score in self._r.zrangebyscore(
+            events_key, f"({seq}", "+inf", withscores=True
+        ):
+            if int(score) != expected:
+                break
+            try:
+                item = json.loads(member.split(":", 1)[1])
+            except (IndexError, json.JSONDecodeError):
+                break
+            out.append((item["event"], _stamp(room_id, item["data"], epoch, expected)))
+            expected += 1
+        if expected <= head:
+            # Начало пропуска уже вытеснено из журнала (или ключ истёк).
+            self.gaps += 1
+            return None
+        return out
+
+    def stats(self) -> dict[str, Any]:
+        return {"backend": "redis", "appended": self.appended, "gaps": self.gaps}
+
+    def clear_all(self) -> None:
+        batch: list[str] = []
+        for key in self._r.scan_iter(match=f"{KEY_PREFIX}*", count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                self._r.delete(*batch)
+                batch.clear()
+        if batch:
+            self._r.delete(*batch)
+
+
+def build_room_event_log(redis_url: str | None, app_logger) -> RoomEventLog:
+    if redis_url:
+        try:
+            log = RedisRoomEventLog(redis_url)
+            app_logger.info(
+                "Журнал событий комнат: Redis (%s)",
+                redis_url.split("@")[-1] if "@" in redis_url else redis_url,
+            )
+            return log
+        except Exception as e:
+            app_logger.warning("Redis для журнала событий недоступен, используется память: %s", e)
+    return MemoryRoomEventLog()
+
+
+_socketio: Any = None
+_log: RoomEventLog | None = None
+_locks: Any = None
+_replays = 0
+_replayed_events = 0
+
+
+def bind_room_events(socketio: Any, log: RoomEventLog, locks: Any) -> None:
+    """Wire the Socket.IO server, event log and emit lock from the app factory."""
+    global _socketio, _log, _locks
+    _socketio = socketio
+    _log = log
+    _locks = locks
+
+
+def publish_room_event(
+    room_id: str,
+    event: str,
+    payload: dict[str, Any],
+    *,
+    coalesce_key: str | None = None,
+    merge: Merge | None = None,
+    skip_sid: str | None = None,
+) -> dict[str, Any]:
+    """Записать событие в журнал комнаты и разослать её участникам.
+
+    Номер присваивается и событие уходит под замком комнаты. С ``coalesce_key``
+    событие ждёт ближайшего ``batch`` (см. ``outbound_batch``) и получает номер
+    только при его отправке — слитые повторы номеров не занимают, а вернётся
+    ``payload`` без ``seq``. Перед срочным событием накопленная пачка комнаты
+    нумеруется и досылается сразу. Так соединения одного процесса получают
+    события комнаты по возрастанию ``seq``; события из разных воркеров могут
+    прийти вразнобой, поэтому клиент двигает курсор только по непрерывным
+    ``seq`` (``advanceCursor`` в ``static/js/room-sync.js``).
+    ``skip_sid`` — соединение, которому событие не шлём (отправитель получит
+    подтверждение); в журнал оно попадает как обычно.
+    """
+
+    if _log is None or _locks is None:
+        if coalesce_key is None:
+            flush_room(room_id)
+            _socketio.emit(event, payload, to=room_id, namespace="/", skip_sid=skip_sid)
+        else:
+            emit_coalesced(room_id, event, payload, coalesce_key, merge, skip_sid)
+        return payload
+    with _locks.hold([room_id]):
+        if coalesce_key is not None:
+            emit_coalesced(
+                room_id,
+                event,
+                payload,
+                coalesce_key,
+                merge,
+                skip_sid,
+                stamp=partial(_log.append, room_id),
+            )
+            return payload
+        flush_room(room_id)
+        data = _log.append(room_id, event, payload)
+        _socketio.emit(event, data, to=room_id, namespace="/", skip_sid=skip_sid)
+    return data
+
+
+def room_event_head(room_id: str) -> tuple[str, int] | None:
+    return _log.head(room_id) if _log is not None else None
+
+
+def room_events_since(room_id: str, epoch: str, seq: int) -> list[RoomEvent] | None:
+    global _replays, _replayed_events
+    if _log is None:
+        return None
+    events = _log.since(room_id, epoch, seq)
+    if events is not None:
+        _replays += 1
+        _replayed_events += len(events)
+    return events
+
+
+def room_event_stats() -> dict[str, Any]:
+    if _log is None:
+        return {}
+    return {**_log.stats(), "replays": _replays, "replayed_events": _replayed_events}
+
+
+def clear_room_events() -> None:
+    if _log is not None:
+        _log.clear_all()
@@ -0,0 +1,173 @@
+"""Resumable socket session tickets: in-memory or Redis (shared across workers).
+
+При подключении сокет получает одноразовый билет. Если клиент переподключается
+в течение ``RESUME_TICKET_TTL_SEC`` (обрыв связи, деплой), он предъявляет билет
+вместе с токеном, и сервер восстанавливает сессию без запросов к MySQL:
+пользователь уже проверен, открытый чат берётся из билета.
+"""
+
+from __future__ import annotations
+
+import json
+import secrets
+import threading
+import time
+from typing import Protocol
+
+KEY_PREFIX = "nebula:resume:"
+RESUME_TICKET_TTL_SEC = 300
+
+
+class SessionTicketStore(Protocol):
+    def issue(self, username: str, room: str | None = None) -> str: ...
+
+    def park(
+        self, ticket: str, username: str, room: str | None, *, stale: bool = False
+    ) -> None:
+        """Save the state of a closed socket under its ticket (TTL restarts).
+
+        ``stale`` — the socket lost events (slow consumer): the resumed session
+        must resync its room in full.
+        """
+
+    def peek(self, ticket: str) -> dict | None:
+        """Like :meth:`take`, but the ticket stays valid."""
+
+    def take(self, ticket: str) -> dict | None:
+        """Return and invalidate ``{"username", "room", "stale"}`` or None."""
+
+    def clear_all(self) -> None: ...
+
+
+def _new_ticket() -> str:
+    return secrets.token_urlsafe(24)
+
+
+class MemorySessionTicketStore:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._data: dict[str, tuple[float, dict]] = {}
+
+    def _put(
+        self, ticket: str, username: str, room: str | None, stale: bool = False
+    ) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if len(self._data) > 1000:
+                for t in [t for t, (exp, _) in self._data.items() if exp <= now]:
+                    del self._data[t]
+            self._data[ticket] = (
+                now + RESUME_TICKET_TTL_SEC,
+                {"username": username, "room": room, "stale": stale},
+            )
+
+    def issue(self, username: str, room: str | None = None) -> str:
+        ticket = _new_ticket()
+        self._put(ticket, username, room)
+        return ticket
+
+    def park(
+        self, ticket: str, username: str, room: str | None, *, stale: bool = False
+    ) -> None:
+        self._put(ticket, username, room, stale)
+
+    def peek(self, ticket: str) -> dict | None:
+        if not ticket:
+            return None
+        with self._lock:
+            item = self._data.get(ticket)
+        if item is None or item[0] <= time.monotonic():
+            return None
+        return dict(item[1])
+
+    def take(self, ticket: str) -> dict | None:
+        if not ticket:
+            return None
+        with self._lock:
+            item = self._data.pop(ticket, None)
+        if item is None or item[0] <= time.monotonic():
+            return None
+        return item[1]
+
+    def clear_all(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class RedisSessionTicketStore:
+    def __init__(self, url: str) -> None:
+        import redis
+
+        self._r = redis.from_url(url, decode_responses=True)
+        self._prefix = KEY_PREFIX
+
+    def _put(
+        self, ticket: str, username: str, room: str | None, stale: bool = False
+    ) -> None:
+        payload = json.dumps({"username": username, "room": room, "stale": stale})
+        self._r.setex(f"{self._prefix}{ticket}", RESUME_TICKET_TTL_SEC, payload)
+
+    def issue(self, username: str, room: str | None = None) -> str:
+        ticket = _new_ticket()
+        self._put(ticket, username, room)
+        return ticket
+
+    def park(
+        self, ticket: str, username: str, room: str | None, *, stale: bool = False
+    ) -> None:
+        self._put(ticket, username, room, stale)
+
+    def peek(self, ticket: str) -> dict | None:
+        if not ticket:
+            return None
+        return self._decode(self._r.get(f"{self._prefix}{ticket}"))
+
+    def take(self, ticket: str) -> dict | None:
+        if not ticket:
+            return None
+        key = f"{self._prefix}{ticket}"
+        pipe = self._r.pipeline(transaction=True)
+        pipe.get(key)
+        pipe.delete(key)
+        return self._decode(pipe.execute()[0])
+
+    @staticmethod
+    def _decode(raw: str | None) -> dict | None:
+        if not raw:
+            return None
+        try:
+            data = json.loads(raw)
+        except (json.JSONDecodeError, TypeError):
+            return None
+        if not isinstance(data, dict) or not data.get("username"):
+            return None
+        return {
+            "username": data["username"],
+            "room": data.get("room"),
+            "stale": bool(data.get("stale")),
+        }
+
+    def clear_all(self) -> None:
+        pattern = f"{self._prefix}*"
+        batch: list[str] = []
+        for key in self._r.scan_iter(match=pattern, count=500):
+            batch.append(key)
+            if len(batch) >= 500:
+                self._r.delete(*batch)
+                batch.clear()
+        if batch:
+            self._r.delete(*batch)
+
+
+def build_session_ticket_store(redis_url: str | None, app_logger) -> SessionTicketStore:
+    if redis_url:
+        try:
+            store = RedisSessionTicketStore(redis_url)
+            app_logger.info(
+                "Билеты возобновления сессий: Redis (%s)",
+                redis_url.split("@")[-1] if "@" in redis_url else redis_url,
+            )
+            return store
+        except Exception as e:
+            app_logger.warning("Redis для билетов сессий недоступен, используется память: %s", e)
+    return MemorySessionTicketStore()
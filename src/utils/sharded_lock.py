@@ -0,0 +1,52 @@
+"""Набор замков, разбитых по ключам (комнатам, sid Engine.IO).
+
+Вместо одного замка на процесс ключ хэшируется в один из ``shards`` RLock:
+операции над разными комнатами почти никогда не ждут друг друга, а над одной
+комнатой по-прежнему идут строго по очереди. Несколько ключей захватываются в
+порядке номеров шардов, поэтому взаимная блокировка невозможна.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections.abc import Hashable, Iterable, Iterator
+from contextlib import contextmanager
+
+DEFAULT_SHARDS = 64
+
+
+class ShardedLock:
+    def __init__(self, shards: int = DEFAULT_SHARDS) -> None:
+        self._locks = [threading.RLock() for _ in range(max(1, shards))]
+        self.acquisitions = 0
+        self.contended = 0
+
+    def _indexes(self, keys: Iterable[Hashable] | None) -> list[int]:
+        n = len(self._locks)
+        if keys is None:
+            return list(range(n))
+        return sorted({hash(k) % n for k in keys})
+
+    @contextmanager
+    def hold(self, keys: Iterable[Hashable] | None) -> Iterator[None]:
+        """Захватить шарды ключей; ``None`` — все шарды (широковещательная операция)."""
+        taken: list[threading.RLock] = []
+        try:
+            for i in self._indexes(keys):
+                lock = self._locks[i]
+                if not lock.acquire(blocking=False):
+                    self.contended += 1
+                    lock.acquire()
+                taken.append(lock)
+            self.acquisitions += 1
+            yield
+        finally:
+            for lock in reversed(taken):
+                lock.release()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "shards": len(self._locks),
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+        }
@@ -0,0 +1,126 @@
+"""Single-flight: одинаковые одновременные чтения выполняются один раз.
+
+Первый вызов с ключом становится «ведущим» и идёт в БД, остальные ждут его
+результат (или исключение). Кэшем это не является: как только ведущий
+закончил, следующий вызов снова пойдёт в БД. Результат общий для всех
+ожидающих — менять его на месте нельзя, фильтрацию под зрителя делайте на копии.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections.abc import Callable, Hashable, Iterable, Mapping
+from typing import Any
+
+
+class _Call:
+    __slots__ = ("done", "value", "error", "token")
+
+    def __init__(self, token: Hashable) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: BaseException | None = None
+        self.token = token
+
+    def result(self) -> Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def _finish(self, key: Hashable, call: _Call) -> None:
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    def do(
+        self, key: Hashable, fn: Callable[[], Any], *, token: Hashable = None
+    ) -> tuple[Any, bool]:
+        """Вернуть ``(результат, shared)``; ``shared`` — дождались чужого вызова.
+
+        ``token`` отличает «поколения» данных: вызов, начатый с другим токеном
+        (например, до инвалидации), не переиспользуется.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.token == token:
+                self.shared += 1
+                leader = False
+            else:
+                call = _Call(token)
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+        if not leader:
+            return call.result(), True
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+        return call.value, False
+
+    def do_many(
+        self,
+        keys: Iterable[Hashable],
+        fn: Callable[[list[Hashable]], Mapping[Hashable, Any]],
+    ) -> dict[Hashable, Any]:
+        """Пакетный вариант: ключи, уже загружаемые другими, не запрашиваются.
+
+        ``fn`` получает только «свои» ключи и возвращает ``{key: value}``;
+        отсутствующие в ответе ключи получают ``None``.
+        """
+        owned: dict[Hashable, _Call] = {}
+        joined: dict[Hashable, _Call] = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is not None and call.token is None:
+                    joined[key] = call
+                else:
+                    call = _Call(None)
+                    self._calls[key] = call
+                    owned[key] = call
+            if owned:
+                self.leaders += 1
+            self.shared += len(joined)
+
+        if owned:
+            try:
+                loaded = fn(list(owned)) or {}
+                for key, call in owned.items():
+                    call.value = loaded.get(key)
+            except BaseException as e:
+                for call in owned.values():
+                    call.error = e
+                raise
+            finally:
+                for key, call in owned.items():
+                    self._finish(key, call)
+
+        out = {key: call.value for key, call in owned.items()}
+        for key, call in joined.items():
+            out[key] = call.result()
+        return out
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "shared": self.shared,
+                "in_flight": len(self._calls),
+            }
@@ -0,0 +1,201 @@
+"""Параллельная обработка событий Socket.IO с сохранением порядка внутри sid.
+
+При ``async_handlers=False`` python-socketio выполняет обработчик прямо в
+потоке, принявшем пакет, и медленное событие (история при ``join``,
+декодирование 20 МБ base64 в ``send_message``) задерживает остальные. Здесь
+события уходят в ограниченный пул потоков:
+
+* у каждого соединения своя FIFO-очередь, одновременно выполняется не больше
+  одного его события — отправка не обгонит собственную правку; ``disconnect``
+  идёт через ту же очередь и не опередит ещё не обработанный ``user_online``;
+* тяжёлые типы событий дополнительно ограничены ``SOCKET_EVENT_LIMITS``:
+  соединение, чьё очередное событие упёрлось в лимит, откладывается и не
+  держит поток пула — освободившийся слот передаётся ему напрямую;
+* глубина очередей, ожидание и число отброшенных событий видны в ``stats()``.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+# Одновременно выполняемых событий данного типа на процесс.
+SOCKET_EVENT_LIMITS = {
+    "send_message": 8,
+    "join": 8,
+    "mark_read_batch": 4,
+}
+# Сверх этого события соединения отбрасываются (клиент шлёт быстрее, чем мы успеваем).
+MAX_PENDING_PER_SID = 256
+
+
+class _EventStats:
+    __slots__ = ("handled", "running", "max_running", "wait_ms_total", "run_ms_total")
+
+    def __init__(self) -> None:
+        self.handled = 0
+        self.running = 0
+        self.max_running = 0
+        self.wait_ms_total = 0.0
+        self.run_ms_total = 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        n = self.handled or 1
+        return {
+            "handled": self.handled,
+            "running": self.running,
+            "max_running": self.max_running,
+            "avg_wait_ms": round(self.wait_ms_total / n, 2),
+            "avg_run_ms": round(self.run_ms_total / n, 2),
+        }
+
+
+class SocketEventDispatcher:
+    def __init__(self, workers: int, logger: Any = None) -> None:
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="socket-event"
+        )
+        self._workers = max(1, workers)
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._queues: dict[str, deque[tuple[str, float, Callable[[], Any]]]] = {}
+        self._limits = dict(SOCKET_EVENT_LIMITS)
+        # Занятые слоты ограниченных типов и соединения, ждущие слота (FIFO).
+        self._active: dict[str, int] = {}
+        self._parked: dict[str, deque[str]] = {}
+        self._events: dict[str, _EventStats] = {}
+        self.pending = 0
+        self.max_pending = 0
+        self.max_sid_depth = 0
+        self.dropped = 0
+        self.deferred = 0
+
+    def submit(
+        self, key: str, event: str, fn: Callable[[], Any], *, force: bool = False
+    ) -> bool:
+        """Поставить ``fn`` в очередь соединения ``key``; ``False`` — очередь переполнена."""
+        with self._lock:
+            queue = self._queues.get(key)
+            if not force and queue is not None and len(queue) >= MAX_PENDING_PER_SID:
+                self.dropped += 1
+                return False
+            start = queue is None
+            if queue is None:
+                queue = self._queues[key] = deque()
+            queue.append((event, time.monotonic(), fn))
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+            self.max_sid_depth = max(self.max_sid_depth, len(queue))
+        if start:
+            self._pool.submit(self._drain, key)
+        return True
+
+    def _drain(self, key: str, has_slot: bool = False) -> None:
+        """Выполнять события соединения по порядку; ``has_slot`` — слот лимита уже передан."""
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    # Очередь пуста — соединение снова «свободно», следующее событие запустит drain.
+                    del self._queues[key]
+                    return
+                event, queued_at, fn = queue[0]
+                limited = event in self._limits
+                if limited and not has_slot:
+                    if self._active.get(event, 0) >= self._limits[event]:
+                        # Лимит занят: соединение ждёт слота, поток пула уходит к другим.
+                        self._parked.setdefault(event, deque()).append(key)
+                        self.deferred += 1
+                        return
+                    self._active[event] = self._active.get(event, 0) + 1
+                has_slot = False
+            handoff = None
+            try:
+                self._run(event, queued_at, fn)
+            finally:
+                if limited:
+                    handoff = self._release_slot(event)
+                with self._lock:
+                    queue.popleft()
+                    self.pending -= 1
+            if handoff is not None:
+                self._pool.submit(self._drain, handoff, True)
+
+    def _release_slot(self, event: str) -> str | None:
+        """Отдать слот ``event`` первому ждущему соединению (его и вернуть) или освободить."""
+        with self._lock:
+            parked = self._parked.get(event)
+            if parked:
+                key = parked.popleft()
+                if not parked:
+                    del self._parked[event]
+                return key
+            self._active[event] -= 1
+            return None
+
+    def _run(self, event: str, queued_at: float, fn: Callable[[], Any]) -> None:
+        started = time.monotonic()
+        with self._lock:
+            st = self._events.setdefault(event, _EventStats())
+            st.running += 1
+            st.max_running = max(st.max_running, st.running)
+        try:
+            fn()
+        except Exception:
+            if self._logger is not None:
+                self._logger.error("Socket event %s failed", event, exc_info=True)
+        finally:
+            finished = time.monotonic()
+            with self._lock:
+                st.running -= 1
+                st.handled += 1
+                st.wait_ms_total += (started - queued_at) * 1000
+                st.run_ms_total += (finished - started) * 1000
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self._workers,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "busy_sids": len(self._queues),
+                "max_sid_depth": self.max_sid_depth,
+                "dropped": self.dropped,
+                "parked_sids": sum(len(q) for q in self._parked.values()),
+                "deferred": self.deferred,
+                "events": {name: st.as_dict() for name, st in self._events.items()},
+            }
+
+
+def install_socket_dispatcher(
+    socketio: Any, workers: int, logger: Any = None
+) -> SocketEventDispatcher:
+    """Перенаправить события и отключения сервера Socket.IO в диспетчер."""
+    dispatcher = SocketEventDispatcher(workers, logger)
+    srv = socketio.server
+    handle_event = srv._handle_event
+    handle_disconnect = srv._handle_disconnect
+
+    def _handle_event(eio_sid, namespace, id, data):
+        event = data[0] if data and isinstance(data[0], str) else "?"
+        if not dispatcher.submit(
+            eio_sid, event, lambda: handle_event(eio_sid, namespace, id, data)
+        ) and logger is not None:
+            logger.warning("Очередь событий %s переполнена, %s отброшено", eio_sid, event)
+
+    def _handle_disconnect(eio_sid, namespace, reason=None):
+        # Отключение не отбрасываем: иначе пользователь «застрянет» в онлайне.
+        dispatcher.submit(
+            eio_sid,
+            "disconnect",
+            lambda: handle_disconnect(eio_sid, namespace, reason),
+            force=True,
+        )
+
+    srv._handle_event = _handle_event
+    srv._handle_disconnect = _handle_disconnect
+    return dispatcher
@@ -0,0 +1,137 @@
+"""Сериализация пакетов Socket.IO: JSON по умолчанию, MessagePack — по выбору клиента.
+
+Клиент, подключившийся с ``?serializer=msgpack``, шлёт и получает бинарные кадры
+MessagePack (без base64 и экранирования строк), остальные — обычный текстовый
+JSON. Сервер один: входящий бинарный кадр вне вложений JSON-пакета — это
+MessagePack, а исходящий пакет кодируется в JSON как раньше и при первой
+отправке msgpack-клиенту получает бинарного «двойника», общего для всех таких
+получателей эмита. ``msgpack`` — необязательная зависимость: без неё сервер
+поддерживает только JSON и не объявляет ``msgpack`` клиентам в ``/api/me``.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+from urllib.parse import parse_qs
+
+from engineio import packet as eio_packet
+from socketio import packet
+
+from utils.backpressure import backpressure_installed
+from utils.json_provider import json_default
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - зависит от окружения
+    msgpack = None
+
+SERIALIZER_QUERY = "serializer"
+_ENVIRON_KEY = "nebula.socket_serializer"
+_BINARY_TYPES = {packet.BINARY_EVENT: packet.EVENT, packet.BINARY_ACK: packet.ACK}
+
+_stats = {"msgpack_connections": 0, "msgpack_frames": 0, "msgpack_encodes": 0}
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+class _JsonFrame(str):
+    """Текст JSON-пакета со ссылкой на пакет — из него строится кадр MessagePack."""
+
+    pkt: NegotiatedPacket
+    twin: bytes | None = None
+
+    def msgpack_twin(self) -> eio_packet.Packet:
+        if self.twin is None:
+            self.twin = self.pkt.encode_msgpack()
+            _stats["msgpack_encodes"] += 1
+        # Пакет Engine.IO на получателя: его кэш кодирования не различает
+        # websocket (сырые байты) и polling (base64), общий сломал бы второй.
+        return eio_packet.Packet(eio_packet.MESSAGE, self.twin)
+
+
+class NegotiatedPacket(packet.Packet):
+    """Пакет, который понимает оба формата: текст — JSON, бинарный кадр — MessagePack."""
+
+    def encode(self):
+        encoded = super().encode()
+        head = encoded[0] if isinstance(encoded, list) else encoded
+        if not isinstance(head, str):
+            return encoded
+        frame = _JsonFrame(head)
+        frame.pkt = self
+        if isinstance(encoded, list):
+            return [frame, *encoded[1:]]
+        return frame
+
+    def encode_msgpack(self) -> bytes:
+        data = self._to_dict()
+        data["type"] = _BINARY_TYPES.get(data["type"], data["type"])
+        data["nsp"] = data["nsp"] or "/"
+        return msgpack.dumps(data, default=json_default)
+
+    def decode(self, encoded_packet):
+        if msgpack is None or not isinstance(encoded_packet, bytes | bytearray):
+            return super().decode(encoded_packet)
+        decoded = msgpack.loads(encoded_packet)
+        self.packet_type = decoded["type"]
+        self.data = decoded.get("data")
+        self.id = decoded.get("id")
+        self.namespace = decoded.get("nsp") or "/"
+        return 0
+
+
+def _uses_msgpack(srv: Any, eio_sid: str) -> bool:
+    environ = srv.environ.get(eio_sid)
+    if environ is None:
+        return False
+    choice = environ.get(_ENVIRON_KEY)
+    if choice is None:
+        query = parse_qs(environ.get("QUERY_STRING", ""))
+        choice = query.get(SERIALIZER_QUERY, ["json"])[0]
+        environ[_ENVIRON_KEY] = choice
+        if choice == "msgpack":
+            _stats["msgpack_connections"] += 1
+    return choice == "msgpack"
+
+
+def install_socket_serializer(socketio: Any) -> bool:
+    """Включить выбор MessagePack на сервере Socket.IO (нужен пакет ``msgpack``).
+
+    Ставится до ``install_backpressure``: ограничитель видит текст JSON-кадра и
+    по нему определяет имя события для любого получателя. Поставленный после,
+    этот слой отдавал бы ограничителю уже бинарные кадры без имени события.
+    """
+    srv = socketio.server
+    if backpressure_installed(srv):
+        raise RuntimeError("install_socket_serializer() must run before install_backpressure()")
+    if msgpack is None:
+        return False
+    srv.packet_class = NegotiatedPacket
+    send_packet = srv._send_packet
+    send_eio_packet = srv._send_eio_packet
+
+    def _send_packet(eio_sid, pkt):
+        if not _uses_msgpack(srv, eio_sid):
+            send_packet(eio_sid, pkt)
+            return
+        _stats["msgpack_frames"] += 1
+        srv.eio.send(eio_sid, pkt.encode_msgpack())
+
+    def _send_eio_packet(eio_sid, eio_pkt):
+        if _uses_msgpack(srv, eio_sid):
+            if not isinstance(eio_pkt.data, _JsonFrame):
+                # Вложения JSON-пакета уже внутри кадра MessagePack.
+                return
+            _stats["msgpack_frames"] += 1
+            eio_pkt = eio_pkt.data.msgpack_twin()
+        send_eio_packet(eio_sid, eio_pkt)
+
+    srv._send_packet = _send_packet
+    srv._send_eio_packet = _send_eio_packet
+    return True
+
+
+def socket_serializer_stats() -> dict[str, Any]:
+    return {"msgpack": msgpack_available(), **_stats}
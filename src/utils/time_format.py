@@ -5,12 +5,18 @@ from __future__ import annotations
 from datetime import UTC, datetime
 
 
+def as_utc(dt: datetime | None) -> datetime | None:
+    """Aware UTC datetime. Naive datetimes (MySQL ``DATETIME``) are treated as UTC."""
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC)
+
+
 def isoformat_utc_z(dt: datetime | None) -> str | None:
     """ISO-8601 instant with Z suffix (UTC). Naive datetimes are treated as UTC."""
+    dt = as_utc(dt)
     if dt is None:
         return None
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=UTC)
-    else:
-        dt = dt.astimezone(UTC)
     return dt.isoformat().replace("+00:00", "Z")
@@ -127,6 +127,12 @@ export async function getProfile(username, token) {
   return apiGet(`/api/profile/${encodeURIComponent(username)}`, token)
 }
 
+/** Профили, last_seen и онлайн-статус списка пользователей одним запросом (ETag/304). */
+export async function getProfiles(usernames, token) {
+  const list = [...new Set(usernames.filter(Boolean))].map(encodeURIComponent).join(',')
+  return apiGet(`/api/profiles?usernames=${list}`, token)
+}
+
 export async function updateProfile(
   { username, nickname, bio, avatar, avatarType },
   token,
@@ -17,10 +17,14 @@ export const state = {
   pendingMedia: null,
   scheduledMessages: [],
   messagesHasMore: false,
+  /** Курсор журнала событий открытого чата (см. room-sync.js). */
+  roomCursor: null,
   loadingOlderMessages: false,
   onlineByUser: {},
   /** username -> { avatar, avatarType, nickname } из /api/users и socket user_profile_updated */
   userProfileCache: {},
+  /** Последний отрисованный список чатов: к нему применяются дельты `inbox_update`. */
+  inboxRows: null,
   inboxDebounce: null,
   typingHideTimer: null,
   lastTypingEmit: 0,
@@ -10,6 +10,7 @@ import {
 } from './auth.js'
 import { t, setLocale, getLocale, applyI18nToDom, translateApiMessage } from './i18n.js'
 import { disconnectSocket } from './socket.js'
+import { uploadMediaFile } from './media-upload.js'
 import { readStoredTheme, normalizeTheme, isLightTheme, THEME_META_COLOR } from './themes.js'
 import { bindLowVisionControls } from './accessibility.js'
 import { els, state, collectEls, showToast } from './app-shell.js'
@@ -587,9 +588,14 @@ function bindEvents() {
     if (f.type.startsWith('image/')) mediaType = 'image'
     else if (f.type.startsWith('video/')) mediaType = 'video'
     else if (f.type.startsWith('audio/')) mediaType = 'audio'
-    const up = await api.uploadMedia(f, mediaType, token)
+    const up = await uploadMediaFile(f, mediaType, token)
     if (up.success && up.path) {
-      state.pendingMedia = { type: up.type || mediaType, data: up.path, name: up.name || f.name }
+      state.pendingMedia = {
+        type: up.type || mediaType,
+        data: up.path,
+        name: up.name || f.name,
+        ...(up.upload_id ? { upload_id: up.upload_id } : {}),
+      }
       updateSendButtonState()
     } else {
       showToast(translateApiMessage(up.message) || t('uploadFailed'), 'error')
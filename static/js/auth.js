@@ -1,4 +1,5 @@
 import { clearRoomLocalCaches } from './read-maps.js'
+import { clearRoomPages } from './room-sync.js'
 
 export function getToken() {
   return localStorage.getItem('auth_token')
@@ -58,6 +59,7 @@ export function setAuth({ token, username, role }) {
 
 export function clearAuth() {
   clearRoomLocalCaches()
+  clearRoomPages()
   serverRoleConfirmed = false
   sessionRole = 'user'
   try {
@@ -19,6 +19,7 @@ import * as api from './api.js'
 import { getToken, getUsername } from './auth.js'
 import { t, translateApiMessage } from './i18n.js'
 import { connectSocket } from './socket.js'
+import { uploadMediaFile } from './media-upload.js'
 import { els, state, showChatHeaderNotice, showToast } from './app-shell.js'
 import { onPasteInsertPlainText } from './dom.js'
 import { refreshBlockedSet, refreshInbox, scheduleInboxRefresh } from './inbox.js'
@@ -320,7 +321,7 @@ function bindVoiceRecorder() {
         voiceBusy = true
         els.btnVoiceRecord.classList.add('is-uploading')
         try {
-          const up = await api.uploadMedia(file, 'voice', getToken())
+          const up = await uploadMediaFile(file, 'voice', getToken())
           const durSec = Math.max(1, Math.round((Date.now() - recStart) / 1000))
           if (up.success && up.path) {
             await sendMessage({
@@ -329,6 +330,7 @@ function bindVoiceRecorder() {
                 type: 'voice',
                 data: up.path,
                 name: file.name,
+                ...(up.upload_id ? { upload_id: up.upload_id } : {}),
                 meta: { durationSec: Math.min(durSec, 300) },
               },
             })
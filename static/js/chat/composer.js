@@ -8,7 +8,7 @@
 import * as api from '../api.js'
 import { getToken, getUsername } from '../auth.js'
 import { t, translateApiMessage } from '../i18n.js'
-import { getSocket } from '../socket.js'
+import { getSocket, queueSocketOp } from '../socket.js'
 import { els, state, showToast } from '../app-shell.js'
 import { $ } from '../dom.js'
 import {
@@ -20,8 +20,12 @@ import {
 } from '../emoji-apple.js'
 import { openSmoothModal, closeSmoothModal } from '../modal-smooth.js'
 import { scheduleInboxRefresh } from '../inbox.js'
+import { normalizeMessage } from '../message-model.js'
+import { advanceCursor } from '../room-sync.js'
 import { POPOVER_CLOSE_MS } from './constants.js'
-import { decryptTextForRoom, encryptTextForRoom } from '../e2ee.js'
+import { appendLiveMessage } from './messages-render.js'
+import { syncExpiryWatcher } from './messages-animations.js'
+import { decryptMessageForRoom, decryptTextForRoom, encryptTextForRoom } from '../e2ee.js'
 
 // -----------------------------------------------------------------------------
 // Черновик и typing
@@ -61,13 +65,13 @@ function emitTyping() {
   const now = Date.now()
   if (now - state.lastTypingEmit < 800) return
   state.lastTypingEmit = now
-  sock.emit('typing', { room: state.currentRoom, username: getUsername() })
+  queueSocketOp('typing', { room: state.currentRoom })
 }
 
 export function emitStopTyping() {
   const sock = getSocket()
   if (!sock?.connected || !state.currentRoom) return
-  sock.emit('stop_typing', { room: state.currentRoom, username: getUsername() })
+  queueSocketOp('stop_typing', { room: state.currentRoom })
 }
 
 export function onInputTyping() {
@@ -254,6 +258,43 @@ export function onSocketAppError(e) {
 // Отправка
 // -----------------------------------------------------------------------------
 
+function newClientId() {
+  if (globalThis.crypto?.randomUUID) return crypto.randomUUID()
+  return `c${Date.now().toString(36)}${Math.random().toString(36).slice(2, 10)}`
+}
+
+/**
+ * Подтверждение `send_message`: полную копию сервер шлёт только другим соединениям,
+ * своё сообщение собираем из отправленного payload и ack (`id`, `timestamp`, путь медиа,
+ * `text` — если сервер его очистил).
+ * Старый сервер ответит без ack и пришлёт `receive_message` — дубль отсечётся по id.
+ */
+async function onSendAck(payload, ack) {
+  if (!ack?.id || ack.client_id !== payload.client_id) return
+  clearSendRestoreTimer()
+  pendingSendRestore = null
+  const room = payload.room
+  if (room === state.currentRoom) {
+    state.roomCursor = advanceCursor(state.roomCursor, room, ack)
+  }
+  const media = payload.media
+    ? { ...payload.media, data: ack.media_data ?? payload.media.data }
+    : undefined
+  const msg = normalizeMessage({
+    id: ack.id,
+    username: payload.username,
+    text: ack.text ?? payload.message ?? '',
+    timestamp: ack.timestamp,
+    expires_at: ack.expires_at,
+    media,
+    read_by: [payload.username],
+    replyTo: payload.replyTo,
+  })
+  const norm = await decryptMessageForRoom(msg, room)
+  if (room === state.currentRoom && appendLiveMessage(norm)) syncExpiryWatcher()
+  scheduleInboxRefresh()
+}
+
 /**
  * @param {{ text?: string, media?: object | null }} [options]
  *   `media` — явная вложенная медиа (например голосовое сразу после записи).
@@ -285,6 +326,8 @@ export async function sendMessage(options = {}) {
     room,
     username: getUsername(),
     message: encryptedText,
+    client_id: newClientId(),
+    ack: true,
   }
   if (state.replyTo) {
     payload.replyTo = {
@@ -313,7 +356,7 @@ export async function sendMessage(options = {}) {
   }
   scheduleClearSendRestore()
 
-  sock.emit('send_message', payload)
+  sock.emit('send_message', payload, (ack) => void onSendAck(payload, ack))
   setComposerPlainText(els.messageInput, '')
   if (els.ttlSelect) {
     els.ttlSelect.value = ''
@@ -486,11 +529,10 @@ async function confirmEditMessage() {
     return
   }
   const encryptedText = await encryptTextForRoom(state.currentRoom, next)
-  getSocket()?.emit('edit_message', {
+  queueSocketOp('edit_message', {
     room: state.currentRoom,
     message_id: msg.message_id,
     new_text: encryptedText,
-    username: getUsername(),
   })
   pendingEditMessage = null
   closeSmoothModal(els.modalEditMessage)
@@ -13,7 +13,7 @@
 import * as api from '../api.js'
 import { getToken, getUsername } from '../auth.js'
 import { t, translateApiMessage } from '../i18n.js'
-import { getSocket } from '../socket.js'
+import { queueSocketOp } from '../socket.js'
 import { els, state, showToast } from '../app-shell.js'
 import { createAppleEmojiImg } from '../emoji-apple.js'
 import { openSmoothModal, closeSmoothModal } from '../modal-smooth.js'
@@ -30,14 +30,9 @@ import {
 // -----------------------------------------------------------------------------
 
 export function toggleReaction(messageId, emoji) {
-  const sock = getSocket()
-  if (!sock?.connected || !state.currentRoom) return
-  sock.emit('add_reaction', {
-    room: state.currentRoom,
-    message_id: messageId,
-    emoji,
-    username: getUsername(),
-  })
+  if (!state.currentRoom) return
+  /** Без связи реакция ждёт переподключения в очереди операций. */
+  queueSocketOp('add_reaction', { room: state.currentRoom, message_id: messageId, emoji })
 }
 
 /** Копирование текста в буфер обмена с fallback на устаревший execCommand. */
@@ -128,11 +123,7 @@ export function bindDeleteMessageModal() {
     pendingDeleteMessage = null
     closeSmoothModal(els.modalDeleteMessage)
     if (!msg || !state.currentRoom) return
-    getSocket()?.emit('delete_message', {
-      room: state.currentRoom,
-      message_id: msg.message_id,
-      username: getUsername(),
-    })
+    queueSocketOp('delete_message', { room: state.currentRoom, message_id: msg.message_id })
   })
   els.btnDeleteMessageCancel.addEventListener('click', () => {
     pendingDeleteMessage = null
@@ -301,11 +292,9 @@ export function openMessageContext(e, msg) {
       label: pinned ? t('unpinMessage') : t('pinMessage'),
       icon: 'fa-thumbtack',
       fn: () => {
-        const evName = pinned ? 'unpin_message' : 'pin_message'
-        getSocket()?.emit(evName, {
-          room_id: state.currentRoom,
+        queueSocketOp(pinned ? 'unpin_message' : 'pin_message', {
+          room: state.currentRoom,
           message_id: msg.message_id,
-          username: getUsername(),
         })
       },
     })
@@ -6,7 +6,7 @@
 
 import { getUsername } from '../auth.js'
 import { t } from '../i18n.js'
-import { getSocket } from '../socket.js'
+import { getSocket, queueSocketOp } from '../socket.js'
 import { els, state } from '../app-shell.js'
 import { privatePeer } from '../message-model.js'
 import { createAppleEmojiImg, fillElementWithAppleEmoji } from '../emoji-apple.js'
@@ -537,6 +537,23 @@ export function renderMessages(opts = {}) {
   })
 }
 
+/**
+ * Добавить новое сообщение в открытый чат: `receive_message` от сервера или своё
+ * по подтверждению отправки. Уже показанное (тот же id) не дублируется.
+ */
+export function appendLiveMessage(norm) {
+  const nid = String(norm.message_id || '')
+  if (nid && state.messages.some((x) => String(x.message_id) === nid)) return false
+  state.messages.push(norm)
+  renderMessages(
+    nid
+      ? { playEnterMessageId: norm.message_id, forceScrollBottom: true }
+      : { forceScrollBottom: true },
+  )
+  markVisibleAsRead()
+  return true
+}
+
 export function markVisibleAsRead() {
   const sock = getSocket()
   if (!sock?.connected || !state.currentRoom) return
@@ -552,9 +569,5 @@ export function markVisibleAsRead() {
   messagesToMark.forEach((m) => {
     m.read_by = Array.isArray(m.read_by) ? [...m.read_by, me] : [me]
   })
-  sock.emit('mark_read_batch', {
-    room: state.currentRoom,
-    message_ids: messageIds,
-    username: me,
-  })
+  queueSocketOp('mark_read_batch', { room: state.currentRoom, message_ids: messageIds })
 }
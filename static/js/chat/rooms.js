@@ -12,7 +12,7 @@
 import * as api from '../api.js'
 import { getToken, getUsername, isModerator } from '../auth.js'
 import { t, translateApiMessage } from '../i18n.js'
-import { getSocket } from '../socket.js'
+import { getSocket, queueSocketOp } from '../socket.js'
 import { els, hideChatHeaderNotice, state, showToast } from '../app-shell.js'
 import { $ } from '../dom.js'
 import {
@@ -21,6 +21,7 @@ import {
   scheduleInboxRefresh,
 } from '../inbox.js'
 import { markRoomReadNow } from '../read-maps.js'
+import { rememberRoomPage, resyncParams, takeRoomPage } from '../room-sync.js'
 import { normalizeMessage, privatePeer } from '../message-model.js'
 import { fillElementWithAppleEmoji, setComposerPlainText } from '../emoji-apple.js'
 import { openSmoothModal, closeSmoothModal } from '../modal-smooth.js'
@@ -215,11 +216,7 @@ function attachUnpinControl(row, p) {
   const doUnpin = (e) => {
     e.stopPropagation()
     e.preventDefault()
-    getSocket()?.emit('unpin_message', {
-      room_id: state.currentRoom,
-      message_id: p.message_id,
-      username: getUsername(),
-    })
+    queueSocketOp('unpin_message', { room: state.currentRoom, message_id: p.message_id })
   }
   unpin.addEventListener('click', doUnpin)
   unpin.addEventListener('keydown', (e) => {
@@ -373,9 +370,15 @@ export async function loadPinnedStrip() {
 
 export function openChat(roomId, type) {
   const chatPanelWasHidden = !!(els.chatPanel && els.chatPanel.hidden)
-  if (state.currentRoom && state.currentRoom !== roomId) {
+  const switching = state.currentRoom !== roomId
+  if (state.currentRoom && switching) {
     clearPendingMedia()
     clearScheduledMessages()
+    rememberRoomPage(state.currentRoom, {
+      messages: state.messages,
+      hasMore: state.messagesHasMore,
+      cursor: state.roomCursor,
+    })
   }
   state.currentRoom = roomId
   state.currentChatType = type
@@ -383,8 +386,11 @@ export function openChat(roomId, type) {
     const peer = privatePeer(roomId, getUsername())
     if (peer) addPrivateChat(roomId, peer)
   }
-  state.messages = []
-  state.messagesHasMore = false
+  /** Недавно открытый чат показываем сразу из кэша вкладки; сервер досылает только дельту. */
+  const cached = switching ? takeRoomPage(roomId) : null
+  state.messages = cached?.messages || []
+  state.roomCursor = cached?.cursor || null
+  state.messagesHasMore = !!cached?.hasMore
   state.loadingOlderMessages = false
   syncMessagesLoadOlderUi()
   syncE2eeButton()
@@ -392,7 +398,8 @@ export function openChat(roomId, type) {
   markRoomReadNow(roomId)
   const sock = getSocket()
   if (sock?.connected) {
-    sock.emit('join', { room: roomId, username: getUsername() })
+    const since = resyncParams(state.roomCursor, roomId)
+    sock.emit('join', { room: roomId, username: getUsername(), columns: true, ...since })
   } else {
     void loadMessages()
   }
@@ -5,12 +5,15 @@
 
 import * as api from '../api.js'
 import { getToken, getUsername, markServerRoleConfirmed, setAuth } from '../auth.js'
-import { getSocket } from '../socket.js'
+import { getSocket, setSocketSerializers } from '../socket.js'
 import { els, state } from '../app-shell.js'
 import { bumpUnread } from '../read-maps.js'
-import { normalizeMessage } from '../message-model.js'
-import { scheduleInboxRefresh } from '../inbox.js'
+import { expandMessageTable, normalizeMessage } from '../message-model.js'
+import { applyInboxUpdate, renderInboxPresence, scheduleInboxRefresh } from '../inbox.js'
+import { applyPresenceChanges } from '../presence-delta.js'
+import { advanceCursor, cursorFromHistory, resyncParams } from '../room-sync.js'
 import {
+  appendLiveMessage,
   markVisibleAsRead,
   mergeHistoryWithExisting,
   patchMessageEdited,
@@ -30,20 +33,40 @@ export function bindSocketEvents() {
   if (!sock || sock._nebulaBound) return
   sock._nebulaBound = true
 
-  /** После reconnect новый sid — без join сервер не шлёт receive_message в комнату группы. */
+  /**
+   * После reconnect новый sid — без join сервер не шлёт receive_message в комнату группы.
+   * Если известен курсор журнала комнаты, `resync` досылает только пропущенные события.
+   */
   sock.on('connect', () => {
     const room = state.currentRoom
     const uname = getUsername()
     if (!room || !uname || !sock.connected) return
-    sock.emit('join', { room, username: uname })
+    const since = resyncParams(state.roomCursor, room)
+    sock.emit(since ? 'resync' : 'join', { room, username: uname, columns: true, ...since })
   })
 
   sock.on('message_history', async (data) => {
-    if (!data.messages) return
+    const messages = data?.messages ?? (data?.message_table && expandMessageTable(data.message_table))
+    if (!messages) return
     if (data.room != null && data.room !== state.currentRoom) return
     const room = data.room ?? state.currentRoom
-    const fetched = await decryptMessagesForRoom(data.messages.map(normalizeMessage), room)
-    state.messages = mergeHistoryWithExisting(fetched, state.messages)
+    const cursor = cursorFromHistory(data)
+    const prev = state.roomCursor
+    /** Живые события могли прийти раньше истории — курсор назад не двигаем. */
+    const ahead =
+      cursor && prev?.room === cursor.room && prev.epoch === cursor.epoch && prev.seq > cursor.seq
+    if (!ahead) state.roomCursor = cursor
+    const fetched = await decryptMessagesForRoom(messages.map(normalizeMessage), room)
+    /**
+     * `full`: курсор клиента журнал уже не покрывает — страница из кэша могла устареть
+     * (удалённые сообщения), поэтому оставляем из неё только то, что новее истории.
+     */
+    let previous = state.messages
+    if (data.full) {
+      const newest = Date.parse(fetched.at(-1)?.timestamp || '') || 0
+      previous = previous.filter((m) => (Date.parse(m.timestamp || '') || 0) > newest)
+    }
+    state.messages = mergeHistoryWithExisting(fetched, previous)
     state.messagesHasMore = fetched.length >= 100
     await loadScheduledMessages()
     renderMessages()
@@ -53,115 +76,183 @@ export function bindSocketEvents() {
     syncMessagesLoadOlderUi()
   })
 
-  sock.on('receive_message', async (msg) => {
-    const roomId = msg.room ?? msg.room_id
-    const norm = await decryptMessageForRoom(normalizeMessage(msg), roomId)
-    const cur = state.currentRoom
-    if (String(roomId || '') === String(cur || '')) {
-      const nid = String(norm.message_id || '')
-      if (nid && state.messages.some((x) => String(x.message_id) === nid)) return
-      state.messages.push(norm)
-      renderMessages(
-        nid
-          ? { playEnterMessageId: norm.message_id, forceScrollBottom: true }
-          : { forceScrollBottom: true },
-      )
-      markVisibleAsRead()
-      syncExpiryWatcher()
-    } else {
-      bumpUnread(roomId, state.currentRoom, state.mutedRooms)
-    }
-    scheduleInboxRefresh()
-  })
+  /** События открытого чата, которые сервер нумерует в журнале комнаты (seq/epoch). */
+  const roomEventHandlers = {
+    receive_message: async (msg) => {
+      const roomId = msg.room ?? msg.room_id
+      const norm = await decryptMessageForRoom(normalizeMessage(msg), roomId)
+      const cur = state.currentRoom
+      /** Превью в списке чатов обновит `inbox_update` — он приходит и для открытого чата. */
+      if (String(roomId || '') === String(cur || '') && appendLiveMessage(norm)) {
+        syncExpiryWatcher()
+      }
+    },
 
-  sock.on('reaction_updated', (data) => {
-    if (!data || data.message_id == null) return
-    const m = state.messages.find((x) => x.message_id === data.message_id)
-    if (m) {
-      m.reactions = data.reactions || {}
-      if (!patchMessageReactions(m)) renderMessages()
-    }
-  })
+    reaction_updated: (data) => {
+      if (!data || data.message_id == null) return
+      const m = state.messages.find((x) => x.message_id === data.message_id)
+      if (m) {
+        m.reactions = data.reactions || {}
+        if (!patchMessageReactions(m)) renderMessages()
+      }
+    },
 
-  sock.on('message_read', (data) => {
-    if (!data?.message_id) return
-    const m = state.messages.find((x) => x.message_id === data.message_id)
-    if (m) {
-      m.read_by = data.read_by || m.read_by
-      if (!patchMessageReadReceipt(m)) renderMessages()
-    }
-  })
+    message_edited: async (data) => {
+      const m = state.messages.find((x) => x.message_id === data.message_id)
+      if (m) {
+        const dec = await decryptMessageForRoom({ ...m, text: data.new_text }, state.currentRoom)
+        m.text = dec.text
+        m.rawText = dec.rawText
+        m.e2ee = dec.e2ee
+        m.edited = true
+        if (!patchMessageEdited(m)) renderMessages()
+      }
+      /** Если отредактированное сообщение — закреплённое, обновляем превью в пин-баре. */
+      if (state.currentRoom && els.pinnedStrip && !els.pinnedStrip.hidden) {
+        const id = String(data.message_id)
+        const pinnedHit = els.pinnedStrip.querySelector(
+          `.pinned-item[data-message-id="${CSS.escape(id)}"]`,
+        )
+        if (pinnedHit) loadPinnedStrip()
+      }
+    },
+
+    message_deleted: (data) => {
+      if (data?.message_id == null) return
+      if (data.room != null && data.room !== state.currentRoom) return
+      const id = String(data.message_id)
+      /** Если удалено закреплённое сообщение — БД каскадом отпинит его, обновим стрип. */
+      if (els.pinnedStrip && !els.pinnedStrip.hidden) {
+        const pinnedHit = els.pinnedStrip.querySelector(
+          `.pinned-item[data-message-id="${CSS.escape(id)}"]`,
+        )
+        if (pinnedHit) loadPinnedStrip()
+      }
+      if (!state.messages.some((x) => String(x.message_id) === id)) return
+      animateMessagesLeaveAndRemove([id])
+    },
+
+    message_pinned: () => {
+      if (state.currentRoom) loadPinnedStrip()
+    },
+    message_unpinned: () => {
+      if (state.currentRoom) loadPinnedStrip()
+    },
+
+    message_read: (data) => {
+      if (!data?.message_id) return
+      const m = state.messages.find((x) => x.message_id === data.message_id)
+      if (m) {
+        m.read_by = data.read_by || m.read_by
+        if (!patchMessageReadReceipt(m)) renderMessages()
+      }
+    },
+
+    message_read_batch: (data) => {
+      if (data?.room != null && data.room !== state.currentRoom) return
+      if (!Array.isArray(data?.reads)) return
+      const byId = new Map(state.messages.map((m) => [String(m.message_id), m]))
+      let needsRender = false
+      data.reads.forEach((item) => {
+        if (!item?.message_id) return
+        const id = String(item.message_id)
+        const m = byId.get(id)
+        if (!m) return
+        m.read_by = item.read_by || m.read_by
+        if (!patchMessageReadReceipt(m)) needsRender = true
+      })
+      if (needsRender) renderMessages()
+    },
+  }
 
-  sock.on('message_read_batch', (data) => {
-    if (data?.room != null && data.room !== state.currentRoom) return
-    if (!Array.isArray(data?.reads)) return
-    const byId = new Map(state.messages.map((m) => [String(m.message_id), m]))
-    let needsRender = false
-    data.reads.forEach((item) => {
-      if (!item?.message_id) return
-      const id = String(item.message_id)
-      const m = byId.get(id)
-      if (!m) return
-      m.read_by = item.read_by || m.read_by
-      if (!patchMessageReadReceipt(m)) needsRender = true
+  const trackRoomEvent = (data) => {
+    state.roomCursor = advanceCursor(state.roomCursor, state.currentRoom, data)
+  }
+  for (const [event, handler] of Object.entries(roomEventHandlers)) {
+    sock.on(event, (data) => {
+      trackRoomEvent(data)
+      return handler(data)
     })
-    if (needsRender) renderMessages()
-  })
+  }
 
-  sock.on('message_edited', async (data) => {
-    const m = state.messages.find((x) => x.message_id === data.message_id)
-    if (m) {
-      const dec = await decryptMessageForRoom({ ...m, text: data.new_text }, state.currentRoom)
-      m.text = dec.text
-      m.rawText = dec.rawText
-      m.e2ee = dec.e2ee
-      m.edited = true
-      if (!patchMessageEdited(m)) renderMessages()
-    }
-    /** Если отредактированное сообщение — закреплённое, обновляем превью в пин-баре. */
-    if (state.currentRoom && els.pinnedStrip && !els.pinnedStrip.hidden) {
-      const id = String(data.message_id)
-      const pinnedHit = els.pinnedStrip.querySelector(
-        `.pinned-item[data-message-id="${CSS.escape(id)}"]`,
-      )
-      if (pinnedHit) loadPinnedStrip()
+  /**
+   * Ответ на `resync` или `join` с курсором: события после курсора — по порядку, теми же
+   * обработчиками (пустой список — страница не изменилась).
+   */
+  sock.on('room_replay', async (data) => {
+    if (data?.room !== state.currentRoom || !Array.isArray(data.events)) return
+    const room = data.room
+    for (const item of data.events) {
+      const handler = roomEventHandlers[item?.event]
+      if (!handler || !item.data) continue
+      trackRoomEvent(item.data)
+      await handler(item.data)
     }
+    await loadScheduledMessages()
+    if (state.currentRoom !== room) return
+    syncScheduledHeaderUi()
+    markVisibleAsRead()
+    syncExpiryWatcher()
+    syncMessagesLoadOlderUi()
   })
 
-  sock.on('message_deleted', (data) => {
-    if (data?.message_id == null) return
-    if (data.room != null && data.room !== state.currentRoom) return
-    const id = String(data.message_id)
-    /** Если удалено закреплённое сообщение — БД каскадом отпинит его, обновим стрип. */
-    if (els.pinnedStrip && !els.pinnedStrip.hidden) {
-      const pinnedHit = els.pinnedStrip.querySelector(
-        `.pinned-item[data-message-id="${CSS.escape(id)}"]`,
-      )
-      if (pinnedHit) loadPinnedStrip()
-    }
-    if (!state.messages.some((x) => String(x.message_id) === id)) return
-    animateMessagesLeaveAndRemove([id])
+  /**
+   * Сервер отбрасывал события, пока мы не успевали их принимать (медленная сеть):
+   * курсору больше верить нельзя — перечитываем открытый чат и список чатов целиком.
+   */
+  sock.on('resync_required', () => {
+    state.roomCursor = null
+    const room = state.currentRoom
+    const uname = getUsername()
+    if (room && uname && sock.connected) sock.emit('join', { room, username: uname, columns: true })
+    scheduleInboxRefresh()
   })
 
-  sock.on('message_pinned', () => {
-    if (state.currentRoom) loadPinnedStrip()
-  })
-  sock.on('message_unpinned', () => {
-    if (state.currentRoom) loadPinnedStrip()
+  /** Сокет подписан только на открытый чат; об остальных сервер шлёт дельты в личный канал. */
+  sock.on('inbox_update', (data) => {
+    const roomId = data?.room
+    if (!roomId) return
+    if (data.unread && data.username !== getUsername()) {
+      bumpUnread(roomId, state.currentRoom, state.mutedRooms)
+    }
+    applyInboxUpdate(data)
   })
 
-  sock.on('user_typing', (data) => {
-    if (data.room !== state.currentRoom || data.username === getUsername()) return
-    setTypingIndicator([data.username])
-  })
-  sock.on('user_stop_typing', (data) => {
-    if (data.room !== state.currentRoom) return
-    setTypingIndicator([])
+  /** Сервер шлёт набор текста и в комнату целиком (в пачке), поэтому свой пропускаем сами. */
+  const typingHandlers = {
+    user_typing: (data) => {
+      if (data.room !== state.currentRoom || data.username === getUsername()) return
+      setTypingIndicator([data.username])
+    },
+    user_stop_typing: (data) => {
+      if (data.room !== state.currentRoom || data.username === getUsername()) return
+      setTypingIndicator([])
+    },
+  }
+  for (const [event, handler] of Object.entries(typingHandlers)) sock.on(event, handler)
+
+  /** Склеенные сервером за ~50 мс события комнаты: набор текста, прочтения, реакции. */
+  sock.on('batch', async (data) => {
+    if (data?.room !== state.currentRoom || !Array.isArray(data.events)) return
+    for (const item of data.events) {
+      if (!item?.data) continue
+      const roomHandler = roomEventHandlers[item.event]
+      if (roomHandler) {
+        trackRoomEvent(item.data)
+        await roomHandler(item.data)
+      } else {
+        typingHandlers[item.event]?.(item.data)
+      }
+    }
   })
 
   sock.on('user_status_changed', () => {
     loadUsersOnline().then(() => scheduleInboxRefresh())
   })
+  // Сервер копит смены статуса контактов и шлёт их пачкой: статусы меняются на месте.
+  sock.on('presence_batch', (data) => {
+    if (applyPresenceChanges(state.onlineByUser, data?.changes)) renderInboxPresence()
+  })
 
   sock.on('user_profile_updated', (data) => {
     if (!data?.username) return
@@ -189,6 +280,7 @@ export async function syncRoleFromServer() {
         role: me.role,
       })
       markServerRoleConfirmed()
+      setSocketSerializers(me.socket_serializers)
     }
   } catch {
     /* offline / error — keep cached role; кнопка модератора скрыта, пока сервер не подтвердил роль */
@@ -0,0 +1,51 @@
+/**
+ * Дельты списка чатов из `inbox_update` (см. `utils/room_delivery.py`) поверх последнего
+ * ответа `/api/inbox`. Если дельты не хватает (чат не в списке, удалено последнее
+ * сообщение, старый сервер без `preview`), `applyInboxDelta` возвращает `null` — тогда
+ * список перечитывается целиком.
+ */
+
+/** Порядок списка: свежие сверху, чаты без сообщений — по названию в конце. */
+export function compareInboxRows(a, b) {
+  const ta = a.last_at || ''
+  const tb = b.last_at || ''
+  if (ta && tb) return tb.localeCompare(ta)
+  if (ta && !tb) return -1
+  if (!ta && tb) return 1
+  return (a.displayTitle || '').localeCompare(b.displayTitle || '')
+}
+
+/** Новые строки списка с применённой дельтой или `null`, если нужен полный запрос. */
+export function applyInboxDelta(rows, delta) {
+  if (!Array.isArray(rows) || !delta?.room) return null
+  const index = rows.findIndex((r) => r.room_id === delta.room)
+  if (index < 0) return null
+  const row = rows[index]
+
+  if (delta.deleted) {
+    /** Предыдущее сообщение чата клиенту неизвестно. */
+    if (row.last_message_id == null || row.last_message_id === delta.message_id) return null
+    return rows
+  }
+  if (typeof delta.preview !== 'string') return null
+
+  let next
+  if (delta.edited) {
+    if (row.last_message_id == null) return null
+    if (row.last_message_id !== delta.message_id) return rows
+    next = row.has_draft ? row : { ...row, last_preview: delta.preview }
+  } else {
+    if (!delta.created_at) return null
+    if (row.last_at && Date.parse(delta.created_at) < Date.parse(row.last_at)) return rows
+    next = {
+      ...row,
+      last_at: delta.created_at,
+      last_message_id: delta.message_id,
+      /** Черновик в превью важнее чужого сообщения — как и в ответе сервера. */
+      ...(row.has_draft ? {} : { last_preview: delta.preview }),
+    }
+  }
+  const out = rows.slice()
+  out[index] = next
+  return out.sort(compareInboxRows)
+}
@@ -6,6 +6,7 @@ import { els, showToast, state } from './app-shell.js'
 import { fillUserAvatarElement } from './user-avatar.js'
 import { readUnreadMap } from './read-maps.js'
 import { privatePeer } from './message-model.js'
+import { applyInboxDelta, compareInboxRows } from './inbox-delta.js'
 
 export function currentChatTitle() {
   if (!state.currentRoom) return ''
@@ -43,14 +44,7 @@ function mergeInboxRows(serverItems) {
       last_at: null,
     }))
   const enriched = [...serverItems.map(enrichInboxItem), ...extra.map(enrichInboxItem)]
-  enriched.sort((a, b) => {
-    const ta = a.last_at || ''
-    const tb = b.last_at || ''
-    if (ta && tb) return tb.localeCompare(ta)
-    if (ta && !tb) return -1
-    if (!ta && tb) return 1
-    return (a.displayTitle || '').localeCompare(b.displayTitle || '')
-  })
+  enriched.sort(compareInboxRows)
   return enriched
 }
 
@@ -208,6 +202,7 @@ function updateInboxRow(div, row, unreadMap, me) {
 
 /** Сброс списка чатов в UI (выход из аккаунта и т.п.). */
 export function clearInboxUi() {
+  state.inboxRows = null
   if (!els.inboxList) return
   renderInboxList([])
 }
@@ -258,6 +253,31 @@ export async function refreshBlockedSet() {
   }
 }
 
+/** Собеседники, которых нет в первой странице /api/users, догружаются одним батчем. */
+async function hydrateMissingPeerProfiles(rows, me, token) {
+  const missing = []
+  rows.forEach((row) => {
+    if (row.kind !== 'private') return
+    const peer = privatePeer(row.room_id, me)
+    if (peer && !state.userProfileCache[peer]) missing.push(peer)
+  })
+  if (!missing.length) return
+  try {
+    const data = await api.getProfiles(missing.slice(0, 100), token)
+    Object.entries(data?.profiles || {}).forEach(([name, p]) => {
+      const at = String(p.avatarType || 'emoji').toLowerCase()
+      state.userProfileCache[name] = {
+        avatar: p.avatar != null && p.avatar !== '' ? p.avatar : '👤',
+        avatarType: at === 'image' ? 'image' : 'emoji',
+        nickname: p.nickname,
+      }
+      state.onlineByUser[name] = !!p.online
+    })
+  } catch {
+    /* аватары останутся заглушками до следующего обновления */
+  }
+}
+
 export async function refreshInbox() {
   const token = getToken()
   const uname = getUsername()
@@ -285,12 +305,33 @@ export async function refreshInbox() {
       if (!p) return false
       return !state.blockedSet.has(p)
     })
+    await hydrateMissingPeerProfiles(filtered, uname, token)
+    state.inboxRows = filtered
     renderInboxList(filtered)
   } catch {
     // Keep the last rendered inbox if request failed (network/offline/etc).
   }
 }
 
+/**
+ * `inbox_update` от сервера: превью, время и порядок меняются на месте, без `/api/inbox`.
+ * Полный запрос — только если дельты не хватает (см. `inbox-delta.js`).
+ */
+export function applyInboxUpdate(data) {
+  const rows = applyInboxDelta(state.inboxRows, data)
+  if (!rows) {
+    scheduleInboxRefresh()
+    return
+  }
+  state.inboxRows = rows
+  renderInboxList(rows)
+}
+
+/** Точки «в сети» у личных чатов после смены статусов — без запроса списка. */
+export function renderInboxPresence() {
+  if (state.inboxRows) renderInboxList(state.inboxRows)
+}
+
 export function scheduleInboxRefresh() {
   clearTimeout(state.inboxDebounce)
   state.inboxDebounce = setTimeout(() => refreshInbox(), 350)
@@ -0,0 +1,72 @@
+/**
+ * Загрузка вложений: по открытому сокету — бинарными кусками (`upload_start` →
+ * `upload_chunk`… → `upload_finish`, см. `utils/media_upload.py`), без сокета —
+ * прежним `POST /api/upload_media`. Результат в одном формате:
+ * `{ success, path, type, name, upload_id? }` — `upload_id` уходит в `media`
+ * сообщения, и сервер берёт уже сохранённый файл по ссылке.
+ */
+import { getUsername } from './auth.js'
+import { uploadMedia as uploadMediaHttp } from './api.js'
+import { getSocket } from './socket.js'
+
+/** Сколько кусков в пути без подтверждения: канал занят, а память — пара кусков. */
+const CHUNK_WINDOW = 4
+const ACK_TIMEOUT_MS = 30000
+
+class UploadRejected extends Error {}
+
+async function request(sock, event, body) {
+  const ack = await sock.timeout(ACK_TIMEOUT_MS).emitWithAck(event, body)
+  if (ack?.error) throw new UploadRejected(ack.error)
+  return ack
+}
+
+async function uploadOverSocket(sock, file, mediaType, onStarted) {
+  const username = getUsername()
+  const started = await request(sock, 'upload_start', {
+    username,
+    type: mediaType,
+    name: file.name,
+    mime: file.type,
+    size: file.size,
+  })
+  const uploadId = started.upload_id
+  const chunkSize = started.chunk_size
+  onStarted()
+  try {
+    const inFlight = []
+    for (let index = 0, offset = 0; offset < file.size; index++, offset += chunkSize) {
+      const data = await file.slice(offset, offset + chunkSize).arrayBuffer()
+      const sent = request(sock, 'upload_chunk', { username, upload_id: uploadId, index, data })
+      /** Ошибку заберёт `await` по очереди; здесь — только чтобы не было unhandled rejection. */
+      sent.catch(() => {})
+      inFlight.push(sent)
+      if (inFlight.length >= CHUNK_WINDOW) await inFlight.shift()
+    }
+    await Promise.all(inFlight)
+    const done = await request(sock, 'upload_finish', { username, upload_id: uploadId })
+    return { success: true, upload_id: uploadId, path: done.path, type: done.type, name: done.name }
+  } catch (err) {
+    sock.emit('upload_abort', { username, upload_id: uploadId })
+    throw err
+  }
+}
+
+/** Загрузить файл вложения; без сокета или при отказе до передачи — по HTTP. */
+export async function uploadMediaFile(file, mediaType, token) {
+  const sock = getSocket()
+  if (sock?.connected && file.size > 0) {
+    let transferring = false
+    try {
+      return await uploadOverSocket(sock, file, mediaType, () => {
+        transferring = true
+      })
+    } catch (err) {
+      /** Отказ посреди передачи (тип по содержимому, размер) HTTP не исправит. */
+      if (err instanceof UploadRejected && transferring) {
+        return { success: false, message: err.message }
+      }
+    }
+  }
+  return uploadMediaHttp(file, mediaType, token)
+}
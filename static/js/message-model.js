@@ -44,6 +44,22 @@ export function normalizeMessage(m) {
   }
 }
 
+/**
+ * Страница истории в столбцовом виде (`message_table` при `join` с `columns`) —
+ * обратно в массив объектов; `null` в строке означает «поля нет».
+ */
+export function expandMessageTable(table) {
+  const columns = Array.isArray(table?.columns) ? table.columns : []
+  const rows = Array.isArray(table?.rows) ? table.rows : []
+  return rows.map((row) => {
+    const m = {}
+    columns.forEach((key, i) => {
+      if (row[i] !== null && row[i] !== undefined) m[key] = row[i]
+    })
+    return m
+  })
+}
+
 export function privatePeer(roomId, me) {
   if (!roomId || !roomId.startsWith('private_')) return null
   const parts = roomId.slice(8).split('_')
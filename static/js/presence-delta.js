@@ -0,0 +1,17 @@
+/**
+ * Дельты онлайн-статусов из `presence_batch` (см. `utils/presence_fanout.py`) поверх
+ * карты `state.onlineByUser`: без повторного `/api/users` на каждую пачку.
+ */
+
+/** Применить `changes` к `onlineByUser` на месте; вернуть, изменилось ли что-то. */
+export function applyPresenceChanges(onlineByUser, changes) {
+  if (!onlineByUser || !Array.isArray(changes)) return false
+  let changed = false
+  for (const change of changes) {
+    if (!change?.username) continue
+    const online = change.status === 'online'
+    if (!!onlineByUser[change.username] !== online) changed = true
+    onlineByUser[change.username] = online
+  }
+  return changed
+}
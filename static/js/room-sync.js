@@ -0,0 +1,71 @@
+/**
+ * Курсор журнала событий открытого чата: `{ room, epoch, seq }` последнего увиденного события.
+ * Сервер нумерует события комнаты; после переподключения клиент шлёт `resync` с курсором
+ * и получает только пропущенное (`room_replay`) или полную `message_history`. Тот же курсор
+ * уходит в `join` при возврате в недавно открытый чат (страница берётся из кэша вкладки).
+ */
+
+/** Курсор из `message_history` (старый сервер без журнала — `null`). */
+export function cursorFromHistory(data) {
+  if (!data?.room || !data.epoch || typeof data.seq !== 'number') return null
+  return { room: data.room, epoch: data.epoch, seq: data.seq }
+}
+
+/** Сколько номеров «через дырку» помним, пока ждём пропущенные. */
+export const CURSOR_AHEAD_MAX = 64
+
+/**
+ * Сдвинуть курсор по событию комнаты `room`. Событие из новой `epoch` (рестарт/вытеснение
+ * журнала) принимаем, только если оно первое в ней, иначе между ними мог быть пропуск.
+ *
+ * Курсор идёт только по непрерывным `seq`: события разных воркеров (и ack отправителю)
+ * могут прийти вразнобой. Номера после дырки копятся в `ahead` и засчитываются, когда
+ * дырка закроется; если не закроется — `resync` после обрыва дошлёт пропущенное.
+ */
+export function advanceCursor(cursor, room, data) {
+  if (!cursor || cursor.room !== room || data?.room !== room) return cursor
+  if (typeof data.seq !== 'number' || !data.epoch) return cursor
+  if (data.epoch !== cursor.epoch) {
+    return data.seq === 1 ? { room, epoch: data.epoch, seq: 1 } : null
+  }
+  const ahead = cursor.ahead || []
+  if (data.seq <= cursor.seq || ahead.includes(data.seq)) return cursor
+  if (data.seq > cursor.seq + 1) {
+    if (ahead.length >= CURSOR_AHEAD_MAX) return cursor
+    return { ...cursor, ahead: [...ahead, data.seq].sort((a, b) => a - b) }
+  }
+  let seq = data.seq
+  const rest = ahead.filter((n) => n > seq)
+  while (rest[0] === seq + 1) seq = rest.shift()
+  const next = { room, epoch: cursor.epoch, seq }
+  return rest.length ? { ...next, ahead: rest } : next
+}
+
+/** Последние открытые чаты: страница сообщений с курсором, чтобы повторный `join` взял только дельту. */
+export const ROOM_PAGE_CACHE_MAX = 8
+const roomPages = new Map()
+
+/** Запомнить страницу покидаемого чата `{ messages, hasMore, cursor }` (без курсора — бесполезна). */
+export function rememberRoomPage(room, page) {
+  if (!room || !page?.cursor || page.cursor.room !== room) return
+  roomPages.delete(room)
+  roomPages.set(room, page)
+  while (roomPages.size > ROOM_PAGE_CACHE_MAX) roomPages.delete(roomPages.keys().next().value)
+}
+
+/** Забрать страницу чата (она снова становится живым состоянием) или `null`. */
+export function takeRoomPage(room) {
+  const page = roomPages.get(room) || null
+  roomPages.delete(room)
+  return page
+}
+
+export function clearRoomPages() {
+  roomPages.clear()
+}
+
+/** Курсор для `join`/`resync` комнаты или `null` — тогда сервер пришлёт полную историю. */
+export function resyncParams(cursor, room) {
+  if (!cursor || cursor.room !== room) return null
+  return { epoch: cursor.epoch, seq: cursor.seq }
+}
@@ -0,0 +1,283 @@
+/**
+ * Парсер Socket.IO поверх MessagePack — совместим с `socket.io-msgpack-parser`
+ * и серверным `utils/socket_serializer.py`: пакет `{ type, nsp, data, id }` целиком
+ * кодируется в один бинарный кадр. Подключается через `io({ parser })`, только если
+ * сервер объявил `msgpack` в `/api/me` (см. `socket.js`).
+ */
+
+const textEncoder = new TextEncoder()
+const textDecoder = new TextDecoder()
+
+// -----------------------------------------------------------------------------
+// Кодирование
+// -----------------------------------------------------------------------------
+
+class Writer {
+  constructor() {
+    this.buf = new Uint8Array(256)
+    this.view = new DataView(this.buf.buffer)
+    this.pos = 0
+  }
+
+  reserve(n) {
+    if (this.pos + n <= this.buf.length) return
+    let size = this.buf.length * 2
+    while (size < this.pos + n) size *= 2
+    const next = new Uint8Array(size)
+    next.set(this.buf.subarray(0, this.pos))
+    this.buf = next
+    this.view = new DataView(next.buffer)
+  }
+
+  u8(v) {
+    this.reserve(1)
+    this.view.setUint8(this.pos, v)
+    this.pos += 1
+  }
+
+  u16(v) {
+    this.reserve(2)
+    this.view.setUint16(this.pos, v)
+    this.pos += 2
+  }
+
+  u32(v) {
+    this.reserve(4)
+    this.view.setUint32(this.pos, v)
+    this.pos += 4
+  }
+
+  /** Байт типа и следом беззнаковое число шириной `size` байт. */
+  typed(code, size, v) {
+    this.u8(code)
+    if (size === 1) this.u8(v)
+    else if (size === 2) this.u16(v)
+    else this.u32(v)
+  }
+
+  bytes(arr) {
+    this.reserve(arr.length)
+    this.buf.set(arr, this.pos)
+    this.pos += arr.length
+  }
+
+  result() {
+    return this.buf.slice(0, this.pos)
+  }
+}
+
+function writeLength(w, len, fix, fixMax, codes) {
+  if (fix !== null && len <= fixMax) w.u8(fix | len)
+  else if (codes[0] !== null && len < 0x100) w.typed(codes[0], 1, len)
+  else if (len < 0x10000) w.typed(codes[1], 2, len)
+  else w.typed(codes[2], 4, len)
+}
+
+/** Целое в самом коротком виде; за пределами 32 бит — int64/uint64 (две половины). */
+function writeInt(w, n) {
+  if (n >= 0 && n < 0x80) w.u8(n)
+  else if (n < 0 && n >= -0x20) w.u8(n & 0xff)
+  else if (n >= 0 && n < 0x100) w.typed(0xcc, 1, n)
+  else if (n >= 0 && n < 0x10000) w.typed(0xcd, 2, n)
+  else if (n >= 0 && n < 0x100000000) w.typed(0xce, 4, n)
+  else if (n < 0 && n >= -0x80) w.typed(0xd0, 1, n & 0xff)
+  else if (n < 0 && n >= -0x8000) w.typed(0xd1, 2, n & 0xffff)
+  else if (n < 0 && n >= -0x80000000) w.typed(0xd2, 4, n >>> 0)
+  else {
+    w.typed(n >= 0 ? 0xcf : 0xd3, 4, Math.floor(n / 0x100000000) >>> 0)
+    w.u32(n >>> 0)
+  }
+}
+
+function writeValue(w, v) {
+  if (v === null || v === undefined) w.u8(0xc0)
+  else if (v === false) w.u8(0xc2)
+  else if (v === true) w.u8(0xc3)
+  else if (typeof v === 'number') {
+    if (Number.isSafeInteger(v)) writeInt(w, v)
+    else {
+      w.u8(0xcb)
+      w.reserve(8)
+      w.view.setFloat64(w.pos, v)
+      w.pos += 8
+    }
+  } else if (typeof v === 'string') {
+    const bytes = textEncoder.encode(v)
+    writeLength(w, bytes.length, 0xa0, 31, [0xd9, 0xda, 0xdb])
+    w.bytes(bytes)
+  } else if (v instanceof ArrayBuffer || ArrayBuffer.isView(v)) {
+    const bytes =
+      v instanceof ArrayBuffer ? new Uint8Array(v) : new Uint8Array(v.buffer, v.byteOffset, v.byteLength)
+    writeLength(w, bytes.length, null, 0, [0xc4, 0xc5, 0xc6])
+    w.bytes(bytes)
+  } else if (Array.isArray(v)) {
+    writeLength(w, v.length, 0x90, 15, [null, 0xdc, 0xdd])
+    for (const item of v) writeValue(w, item)
+  } else if (typeof v.toJSON === 'function') {
+    writeValue(w, v.toJSON())
+  } else {
+    /** Как JSON.stringify: поля со значением `undefined` пропускаются. */
+    const entries = Object.entries(v).filter(([, item]) => item !== undefined)
+    writeLength(w, entries.length, 0x80, 15, [null, 0xde, 0xdf])
+    for (const [key, item] of entries) {
+      writeValue(w, key)
+      writeValue(w, item)
+    }
+  }
+}
+
+export function encodeMsgpack(value) {
+  const w = new Writer()
+  writeValue(w, value)
+  return w.result()
+}
+
+// -----------------------------------------------------------------------------
+// Декодирование
+// -----------------------------------------------------------------------------
+
+function readValue(r) {
+  const { view } = r
+  const type = view.getUint8(r.pos++)
+  if (type < 0x80) return type
+  if (type < 0x90) return readMap(r, type & 0x0f)
+  if (type < 0xa0) return readArray(r, type & 0x0f)
+  if (type < 0xc0) return readStr(r, type & 0x1f)
+  if (type >= 0xe0) return type - 0x100
+  const take = (n, get) => {
+    const v = get(r.pos)
+    r.pos += n
+    return v
+  }
+  switch (type) {
+    case 0xc0:
+      return null
+    case 0xc2:
+      return false
+    case 0xc3:
+      return true
+    case 0xc4:
+      return readBin(r, take(1, (p) => view.getUint8(p)))
+    case 0xc5:
+      return readBin(r, take(2, (p) => view.getUint16(p)))
+    case 0xc6:
+      return readBin(r, take(4, (p) => view.getUint32(p)))
+    case 0xca:
+      return take(4, (p) => view.getFloat32(p))
+    case 0xcb:
+      return take(8, (p) => view.getFloat64(p))
+    case 0xcc:
+      return take(1, (p) => view.getUint8(p))
+    case 0xcd:
+      return take(2, (p) => view.getUint16(p))
+    case 0xce:
+      return take(4, (p) => view.getUint32(p))
+    case 0xcf:
+      return take(8, (p) => view.getUint32(p) * 0x100000000 + view.getUint32(p + 4))
+    case 0xd0:
+      return take(1, (p) => view.getInt8(p))
+    case 0xd1:
+      return take(2, (p) => view.getInt16(p))
+    case 0xd2:
+      return take(4, (p) => view.getInt32(p))
+    case 0xd3:
+      return take(8, (p) => view.getInt32(p) * 0x100000000 + view.getUint32(p + 4))
+    case 0xd9:
+      return readStr(r, take(1, (p) => view.getUint8(p)))
+    case 0xda:
+      return readStr(r, take(2, (p) => view.getUint16(p)))
+    case 0xdb:
+      return readStr(r, take(4, (p) => view.getUint32(p)))
+    case 0xdc:
+      return readArray(r, take(2, (p) => view.getUint16(p)))
+    case 0xdd:
+      return readArray(r, take(4, (p) => view.getUint32(p)))
+    case 0xde:
+      return readMap(r, take(2, (p) => view.getUint16(p)))
+    case 0xdf:
+      return readMap(r, take(4, (p) => view.getUint32(p)))
+    default:
+      throw new Error(`msgpack: неподдерживаемый тип 0x${type.toString(16)}`)
+  }
+}
+
+function readStr(r, len) {
+  const s = textDecoder.decode(r.bytes.subarray(r.pos, r.pos + len))
+  r.pos += len
+  return s
+}
+
+function readBin(r, len) {
+  const out = r.bytes.slice(r.pos, r.pos + len)
+  r.pos += len
+  return out.buffer
+}
+
+function readArray(r, len) {
+  const out = new Array(len)
+  for (let i = 0; i < len; i++) out[i] = readValue(r)
+  return out
+}
+
+function readMap(r, len) {
+  const out = {}
+  for (let i = 0; i < len; i++) {
+    const key = readValue(r)
+    out[key] = readValue(r)
+  }
+  return out
+}
+
+export function decodeMsgpack(data) {
+  const bytes =
+    data instanceof ArrayBuffer
+      ? new Uint8Array(data)
+      : new Uint8Array(data.buffer, data.byteOffset, data.byteLength)
+  const r = { bytes, view: new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength), pos: 0 }
+  const value = readValue(r)
+  if (r.pos !== bytes.length) throw new Error('msgpack: лишние байты в кадре')
+  return value
+}
+
+// -----------------------------------------------------------------------------
+// Парсер для socket.io-client (`io({ parser })`)
+// -----------------------------------------------------------------------------
+
+export const protocol = 5
+
+export class Encoder {
+  encode(packet) {
+    return [encodeMsgpack(packet)]
+  }
+}
+
+export class Decoder {
+  constructor() {
+    this.listeners = []
+  }
+
+  /** Менеджер socket.io подписывается в `onopen` и отписывается через `off` при обрыве. */
+  on(event, fn) {
+    if (event === 'decoded') this.listeners.push(fn)
+    return this
+  }
+
+  off(event, fn) {
+    if (event === 'decoded') this.listeners = this.listeners.filter((l) => l !== fn)
+    return this
+  }
+
+  add(data) {
+    if (typeof data === 'string') throw new Error('msgpack: ожидался бинарный кадр')
+    const packet = decodeMsgpack(data)
+    if (!Number.isInteger(packet?.type) || typeof packet.nsp !== 'string') {
+      throw new Error('msgpack: некорректный пакет')
+    }
+    for (const fn of this.listeners) fn(packet)
+  }
+
+  /** Буфера частичных пакетов нет (кадр всегда целый) — освобождать нечего. */
+  destroy() {}
+}
+
+export const msgpackParser = { protocol, Encoder, Decoder }
@@ -1,8 +1,23 @@
 import { getToken, getUsername } from './auth.js'
+import { msgpackParser } from './socket-msgpack.js'
 
 let socket = null
 /** Намеренное отключение (выход из аккаунта): не показывать баннер «обрыв связи». */
 let intentionalDisconnect = false
+/** Одноразовый билет от сервера: переподключение в течение TTL обходится без запросов к БД. */
+let resumeTicket = null
+/** Отложенная попытка по подсказке сервера `retry_after`. */
+let retryTimer = null
+/** Форматы кадров, объявленные сервером в `/api/me`; до ответа — только JSON. */
+let serverSerializers = ['json']
+
+/** Запомнить `socket_serializers` из `/api/me`: действует на следующее `connectSocket()`. */
+export function setSocketSerializers(list) {
+  serverSerializers = Array.isArray(list) && list.length ? list : ['json']
+}
+
+const AUTH_ERROR_RE =
+  /sign in|log in again|authentication required|authentication error|token expired|user not found|please log in|session expired|banned/i
 
 export function connectSocket() {
   if (typeof io === 'undefined') {
@@ -14,14 +29,24 @@ export function connectSocket() {
   if (socket) return socket
 
   intentionalDisconnect = false
+  /** MessagePack: бинарные кадры меньше и разбираются быстрее JSON; выбор — в query рукопожатия. */
+  const msgpack = serverSerializers.includes('msgpack')
   socket = io({
     path: '/socket.io',
+    ...(msgpack ? { parser: msgpackParser, query: { serializer: 'msgpack' } } : {}),
     transports: ['websocket', 'polling'],
     upgrade: true,
     reconnection: true,
     reconnectionAttempts: 10,
     reconnectionDelay: 1000,
-    reconnectionDelayMax: 5000,
+    reconnectionDelayMax: 10000,
+    /** Разброс задержек, чтобы вкладки после рестарта сервера не стучались синхронно. */
+    randomizationFactor: 0.5,
+    /** Токен проверяется в рукопожатии; функция вызывается на каждое (пере)подключение. */
+    auth: (cb) => {
+      const ticket = resumeTicket
+      cb({ username: getUsername(), token: getToken(), ...(ticket ? { ticket } : {}) })
+    },
   })
 
   /** Чтобы не показывать «соединение восстановлено» при самом первом подключении. */
@@ -33,16 +58,16 @@ export function connectSocket() {
     )
   }
 
+  socket.on('session', (data) => {
+    resumeTicket = data?.ticket || null
+  })
+
   socket.on('connect', () => {
-    const token = getToken()
-    const username = getUsername()
-    if (token && username) {
-      socket.emit('user_online', { username, token })
-    }
     if (wasDisconnected) {
       wasDisconnected = false
       emitConnectionState('restored')
     }
+    if (pendingOps.length) flushOpsOnConnect()
   })
 
   socket.on('disconnect', (reason) => {
@@ -52,8 +77,27 @@ export function connectSocket() {
     emitConnectionState('lost')
   })
 
-  socket.on('connect_error', () => {
+  socket.on('connect_error', (err) => {
     if (intentionalDisconnect) return
+    /** Сервер отклонил рукопожатие: токен недействителен, переподключаться бессмысленно. */
+    if (AUTH_ERROR_RE.test((err && err.message) || '')) {
+      window.dispatchEvent(new CustomEvent('nebula-auth-lost'))
+      return
+    }
+    /**
+     * Сервер перегружен (волна переподключений) и прислал окно, за которое он
+     * разберёт очередь отказов. Отказ в рукопожатии не запускает автопереподключение —
+     * планируем сами, в случайный момент окна (full jitter), чтобы повторы не шли пачкой.
+     */
+    const retryAfter = Number(err?.data?.retry_after)
+    if (retryAfter > 0) {
+      clearTimeout(retryTimer)
+      const delayMs = Math.random() * retryAfter * 1000
+      retryTimer = setTimeout(() => {
+        retryTimer = null
+        if (socket && !socket.connected && !intentionalDisconnect) socket.connect()
+      }, delayMs)
+    }
     console.warn('Ошибка подключения к серверу сокетов')
     wasDisconnected = true
     emitConnectionState('lost')
@@ -61,11 +105,7 @@ export function connectSocket() {
 
   socket.on('error', (data) => {
     const msg = (data && data.message) || ''
-    if (
-      /sign in|log in again|authentication required|authentication error|token expired|user not found|please log in|session expired|banned/i.test(
-        msg,
-      )
-    ) {
+    if (AUTH_ERROR_RE.test(msg)) {
       window.dispatchEvent(new CustomEvent('nebula-auth-lost'))
       return
     }
@@ -81,6 +121,12 @@ export function connectSocket() {
 
 export function disconnectSocket() {
   intentionalDisconnect = true
+  resumeTicket = null
+  clearTimeout(retryTimer)
+  retryTimer = null
+  clearTimeout(opsTimer)
+  opsTimer = null
+  pendingOps = []
   if (socket) {
     socket.disconnect()
     socket = null
@@ -94,3 +140,77 @@ export function disconnectSocket() {
 export function getSocket() {
   return socket
 }
+
+/** Операции над сообщениями копятся столько мс и уходят одним `batch` (одна проверка и транзакция). */
+const OP_BATCH_DELAY_MS = 25
+/** Ответ на `batch` дольше — пачка считается потерянной (обрыв посреди отправки). */
+const OP_ACK_TIMEOUT_MS = 15000
+/** Сколько операций держим, пока нет связи; дальше — отказ с ошибкой. */
+const MAX_PENDING_OPS = 200
+/** Не больше за один `batch` — как `BATCH_MAX_OPS` в `handlers/socket_messages.py`. */
+export const BATCH_MAX_OPS = 100
+/** Фоновые операции: об их ошибках пользователю не сообщаем. */
+const QUIET_OPS = new Set(['mark_as_read', 'mark_read_batch', 'typing', 'stop_typing'])
+/** Имеют смысл только сейчас: после переподключения не досылаются. */
+const TRANSIENT_OPS = new Set(['typing', 'stop_typing'])
+let pendingOps = []
+let opsTimer = null
+
+function reportOpError(message) {
+  window.dispatchEvent(new CustomEvent('nebula-socket-app-error', { detail: { message } }))
+}
+
+/** Отправить накопленное; без связи операции ждут `connect` (см. `connectSocket`). */
+function flushOps() {
+  clearTimeout(opsTimer)
+  opsTimer = null
+  if (!socket?.connected) return
+  /** Накопленное без связи может не влезть в одну пачку: сервер отклонил бы её целиком. */
+  while (pendingOps.length) sendOpBatch(pendingOps.splice(0, BATCH_MAX_OPS))
+}
+
+function sendOpBatch(ops) {
+  socket.timeout(OP_ACK_TIMEOUT_MS).emit('batch', { username: getUsername(), ops }, (err, ack) => {
+    /**
+     * Ответа нет — дошла ли пачка, неизвестно; повтор мог бы, например, дважды
+     * переключить реакцию, поэтому не досылаем, а сообщаем.
+     */
+    if (err) {
+      if (ops.some((o) => !QUIET_OPS.has(o.op))) reportOpError('Connection lost, action may not be saved')
+      return
+    }
+    const errors = ack?.error
+      ? [ack.error]
+      : (ack?.results || [])
+          .filter((r) => r && !r.ok && r.error && !QUIET_OPS.has(r.op))
+          .map((r) => r.error)
+    /** Как и серверное `error`: одна всплывашка на пачку. */
+    if (errors.length) reportOpError(errors[0])
+  })
+}
+
+/** Досылка после переподключения: «печатает…» уже неактуально. */
+function flushOpsOnConnect() {
+  pendingOps = pendingOps.filter((o) => !TRANSIENT_OPS.has(o.op))
+  flushOps()
+}
+
+/**
+ * Поставить операцию (`add_reaction`, `edit_message`, `typing`, …) в ближайший `batch`.
+ * При обрыве операции (кроме «печатает») копятся и уходят после переподключения.
+ */
+export function queueSocketOp(op, fields) {
+  if (!socket) return false
+  if (!socket.connected) {
+    if (TRANSIENT_OPS.has(op)) return false
+    if (pendingOps.length >= MAX_PENDING_OPS) {
+      if (!QUIET_OPS.has(op)) reportOpError('No connection to the server')
+      return false
+    }
+    pendingOps.push({ op, ...fields })
+    return true
+  }
+  pendingOps.push({ op, ...fields })
+  if (!opsTimer) opsTimer = setTimeout(flushOps, OP_BATCH_DELAY_MS)
+  return true
+}
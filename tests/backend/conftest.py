@@ -0,0 +1,32 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+SRC = Path(__file__).resolve().parents[2] / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+
+@pytest.fixture
+def socket_app(monkeypatch, tmp_path):
+    """Приложение ``testing`` без MySQL: нужные функции ``db`` подменяет сам тест."""
+    import app as appmod
+    import db
+
+    monkeypatch.setattr(appmod, "MEDIA_DIR", str(tmp_path / "media"))
+    monkeypatch.setattr(appmod, "_configure_logging", lambda app, log_dir: None)
+    monkeypatch.setattr(db, "init_connection_pool", lambda: False)
+    for name in ("update_last_seen", "list_contact_usernames"):
+        monkeypatch.setattr(db, name, lambda *args, **kwargs: None)
+    app, socketio = appmod.create_app(testing=True, strict_db=False)
+    yield app, socketio
+    app.extensions["nebula_presence"].clear_all()
+
+
+def login(app, username):
+    """Выдать токен, как ``/api/login``; вернуть ``auth`` для рукопожатия."""
+    token = f"token-{username}"
+    app.extensions["auth_token_store"].put(token, username, time.time(), 3600)
+    return {"username": username, "token": token}
@@ -0,0 +1,23 @@
+from utils.admission import MAX_RETRY_AFTER_SEC, AdmissionControl, TokenBucket
+
+
+def test_retry_window_grows_with_rejected_backlog():
+    bucket = TokenBucket(rate_per_sec=2, burst=2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+
+    waits = [bucket.try_acquire() for _ in range(10)]
+
+    # Десятому отказу ждать, пока ведро пропустит девятерых до него.
+    assert waits == sorted(waits)
+    assert waits[-1] >= 10 / 2 - 0.1
+    assert bucket.stats()["rejected"] == 10
+
+
+def test_admit_caps_hint_and_admits_under_limit():
+    admission = AdmissionControl(connect_rate=1, bootstrap_rate=1)
+    assert admission.admit_connect() is None
+    assert admission.admit_connect() is None
+    hints = [admission.admit_connect() for _ in range(100)]
+    assert hints[0] >= 1.0
+    assert hints[-1] == MAX_RETRY_AFTER_SEC
@@ -0,0 +1,38 @@
+import pytest
+from conftest import login
+
+import db
+
+CAS = "/media/ab/cd/abcd" + "0" * 60 + ".png"
+
+
+@pytest.fixture
+def profile_app(socket_app, monkeypatch):
+    app, _ = socket_app
+    saved = []
+    monkeypatch.setattr(db, "get_user", lambda username: {"username": username})
+    monkeypatch.setattr(
+        db, "get_user_profile", lambda username: {"avatar": "", "avatar_type": "emoji"}
+    )
+    monkeypatch.setattr(
+        db, "media_uploaded_by", lambda path, username: username == "alice"
+    )
+    monkeypatch.setattr(
+        db, "upsert_user_profile", lambda username, **fields: saved.append(fields) or True
+    )
+    return app, saved
+
+
+@pytest.mark.parametrize("username,status", [("alice", 200), ("bob", 400)])
+def test_avatar_must_be_uploaded_by_the_profile_owner(profile_app, username, status):
+    app, saved = profile_app
+    token = login(app, username)["token"]
+
+    resp = app.test_client().post(
+        "/api/profile",
+        json={"username": username, "avatar": CAS, "avatarType": "image"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    assert resp.status_code == status
+    assert [s["avatar"] for s in saved] == ([CAS] if status == 200 else [])
@@ -0,0 +1,75 @@
+import queue
+from types import SimpleNamespace
+
+import pytest
+import socketio
+
+from utils import backpressure
+from utils.socket_serializer import install_socket_serializer
+
+
+class _FakeEioSocket:
+    """Сокет Engine.IO: очередь нужной глубины и список отправленного."""
+
+    closed = False
+
+    def __init__(self, depth):
+        self.queue = queue.Queue()
+        for _ in range(depth):
+            self.queue.put(None)
+        self.sent = []
+
+    def send(self, pkt):
+        self.sent.append(pkt)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(backpressure, "_installed", None)
+    srv = socketio.Server()
+    srv.start_background_task = lambda *args, **kwargs: None
+    return srv
+
+
+def _connect(srv, eio_sid, depth, query=""):
+    srv.eio.sockets[eio_sid] = sock = _FakeEioSocket(depth)
+    srv.environ[eio_sid] = {"QUERY_STRING": query}
+    srv.manager.connect(eio_sid, "/")
+    return sock
+
+
+def _events(sock):
+    return [pkt.data for pkt in sock.sent]
+
+
+def test_serializer_after_backpressure_is_refused(server):
+    backpressure.install_backpressure(SimpleNamespace(server=server))
+    with pytest.raises(RuntimeError):
+        install_socket_serializer(SimpleNamespace(server=server))
+
+
+def test_msgpack_clients_are_classified_by_event_name(server):
+    assert install_socket_serializer(SimpleNamespace(server=server))
+    guard = backpressure.install_backpressure(SimpleNamespace(server=server))
+    sock = _connect(server, "e1", backpressure.EPHEMERAL_DEPTH, "serializer=msgpack")
+
+    server.emit("user_typing", {"username": "bob"})
+    server.emit("new_message", {"text": "hi"})
+    # Эфемерное отброшено, сообщение ушло бинарным кадром MessagePack.
+    assert guard.dropped_ephemeral == 1
+    assert len(sock.sent) == 1 and isinstance(sock.sent[0].data, bytes)
+
+
+def test_lagging_client_gets_resync_without_further_traffic(server):
+    guard = backpressure.install_backpressure(SimpleNamespace(server=server))
+    sock = _connect(server, "e1", backpressure.STATE_DEPTH)
+
+    server.emit("reaction_updated", {"message_id": "m1"})
+    assert guard.dropped_state == 1 and sock.sent == []
+
+    with sock.queue.mutex:
+        sock.queue.queue.clear()
+    # Новых событий для клиента нет: подсказку отправляет проверка из stats().
+    assert guard.stats()["lagging"] == 0
+    assert guard.resync_hints == 1
+    assert len(sock.sent) == 1 and '"resync_required"' in _events(sock)[0]
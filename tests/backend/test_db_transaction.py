@@ -0,0 +1,51 @@
+from contextlib import contextmanager
+
+import pytest
+
+import db
+
+
+class _Connection:
+    def __init__(self):
+        self.calls = []
+
+    def commit(self):
+        self.calls.append("commit")
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    conn = _Connection()
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    monkeypatch.setattr(db, "get_db_connection", fake_connection)
+    return conn
+
+
+def test_after_commit_runs_after_commit(connection):
+    seen = []
+    with db.transaction():
+        db.after_commit(lambda: seen.append(list(connection.calls)))
+        assert seen == []
+    assert seen == [["commit"]]
+
+
+def test_after_commit_is_dropped_on_rollback(connection):
+    seen = []
+    with pytest.raises(RuntimeError), db.transaction():
+        db.after_commit(lambda: seen.append("applied"))
+        raise RuntimeError("boom")
+    assert connection.calls == ["rollback"]
+    assert seen == []
+
+
+def test_after_commit_outside_transaction_runs_now():
+    seen = []
+    db.after_commit(lambda: seen.append("applied"))
+    assert seen == ["applied"]
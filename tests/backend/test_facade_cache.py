@@ -0,0 +1,89 @@
+import json
+from datetime import UTC, datetime
+from decimal import Decimal
+
+import db
+from utils import facade_cache as fc
+
+
+def _roundtrip(value):
+    raw = json.dumps(value, default=fc._encode_default)
+    return json.loads(raw, object_hook=fc._decode_object)
+
+
+def test_redis_encoding_restores_datetimes():
+    row = {
+        "room_id": "r1",
+        "created_at": datetime(2026, 1, 2, 3, 4, 5),
+        "edited_at": datetime(2026, 1, 2, 3, 4, 5, 678, tzinfo=UTC),
+        "nested": [{"at": datetime(2026, 5, 6)}],
+    }
+    assert _roundtrip(row) == row
+
+
+def test_redis_encoding_uses_json_provider_defaults():
+    assert _roundtrip({"n": Decimal("1.50")}) == {"n": "1.50"}
+    assert _roundtrip(("a", "b")) == ["a", "b"]
+
+
+def test_redis_payload_is_not_pickle():
+    class _Redis:
+        def __init__(self):
+            self.data = {}
+
+        def pipeline(self, transaction=False):
+            return self
+
+        def set(self, key, raw, ex=None):
+            self.data[key] = raw
+
+        def sadd(self, *args):
+            pass
+
+        def expire(self, *args):
+            pass
+
+        def execute(self):
+            pass
+
+        def get(self, key):
+            return self.data.get(key)
+
+    cache = fc.FacadeCache()
+    cache._redis = _Redis()
+    entry = fc._Entry({"at": datetime(2026, 1, 1)}, 0.0, 60, 0, ("room:r1",))
+    cache._redis_set("k", entry)
+
+    raw = cache._redis.data[fc.KEY_PREFIX + "k"]
+    assert json.loads(raw)[0] == {"at": {"$datetime": "2026-01-01T00:00:00"}}
+    value, _, tags = cache._redis_get("k")
+    assert value == {"at": datetime(2026, 1, 1)}
+    assert tags == ("room:r1",)
+
+
+def test_tag_invalidation_drops_only_tagged_entries():
+    cache = fc.FacadeCache()
+    calls = []
+
+    @cache.cached(ttl=60, tags=lambda room_id: [f"room:{room_id}"])
+    def get_room(room_id):
+        calls.append(room_id)
+        return {"room_id": room_id}
+
+    for room_id in ("r1", "r2", "r1"):
+        get_room(room_id)
+    assert calls == ["r1", "r2"]
+
+    cache.invalidate_tags("room:r1")
+    for room_id in ("r1", "r2"):
+        get_room(room_id)
+    assert calls == ["r1", "r2", "r1"]
+
+
+def test_role_changes_are_seen_immediately(monkeypatch):
+    roles = iter(["admin", "user"])
+    monkeypatch.setattr(
+        db.moderation_repo, "get_user_role", lambda *args: next(roles)
+    )
+    assert db.get_user_role("alice") == "admin"
+    assert db.get_user_role("alice") == "user"
@@ -0,0 +1,40 @@
+from utils import pinned_cache, profile_cache
+
+
+def test_remote_pin_change_drops_room_and_changes_etag():
+    pinned_cache.clear_pinned_cache()
+    pinned_cache.get_pinned("r1", lambda room_id: [{"message_id": "m1"}])
+    etag = pinned_cache.pinned_etag("r1")
+
+    pinned_cache.on_invalidate([pinned_cache.pinned_tag("r1")])
+
+    assert pinned_cache.pinned_etag("r1") != etag
+    assert pinned_cache.get_pinned("r1", lambda room_id: []) == []
+
+
+def test_remote_message_edit_drops_room_with_that_pin():
+    pinned_cache.clear_pinned_cache()
+    pinned_cache.get_pinned("r1", lambda room_id: [{"message_id": "m1"}])
+    etag = pinned_cache.pinned_etag("r1")
+
+    pinned_cache.on_invalidate(["message:m1"])
+
+    assert pinned_cache.pinned_etag("r1") != etag
+
+
+def test_remote_profile_change_bumps_version_and_etag():
+    profile_cache.clear_profile_cache()
+    profile_cache.get_user_cards(["bob"], lambda names: {"bob": {"bio": "old"}})
+    etag = profile_cache.cards_etag(["bob"], {})
+
+    profile_cache.on_invalidate([profile_cache.profile_tag("bob")])
+
+    assert profile_cache.cards_etag(["bob"], {}) != etag
+    cards = profile_cache.get_user_cards(["bob"], lambda names: {"bob": {"bio": "new"}})
+    assert cards["bob"] == {"bio": "new"}
+
+
+def test_full_clear_changes_every_etag():
+    etag = pinned_cache.pinned_etag("untouched")
+    pinned_cache.on_invalidate(None)
+    assert pinned_cache.pinned_etag("untouched") != etag
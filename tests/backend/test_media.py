@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+
+import pytest
+
+from utils import media
+from utils.media_upload import ChunkedUploads
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 56
+
+
+def test_stream_is_staged_outside_the_media_root(tmp_path):
+    media_dir = str(tmp_path / "media")
+    media.ensure_media_dir(media_dir)
+    staging = media.media_staging_dir(media_dir)
+    seen = []
+
+    def chunks():
+        yield b"hello "
+        seen.extend(os.listdir(staging))
+        yield b"world"
+
+    path, size = media.write_media_stream(chunks(), media_dir, ".txt", 1024)
+    assert size == 11 and path.startswith("/media/")
+    assert len(seen) == 1 and seen[0].endswith(".part")
+    assert os.listdir(staging) == []
+    assert not staging.startswith(media_dir + os.sep)
+
+
+def test_same_content_is_stored_once(tmp_path):
+    media_dir = str(tmp_path / "media")
+    media.ensure_media_dir(media_dir)
+
+    first, _ = media.write_media_stream(iter([b"same"]), media_dir, ".txt", 1024)
+    second, _ = media.write_media_stream(iter([b"sa", b"me"]), media_dir, ".txt", 1024)
+    assert first == second
+    assert media.classify_media_name(first.removeprefix("/media/")) == "cas"
+    assert os.path.isfile(os.path.join(media_dir, first.removeprefix("/media/")))
+
+
+def test_hidden_and_partial_names_are_not_served():
+    assert media.classify_media_name("abc.png") == "legacy"
+    assert media.classify_media_name(".tmpab12.part") is None
+    assert media.classify_media_name("up_1f2e.part") is None
+    assert media.classify_media_name(".uploads") is None
+
+
+def test_oversized_stream_leaves_no_files(tmp_path):
+    media_dir = str(tmp_path / "media")
+    media.ensure_media_dir(media_dir)
+
+    with pytest.raises(media.MediaTooLarge):
+        media.write_media_stream(iter([b"x" * 8, b"x" * 8]), media_dir, ".bin", 10)
+    assert os.listdir(media_dir) == []
+    assert os.listdir(media.media_staging_dir(media_dir)) == []
+
+
+def test_media_io_runs_inline_without_gevent():
+    assert media.run_media_io(threading.get_ident) == threading.get_ident()
+
+
+def test_partial_uploads_are_written_outside_the_media_root(tmp_path):
+    media_dir = str(tmp_path / "media")
+    media.ensure_media_dir(media_dir)
+    staging = media.media_staging_dir(media_dir)
+    uploads = ChunkedUploads(media_dir, 1024, logger=None)
+
+    upload_id = uploads.start("alice", "image", "a.png", "image/png", len(PNG))["upload_id"]
+    uploads.chunk("alice", upload_id, 0, PNG)
+    assert os.listdir(staging) == [f"{upload_id}.part"]
+    assert os.listdir(media_dir) == []
+    assert not staging.startswith(media_dir + os.sep)
+
+    uploads.abort("alice", upload_id)
+    assert os.listdir(staging) == []
+
+
+def test_stale_staging_files_are_swept(tmp_path):
+    media_dir = str(tmp_path / "media")
+    media.ensure_media_dir(media_dir)
+    staging = media.media_staging_dir(media_dir)
+    old = os.path.join(staging, "old.part")
+    fresh = os.path.join(staging, "fresh.part")
+    for name in (old, fresh):
+        with open(name, "wb") as f:
+            f.write(b"x")
+    stale = time.time() - media.MEDIA_STAGING_GRACE_SEC - 60
+    os.utime(old, (stale, stale))
+
+    assert media.sweep_media_staging(media_dir, logger=None) == 1
+    assert os.listdir(staging) == ["fresh.part"]
+
+
+def test_orphans_are_removed_only_when_forgotten(tmp_path):
+    media_dir = str(tmp_path / "media")
+    media.ensure_media_dir(media_dir)
+    paths = {}
+    for body in (b"kept", b"gone"):
+        path, _ = media.write_media_stream(iter([body]), media_dir, ".txt", 1024)
+        paths[body] = os.path.join(media_dir, path.removeprefix("/media/"))
+        old = time.time() - 120
+        os.utime(paths[body], (old, old))
+    names = {body: os.path.basename(p) for body, p in paths.items()}
+
+    removed = media.collect_orphan_media(
+        media_dir,
+        logger=None,
+        orphans=[names[b"kept"], names[b"gone"]],
+        forget=lambda name: name == names[b"gone"],
+        grace_sec=60,
+    )
+
+    assert removed == 1
+    assert os.path.exists(paths[b"kept"]) and not os.path.exists(paths[b"gone"])
@@ -0,0 +1,40 @@
+import pytest
+
+from utils import pinned_cache
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    pinned_cache.clear_pinned_cache()
+    yield
+    pinned_cache.clear_pinned_cache()
+
+
+def _loader(calls):
+    def load(room_id):
+        calls.append(room_id)
+        return [{"message_id": f"{room_id}-m1"}]
+
+    return load
+
+
+def test_pinned_list_is_reloaded_only_after_invalidation():
+    calls = []
+    load = _loader(calls)
+
+    pinned_cache.get_pinned("r1", load)
+    pinned_cache.get_pinned("r1", load)
+    assert calls == ["r1"]
+
+    # Правка сообщения знает только его id — сбрасывается его комната.
+    pinned_cache.invalidate_pinned_messages(["r1-m1", "unknown"])
+    pinned_cache.get_pinned("r1", load)
+    assert calls == ["r1", "r1"]
+
+
+def test_pinned_etag_changes_on_pin_and_unpin():
+    etag = pinned_cache.pinned_etag("r1")
+    assert pinned_cache.pinned_etag("r1") == etag
+    pinned_cache.invalidate_pinned("r1")
+    assert pinned_cache.pinned_etag("r1") != etag
+    assert pinned_cache.pinned_etag("r2") != pinned_cache.pinned_etag("r1")
@@ -0,0 +1,44 @@
+import db
+from repositories import rooms as rooms_repo
+from utils.facade_cache import facade_cache
+from utils.presence_fanout import PresenceFanout
+
+
+class _SocketIO:
+    def __init__(self):
+        self.sent = []
+
+    def emit(self, event, data, to=None, namespace=None):
+        self.sent.append((event, data, to))
+
+
+def test_contacts_are_cached_between_flushes_and_dropped_on_new_group(monkeypatch):
+    facade_cache.clear()
+    scans = []
+
+    def peers(get_db_cursor, logger, Error, username):
+        scans.append(username)
+        return ["bob"]
+
+    monkeypatch.setattr(rooms_repo, "list_room_peer_usernames", peers)
+    monkeypatch.setattr(db, "list_private_room_ids_for_user", lambda username: [])
+    monkeypatch.setattr(rooms_repo, "create_room", lambda *args: True)
+    monkeypatch.setattr(db, "update_last_seen", lambda username: None)
+    monkeypatch.setattr(db, "get_last_seen", lambda username: None)
+    sio = _SocketIO()
+    fanout = PresenceFanout(sio, db, lambda username: False)
+
+    for _ in range(3):
+        fanout.online("alice")
+        fanout.flush()
+        fanout.offline("alice", grace=0)
+        fanout.flush()
+    # Шесть переходов — один скан комнат.
+    assert scans == ["alice"]
+    assert [to for _, _, to in sio.sent] == ["user:bob"] * 6
+
+    db.create_room("room_1", "Group", ["alice", "carol"])
+    fanout.online("alice")
+    fanout.flush()
+    assert scans == ["alice", "alice"]
+    facade_cache.clear()
@@ -0,0 +1,24 @@
+import logging
+
+from utils.presence_registry import MemoryPresenceRegistry, build_presence_registry
+
+
+def test_online_status_follows_the_last_connection():
+    registry = MemoryPresenceRegistry()
+
+    assert registry.add("s1", "alice") == 0
+    assert registry.add("s2", "alice") == 1
+    assert registry.online_many(["alice", "bob"]) == {"alice": True, "bob": False}
+
+    assert registry.remove("s1") == ("alice", 1)
+    assert registry.is_online("alice")
+    assert registry.remove("s2") == ("alice", 0)
+    assert not registry.is_online("alice")
+    assert registry.remove("s2") == (None, 0)
+
+
+def test_unreachable_redis_falls_back_to_memory():
+    registry = build_presence_registry(
+        "redis://127.0.0.1:1/0", logging.getLogger(__name__)
+    )
+    assert isinstance(registry, MemoryPresenceRegistry)
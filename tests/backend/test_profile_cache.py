@@ -0,0 +1,43 @@
+import pytest
+
+from utils import profile_cache
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    profile_cache.clear_profile_cache()
+    yield
+    profile_cache.clear_profile_cache()
+
+
+def _loader(calls, rows):
+    def load(names):
+        calls.append(list(names))
+        return {un: rows[un] for un in names if un in rows}
+
+    return load
+
+
+def test_cards_are_loaded_once_until_the_version_changes():
+    calls = []
+    load = _loader(calls, {"alice": {"nickname": "A"}})
+
+    assert profile_cache.get_user_cards(["alice", "ghost"], load) == {
+        "alice": {"nickname": "A"},
+        "ghost": None,
+    }
+    profile_cache.get_user_cards(["ghost", "alice"], load)
+    assert calls == [["alice", "ghost"]]
+
+    profile_cache.bump_profile_version("alice")
+    profile_cache.get_user_cards(["alice", "ghost"], load)
+    assert calls == [["alice", "ghost"], ["alice"]]
+
+
+def test_etag_follows_versions_and_online_flags():
+    etag = profile_cache.cards_etag(["bob", "alice"], {"alice": True})
+
+    assert profile_cache.cards_etag(["alice", "bob"], {"alice": True}) == etag
+    assert profile_cache.cards_etag(["alice", "bob"], {}) != etag
+    profile_cache.bump_profile_version("bob")
+    assert profile_cache.cards_etag(["alice", "bob"], {"alice": True}) != etag
@@ -0,0 +1,152 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from repositories.messages import hydrate_message_row
+from utils import recent_messages
+
+
+@pytest.fixture(autouse=True)
+def _clean_buffer():
+    recent_messages.clear_recent_messages()
+    yield
+    recent_messages.clear_recent_messages()
+
+
+def _msg(message_id, **fields):
+    return {"message_id": message_id, "username": "alice", "text": message_id, **fields}
+
+
+def _ids(page):
+    return [m["message_id"] for m in page]
+
+
+def test_first_page_is_served_from_the_buffer_and_patched_in_place():
+    page = recent_messages.first_page("r1", 10, lambda room_id, limit: [_msg("m1")])
+    assert _ids(page) == ["m1"]
+
+    recent_messages.append("r1", _msg("m2"))
+    recent_messages.edit_message("m1", "edited", datetime(2026, 1, 1, tzinfo=UTC))
+    recent_messages.toggle_reaction("m2", "bob", "👍")
+
+    page = recent_messages.first_page("r1", 10, lambda room_id, limit: pytest.fail())
+    assert _ids(page) == ["m1", "m2"]
+    assert page[0]["text"] == "edited" and page[0]["edited"] is True
+    assert page[1]["reactions"] == {"👍": ["bob"]}
+
+
+def test_invalidation_from_another_worker_drops_the_room():
+    recent_messages.first_page("r1", 10, lambda room_id, limit: [_msg("m1")])
+    recent_messages.on_invalidate([recent_messages.message_tag("m1")])
+    assert recent_messages.find("m1") is None
+
+
+def test_write_generation_changes_on_writes_to_buffered_and_unknown_rooms():
+    recent_messages.first_page("r1", 10, lambda room_id, limit: [_msg("m1")])
+    gen = recent_messages.write_generation("r1")
+
+    recent_messages.toggle_reaction("m1", "bob", "👍")
+    after_reaction = recent_messages.write_generation("r1")
+    assert after_reaction != gen
+
+    # Сообщение вне буфера: комната неизвестна — меняются поколения всех комнат.
+    other = recent_messages.write_generation("r2")
+    recent_messages.add_reader("not-buffered", "bob")
+    assert recent_messages.write_generation("r1") != after_reaction
+    assert recent_messages.write_generation("r2") != other
+
+
+def test_page_loaded_across_an_unplaced_write_is_not_buffered():
+    def load(room_id, limit):
+        recent_messages.add_reader("m1", "bob")
+        return [_msg("m1")]
+
+    recent_messages.first_page("r1", 10, load)
+    assert recent_messages.find("m1") is None
+
+
+def _reply(message_id, reply_to, expires_at=None):
+    return _msg(
+        message_id, expires_at=expires_at, replyTo={"id": reply_to, "text": "orig"}
+    )
+
+
+def test_reply_target_index_follows_the_buffer(monkeypatch):
+    monkeypatch.setattr(recent_messages, "RECENT_MESSAGES_PER_ROOM", 2)
+    now = datetime.now(UTC)
+    rows = [_reply("a", "orig1"), _reply("b", "orig2", now + timedelta(hours=1))]
+    recent_messages.first_page("r1", 2, lambda room_id, limit: rows)
+    targets = recent_messages._room_by_reply_target
+    assert targets == {"orig1": "r1", "orig2": "r1"}
+
+    # Вытеснение из полного буфера.
+    recent_messages.append("r1", _reply("c", "orig2"))
+    assert targets == {"orig2": "r1"}
+
+    # Удаление одного из двух ответов: второй ещё держит запись.
+    recent_messages.remove_message("c")
+    assert targets == {"orig2": "r1"}
+    recent_messages.remove_message("b")
+    assert targets == {}
+
+    # Истечение срока при чтении из буфера.
+    recent_messages.append("r1", _reply("d", "orig3", now - timedelta(minutes=1)))
+    assert targets == {"orig3": "r1"}
+    recent_messages.first_page("r1", 1, lambda room_id, limit: [])
+    assert targets == {}
+
+
+def _row(message_id, expires_at=None):
+    """Строка ``messages`` как её отдаёт MySQL: ``DATETIME`` без часового пояса."""
+    return {
+        "message_id": message_id,
+        "room_id": "r1",
+        "username": "alice",
+        "text": message_id,
+        "media_type": None,
+        "reply_to_id": None,
+        "forwarded_from": None,
+        "expires_at": expires_at,
+        "edited_at": None,
+        "created_at": datetime(2026, 1, 1, 12, 0),
+    }
+
+
+def _hydrated(message_id, expires_at=None):
+    return hydrate_message_row(_row(message_id, expires_at), reactions={}, read_by=[])
+
+
+def test_hydrate_makes_datetimes_aware_utc():
+    msg = _hydrated("m1", datetime(2030, 1, 1, 0, 0))
+    assert msg["timestamp"] == datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+    assert msg["expires_at"].tzinfo is UTC
+    assert msg["edited_at"] is None
+
+
+def test_first_page_drops_expired_rows():
+    naive_now = datetime.now(UTC).replace(tzinfo=None)
+    rows = [
+        _hydrated("gone", naive_now - timedelta(minutes=1)),
+        _hydrated("kept", naive_now + timedelta(hours=1)),
+        _hydrated("plain"),
+    ]
+
+    page = recent_messages.first_page("r1", 50, lambda room_id, limit: rows)
+    assert [m["message_id"] for m in page] == ["kept", "plain"]
+
+    # Второе чтение — из буфера: просроченное вычищается и из индекса.
+    page = recent_messages.first_page("r1", 50, lambda room_id, limit: pytest.fail())
+    assert [m["message_id"] for m in page] == ["kept", "plain"]
+    assert recent_messages.find("gone") is None
+
+
+def test_expiry_accepts_naive_aware_and_string_values():
+    now = datetime.now(UTC)
+    past = now - timedelta(seconds=5)
+    assert recent_messages._is_expired({"expires_at": past}, now)
+    assert recent_messages._is_expired({"expires_at": past.replace(tzinfo=None)}, now)
+    assert recent_messages._is_expired(
+        {"expires_at": past.isoformat().replace("+00:00", "Z")}, now
+    )
+    assert not recent_messages._is_expired({"expires_at": now + timedelta(minutes=1)}, now)
+    assert not recent_messages._is_expired({"expires_at": "not a date"}, now)
@@ -0,0 +1,70 @@
+import socketio
+
+from utils import room_delivery
+from utils.presence_registry import MemoryPresenceRegistry
+
+
+class _SocketIO:
+    def __init__(self):
+        self.server = socketio.Server()
+        self.emitted = []
+
+    def emit(self, event, payload, to=None, namespace=None):
+        self.emitted.append((event, payload, to))
+
+
+def _connect(sio, presence, username):
+    sid = sio.server.manager.connect(f"eio-{username}", "/")
+    presence.add(sid, username)
+    return sid
+
+
+def _bind(monkeypatch):
+    sio, presence = _SocketIO(), MemoryPresenceRegistry()
+    monkeypatch.setattr(room_delivery, "_socketio", sio)
+    monkeypatch.setattr(room_delivery, "_presence", presence)
+    monkeypatch.setattr(room_delivery, "_active_room_by_sid", {})
+    monkeypatch.setattr(room_delivery, "_active_sids_by_room", {})
+    return sio, presence
+
+
+def _participants(sio, room_id):
+    return {sid for sid, _ in sio.server.manager.get_participants("/", room_id)}
+
+
+def test_socket_is_subscribed_only_to_the_open_chat(monkeypatch):
+    sio, presence = _bind(monkeypatch)
+    alice = _connect(sio, presence, "alice")
+
+    room_delivery.set_active_room(alice, "private_alice_bob")
+    room_delivery.set_active_room(alice, "private_alice_carol")
+
+    assert _participants(sio, "private_alice_bob") == set()
+    assert _participants(sio, "private_alice_carol") == {alice}
+    assert room_delivery.active_room_stats() == {"active_sids": 1, "active_rooms": 1}
+
+
+def test_reconciler_drops_sids_without_access_and_restores_dropped_ones(monkeypatch):
+    sio, presence = _bind(monkeypatch)
+    alice = _connect(sio, presence, "alice")
+    carol = _connect(sio, presence, "carol")
+    room_delivery.set_active_room(alice, "private_alice_bob")
+    sio.server.leave_room(alice, "private_alice_bob")
+    sio.server.enter_room(carol, "private_alice_bob")
+
+    result = room_delivery.reconcile_room_subscriptions()
+
+    assert result == {"rooms": 1, "entered": 1, "left": 1}
+    assert _participants(sio, "private_alice_bob") == {alice}
+
+
+def test_inbox_update_goes_to_every_member_personal_room():
+    sio = _SocketIO()
+    room_delivery.emit_inbox_update(sio, "private_alice_bob", {"message_id": "m1"})
+    assert sio.emitted == [
+        (
+            "inbox_update",
+            {"room": "private_alice_bob", "message_id": "m1"},
+            ["user:alice", "user:bob"],
+        )
+    ]
@@ -0,0 +1,80 @@
+import pytest
+
+from utils import outbound_batch, room_events
+from utils.room_events import MemoryRoomEventLog, publish_room_event
+from utils.sharded_lock import ShardedLock
+
+
+class _SocketIO:
+    def __init__(self):
+        self.sent = []
+
+    def emit(self, event, data, to=None, namespace=None, skip_sid=None):
+        self.sent.append((event, data, to, skip_sid))
+
+
+@pytest.fixture
+def sio():
+    socketio = _SocketIO()
+    locks = ShardedLock()
+    outbound_batch.bind_outbound_batch(socketio, 50, locks)
+    room_events.bind_room_events(socketio, MemoryRoomEventLog(), locks)
+    yield socketio
+    outbound_batch.bind_outbound_batch(None, 0)
+    room_events.bind_room_events(None, None, None)
+
+
+def _seqs(sent):
+    out = []
+    for event, data, _, _ in sent:
+        if event == "batch":
+            out.extend(item["data"]["seq"] for item in data["events"])
+        else:
+            out.append(data["seq"])
+    return out
+
+
+def test_pending_coalesced_events_go_before_immediate_one(sio):
+    publish_room_event("r1", "reaction_updated", {"message_id": "m1"}, coalesce_key="r:m1")
+    publish_room_event("r1", "message_edited", {"message_id": "m1"})
+
+    assert [event for event, *_ in sio.sent] == ["batch", "message_edited"]
+    assert _seqs(sio.sent) == [1, 2]
+    assert outbound_batch.flush_outbound() == 0
+
+
+def test_coalesced_skip_sid_is_honoured(sio):
+    publish_room_event(
+        "r1", "reaction_updated", {"message_id": "m1"}, coalesce_key="r:m1", skip_sid="s1"
+    )
+    publish_room_event("r1", "message_read", {"message_id": "m2"}, coalesce_key="read:m2")
+    outbound_batch.flush_outbound()
+
+    to_room, to_sender = sio.sent
+    assert to_room[2] == "r1" and to_room[3] == ["s1"]
+    assert len(to_room[1]["events"]) == 2
+    assert to_sender[2] == "s1"
+    assert [e["event"] for e in to_sender[1]["events"]] == ["message_read"]
+
+
+def test_coalesced_repeats_do_not_leave_seq_gaps(sio):
+    publish_room_event(
+        "r1", "reaction_updated", {"message_id": "m1", "n": 1}, coalesce_key="r:m1"
+    )
+    publish_room_event("r1", "message_read", {"message_id": "m2"}, coalesce_key="read:m2")
+    publish_room_event(
+        "r1", "reaction_updated", {"message_id": "m1", "n": 2}, coalesce_key="r:m1"
+    )
+    outbound_batch.flush_outbound()
+    publish_room_event("r1", "message_edited", {"message_id": "m1"})
+
+    # Заменённая реакция номер не заняла: курсор клиента идёт без пропусков.
+    assert _seqs(sio.sent) == [1, 2, 3]
+    batch = sio.sent[0][1]["events"]
+    assert [(e["event"], e["data"].get("n")) for e in batch] == [
+        ("message_read", None),
+        ("reaction_updated", 2),
+    ]
+    epoch, head = room_events.room_event_head("r1")
+    replay = room_events.room_events_since("r1", epoch, 0)
+    assert [data["seq"] for _, data in replay] == [1, 2, 3] and head == 3
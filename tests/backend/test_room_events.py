@@ -0,0 +1,33 @@
+from utils.room_events import MemoryRoomEventLog
+
+
+def test_resync_replays_only_missed_events():
+    log = MemoryRoomEventLog()
+    first = log.append("r1", "receive_message", {"message_id": "m1"})
+    log.append("r1", "message_edited", {"message_id": "m1"})
+    log.append("r1", "message_deleted", {"message_id": "m1"})
+
+    assert first == {
+        "room": "r1",
+        "message_id": "m1",
+        "seq": 1,
+        "epoch": first["epoch"],
+    }
+    assert [event for event, _ in log.since("r1", first["epoch"], 1)] == [
+        "message_edited",
+        "message_deleted",
+    ]
+    assert log.since("r1", first["epoch"], 3) == []
+
+
+def test_uncovered_gap_falls_back_to_history():
+    log = MemoryRoomEventLog(size=2)
+    epoch, _ = log.head("r1")
+    for n in range(4):
+        log.append("r1", "receive_message", {"message_id": f"m{n}"})
+
+    # Журнал помнит два последних события — с seq 1 догнать уже нельзя.
+    assert log.since("r1", epoch, 1) is None
+    assert [data["seq"] for _, data in log.since("r1", epoch, 2)] == [3, 4]
+    assert log.since("r1", "other-epoch", 4) is None
+    assert log.stats()["gaps"] == 2
@@ -0,0 +1,54 @@
+from datetime import UTC, datetime
+
+from conftest import login
+
+import db
+
+
+def _join(socketio, app, room):
+    client = socketio.test_client(app, auth=login(app, "alice"))
+    sid = socketio.server.manager.sid_from_eio_sid(client.eio_sid, "/")
+    socketio.server.enter_room(sid, room)
+    client.get_received()
+    return client
+
+
+def _names(client):
+    return [e["name"] for e in client.get_received()]
+
+
+def test_sender_gets_an_ack_and_other_devices_the_message(socket_app, monkeypatch):
+    app, socketio = socket_app
+    rows = {}
+
+    def create_message(data):
+        rows[data["id"]] = {
+            "message_id": data["id"],
+            "room_id": data["room"],
+            "username": data["username"],
+            "text": data["text"],
+            "created_at": datetime(2026, 1, 1, tzinfo=UTC),
+        }
+        return True
+
+    monkeypatch.setattr(db, "get_user", lambda username: {"username": username})
+    monkeypatch.setattr(db, "is_user_banned", lambda username: False)
+    monkeypatch.setattr(db, "can_user_post_in_room", lambda username, room: True)
+    monkeypatch.setattr(db, "create_message", create_message)
+    monkeypatch.setattr(db, "get_message_by_id", rows.get)
+    monkeypatch.setattr(db, "remember_recent_message", lambda row: None)
+    sender = _join(socketio, app, "general")
+    other_device = _join(socketio, app, "general")
+
+    ack = sender.emit(
+        "send_message",
+        {"room": "general", "username": "alice", "message": "hi", "ack": True},
+        callback=True,
+    )
+
+    assert set(ack) == {"id", "room", "timestamp", "seq", "epoch"}
+    assert ack["id"] in rows and ack["seq"] == 1
+    assert "receive_message" not in _names(sender)
+    assert "receive_message" in _names(other_device)
+    sender.disconnect()
+    other_device.disconnect()
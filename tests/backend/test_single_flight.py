@@ -0,0 +1,64 @@
+import threading
+import time
+
+import db
+from utils.single_flight import SingleFlight
+
+
+def _wait_until(check):
+    deadline = time.monotonic() + 5
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_concurrent_reads_share_one_load():
+    flight = SingleFlight()
+    release = threading.Event()
+    loads = []
+
+    def load():
+        loads.append("k")
+        release.wait(5)
+        return ["page"]
+
+    leader = threading.Thread(target=flight.do, args=("k", load))
+    leader.start()
+    _wait_until(lambda: loads)
+    results = []
+    follower = threading.Thread(
+        target=lambda: results.append(flight.do("k", lambda: ["other"]))
+    )
+    follower.start()
+    _wait_until(lambda: flight.shared)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert loads == ["k"]
+    assert results == [(["page"], True)]
+
+
+def test_read_after_a_write_does_not_join_an_older_flight(monkeypatch):
+    release = threading.Event()
+    loads = []
+
+    def get_messages(get_db_cursor, logger, Error, room_id, **kwargs):
+        loads.append(room_id)
+        if len(loads) == 1:
+            release.wait(5)
+        return [{"message_id": f"m{len(loads)}"}]
+
+    monkeypatch.setattr(db.messages_repo, "get_messages", get_messages)
+    monkeypatch.setattr(db.messages_repo, "toggle_reaction", lambda *args: True)
+    before = threading.Thread(target=db.get_messages, args=("r1",))
+    before.start()
+    _wait_until(lambda: loads)
+
+    db.toggle_reaction("m1", "bob", "👍")
+    after = db.get_messages("r1")
+    release.set()
+    before.join()
+
+    assert loads == ["r1", "r1"]
+    assert after == [{"message_id": "m2"}]
@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+
+import pytest
+from conftest import login
+
+import db
+from handlers.socket_messages import BATCH_MAX_OPS
+
+
+@pytest.fixture
+def commits(socket_app, monkeypatch):
+    calls = []
+
+    class _Connection:
+        def commit(self):
+            calls.append("commit")
+
+        def rollback(self):
+            calls.append("rollback")
+
+    @contextmanager
+    def fake_connection():
+        yield _Connection()
+
+    monkeypatch.setattr(db, "get_db_connection", fake_connection)
+    monkeypatch.setattr(db, "get_user", lambda username: {"username": username})
+    monkeypatch.setattr(db, "user_can_access_room", lambda username, room: room == "r1")
+    monkeypatch.setattr(
+        db, "get_message_by_id", lambda message_id: {"room_id": message_id[:2]}
+    )
+    monkeypatch.setattr(db, "toggle_reaction", lambda *args: True)
+    monkeypatch.setattr(
+        db, "get_message_reactions", lambda message_id: {"👍": ["alice"]}
+    )
+    return calls
+
+
+def _client(socket_app):
+    app, socketio = socket_app
+    return socketio.test_client(app, auth=login(app, "alice"))
+
+
+def _reaction(room):
+    return {
+        "op": "add_reaction",
+        "room": room,
+        "message_id": f"{room}-m1",
+        "emoji": "👍",
+    }
+
+
+def test_batch_applies_ops_in_one_transaction(socket_app, commits):
+    client = _client(socket_app)
+    ack = client.emit(
+        "batch",
+        {
+            "username": "alice",
+            "ops": [_reaction("r1"), _reaction("r2"), {"op": "nope"}],
+        },
+        callback=True,
+    )
+
+    assert ack == {
+        "results": [
+            {"op": "add_reaction", "ok": True},
+            {"op": "add_reaction", "ok": False, "error": "No access to this chat"},
+            {"op": "nope", "ok": False, "error": "Unknown operation"},
+        ]
+    }
+    assert commits == ["commit"]
+    client.disconnect()
+
+
+def test_oversized_batch_is_refused_before_any_write(socket_app, commits):
+    client = _client(socket_app)
+    ops = [_reaction("r1")] * (BATCH_MAX_OPS + 1)
+
+    ack = client.emit("batch", {"username": "alice", "ops": ops}, callback=True)
+
+    assert ack == {"error": "Too many operations"}
+    assert commits == []
+    client.disconnect()
@@ -0,0 +1,50 @@
+import threading
+import time
+
+from utils import socket_dispatcher
+from utils.socket_dispatcher import SocketEventDispatcher
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_limited_events_do_not_block_pool_threads(monkeypatch):
+    monkeypatch.setattr(socket_dispatcher, "SOCKET_EVENT_LIMITS", {"join": 1})
+    dispatcher = SocketEventDispatcher(workers=2)
+    release = threading.Event()
+    done = []
+
+    dispatcher.submit("a", "join", lambda: (release.wait(5), done.append("a-join")))
+    _wait(lambda: dispatcher.stats()["events"].get("join", {}).get("running") == 1)
+    # Второй join ждёт слота, но не занимает второй поток: ping другого sid проходит.
+    dispatcher.submit("b", "join", lambda: done.append("b-join"))
+    dispatcher.submit("b2", "ping", lambda: done.append("b2-ping"))
+    _wait(lambda: "b2-ping" in done)
+    assert dispatcher.stats()["parked_sids"] == 1
+
+    release.set()
+    _wait(lambda: len(done) == 3)
+    assert done.index("a-join") < done.index("b-join")
+    _wait(lambda: dispatcher.stats()["busy_sids"] == 0)
+    assert dispatcher.stats()["deferred"] == 1
+
+
+def test_parked_sid_keeps_its_event_order(monkeypatch):
+    monkeypatch.setattr(socket_dispatcher, "SOCKET_EVENT_LIMITS", {"join": 1})
+    dispatcher = SocketEventDispatcher(workers=2)
+    release = threading.Event()
+    done = []
+
+    dispatcher.submit("a", "join", lambda: release.wait(5))
+    _wait(lambda: dispatcher.stats()["events"].get("join", {}).get("running") == 1)
+    dispatcher.submit("b", "join", lambda: done.append("join"))
+    dispatcher.submit("b", "send_message", lambda: done.append("send"))
+    time.sleep(0.05)
+    assert done == []
+
+    release.set()
+    _wait(lambda: done == ["join", "send"])
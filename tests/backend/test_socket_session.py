@@ -0,0 +1,53 @@
+import pytest
+from conftest import login
+
+import db
+from utils.room_delivery import active_room
+
+
+def _session(client):
+    return next(e["args"][0] for e in client.get_received() if e["name"] == "session")
+
+
+def _tickets(app):
+    return app.extensions["nebula_socket_runtime"].session_tickets
+
+
+def _sid(socketio, client):
+    return socketio.server.manager.sid_from_eio_sid(client.eio_sid, "/")
+
+
+@pytest.mark.parametrize("allowed", [True, False])
+def test_resumed_ticket_rechecks_room_access(socket_app, monkeypatch, allowed):
+    app, socketio = socket_app
+    monkeypatch.setattr(db, "get_user", lambda username: {"username": username})
+    monkeypatch.setattr(db, "user_can_access_room", lambda username, room: allowed)
+    ticket = _tickets(app).issue("alice", "r1")
+
+    client = socketio.test_client(app, auth={**login(app, "alice"), "ticket": ticket})
+    session = _session(client)
+    assert session["resumed"] is True
+    # Доступ отозван: комната не подписана и в новый билет не попала.
+    expected = "r1" if allowed else None
+    assert active_room(_sid(socketio, client)) == expected
+    assert _tickets(app).take(session["ticket"])["room"] == expected
+    client.disconnect()
+
+
+def test_ticket_survives_refused_handshake(socket_app, monkeypatch):
+    app, socketio = socket_app
+    monkeypatch.setattr(db, "get_user", lambda username: {"username": username})
+    monkeypatch.setattr(db, "user_can_access_room", lambda username, room: True)
+    admission = app.extensions["nebula_admission"]
+    ticket = _tickets(app).issue("alice", "r1")
+
+    # Чужой билет не возобновляет сессию и не сгорает.
+    monkeypatch.setattr(admission, "admit_bootstrap", lambda: 2.0)
+    client = socketio.test_client(app, auth={**login(app, "bob"), "ticket": ticket})
+    assert not client.is_connected()
+    assert _tickets(app).peek(ticket) is not None
+
+    client = socketio.test_client(app, auth={**login(app, "alice"), "ticket": ticket})
+    assert _session(client)["resumed"] is True
+    assert _tickets(app).peek(ticket) is None
+    client.disconnect()
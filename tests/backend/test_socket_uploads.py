@@ -0,0 +1,54 @@
+import pytest
+from conftest import login
+
+import db
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 56
+
+
+@pytest.fixture
+def upload(socket_app, monkeypatch):
+    """Завершённая кусочная загрузка ``alice``; ``db`` без MySQL."""
+    app, _ = socket_app
+    monkeypatch.setattr(db, "get_user", lambda username: {"username": username})
+    monkeypatch.setattr(db, "register_media_object", lambda *args: True)
+    monkeypatch.setattr(db, "is_user_banned", lambda username: False)
+    monkeypatch.setattr(db, "can_user_post_in_room", lambda username, room: True)
+    uploads = app.extensions["nebula_uploads"]
+    upload_id = uploads.start("alice", "image", "a.png", "image/png", len(PNG))["upload_id"]
+    uploads.chunk("alice", upload_id, 0, PNG)
+    uploads.finish("alice", upload_id)
+    return uploads, upload_id
+
+
+def _send(socketio, app, upload_id):
+    client = socketio.test_client(app, auth=login(app, "alice"))
+    client.get_received()
+    client.emit(
+        "send_message",
+        {"room": "general", "username": "alice", "media": {"upload_id": upload_id}},
+    )
+    errors = [e["args"][0] for e in client.get_received() if e["name"] == "error"]
+    client.disconnect()
+    return errors
+
+
+def test_rejected_send_keeps_the_upload(socket_app, monkeypatch, upload):
+    app, socketio = socket_app
+    uploads, upload_id = upload
+    monkeypatch.setattr(db, "create_message", lambda data: False)
+
+    assert _send(socketio, app, upload_id) == [{"message": "Could not save message"}]
+    assert uploads.peek("alice", upload_id) is not None
+
+
+def test_saved_message_claims_the_upload(socket_app, monkeypatch, upload):
+    app, socketio = socket_app
+    uploads, upload_id = upload
+    saved = []
+    monkeypatch.setattr(db, "create_message", lambda data: saved.append(data) or True)
+    monkeypatch.setattr(db, "get_message_by_id", lambda message_id: None)
+
+    assert _send(socketio, app, upload_id) == []
+    assert saved[0]["media"]["data"].startswith("/media/")
+    assert uploads.peek("alice", upload_id) is None
@@ -0,0 +1,43 @@
+import threading
+from types import SimpleNamespace
+
+from engineio import packet as eio_packet
+from socketio import packet
+
+from app import _install_socket_write_lock
+
+
+def _fake_socketio(sent):
+    eio = SimpleNamespace(send_packet=lambda eio_sid, pkt: None)
+    srv = SimpleNamespace(
+        eio=eio,
+        _send_packet=lambda eio_sid, pkt: None,
+        _send_eio_packet=lambda eio_sid, eio_pkt: sent.append(eio_pkt.data),
+    )
+    return SimpleNamespace(server=srv)
+
+
+def _frames(data):
+    encoded = packet.Packet(packet.EVENT, data=data).encode()
+    if not isinstance(encoded, list):
+        encoded = [encoded]
+    return [eio_packet.Packet(eio_packet.MESSAGE, p) for p in encoded]
+
+
+def test_binary_packet_parts_are_not_interleaved():
+    sent = []
+    socketio = _fake_socketio(sent)
+    _install_socket_write_lock(socketio)
+    send = socketio.server._send_eio_packet
+    header, attachment = _frames(["file", b"\x00\x01"])
+    (text,) = _frames(["typing", {"room": "r1"}])
+
+    # Заголовок ушёл из одного потока, а другой пишет тому же получателю
+    # до того, как первый дошлёт вложение.
+    send("e1", header)
+    other = threading.Thread(target=send, args=("e1", text))
+    other.start()
+    other.join()
+    send("e1", attachment)
+
+    assert sent == [text.data, header.data, attachment.data]
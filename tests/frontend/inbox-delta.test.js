@@ -0,0 +1,52 @@
+import { test } from 'node:test'
+import assert from 'node:assert/strict'
+
+import { applyInboxDelta } from '../../static/js/inbox-delta.js'
+
+const rows = [
+  { room_id: 'a', last_at: '2026-01-02T10:00:00Z', last_message_id: 'a1', last_preview: 'hi' },
+  { room_id: 'b', last_at: '2026-01-01T10:00:00Z', last_message_id: 'b1', last_preview: 'yo' },
+]
+
+test('applyInboxDelta: новое сообщение поднимает чат и меняет превью', () => {
+  const out = applyInboxDelta(rows, {
+    room: 'b',
+    message_id: 'b2',
+    created_at: '2026-01-03T10:00:00Z',
+    preview: 'new',
+  })
+  assert.deepEqual(
+    out.map((r) => [r.room_id, r.last_preview, r.last_message_id]),
+    [
+      ['b', 'new', 'b2'],
+      ['a', 'hi', 'a1'],
+    ],
+  )
+})
+
+test('applyInboxDelta: черновик в превью не затирается', () => {
+  const withDraft = [{ ...rows[0], has_draft: true, last_preview: 'draft' }]
+  const out = applyInboxDelta(withDraft, {
+    room: 'a',
+    message_id: 'a2',
+    created_at: '2026-01-03T10:00:00Z',
+    preview: 'new',
+  })
+  assert.equal(out[0].last_preview, 'draft')
+  assert.equal(out[0].last_message_id, 'a2')
+})
+
+test('applyInboxDelta: правка последнего сообщения меняет превью, чужого — ничего', () => {
+  const edited = applyInboxDelta(rows, { room: 'a', message_id: 'a1', edited: true, preview: 'fix' })
+  assert.equal(edited[0].last_preview, 'fix')
+  assert.equal(applyInboxDelta(rows, { room: 'a', message_id: 'a0', edited: true, preview: 'x' }), rows)
+})
+
+test('applyInboxDelta: чего не знаем — полный запрос', () => {
+  assert.equal(applyInboxDelta(null, { room: 'a' }), null)
+  assert.equal(applyInboxDelta(rows, { room: 'zzz', message_id: 'z1', preview: '', created_at: 'x' }), null)
+  assert.equal(applyInboxDelta(rows, { room: 'a', message_id: 'a1', deleted: true }), null)
+  assert.equal(applyInboxDelta(rows, { room: 'a', message_id: 'a0', deleted: true }), rows)
+  /** Старый сервер без `preview`. */
+  assert.equal(applyInboxDelta(rows, { room: 'a', message_id: 'a2', created_at: '2026-01-03T10:00:00Z' }), null)
+})
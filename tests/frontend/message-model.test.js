@@ -2,6 +2,7 @@ import { test } from 'node:test'
 import assert from 'node:assert/strict'
 
 import {
+  expandMessageTable,
   normalizeMessage,
   normalizeScheduledMessage,
   privatePeer,
@@ -51,3 +52,18 @@ test('privatePeer: null для не приватных комнат', () => {
   assert.equal(privatePeer('group_123', 'alice'), null)
   assert.equal(privatePeer(null, 'alice'), null)
 })
+
+test('expandMessageTable: строки обратно в объекты, null — поля нет', () => {
+  const table = {
+    columns: ['message_id', 'username', 'media'],
+    rows: [
+      ['m1', 'kami', null],
+      ['m2', 'lena', { type: 'image' }],
+    ],
+  }
+  assert.deepEqual(expandMessageTable(table), [
+    { message_id: 'm1', username: 'kami' },
+    { message_id: 'm2', username: 'lena', media: { type: 'image' } },
+  ])
+  assert.deepEqual(expandMessageTable(null), [])
+})
@@ -0,0 +1,20 @@
+import { test } from 'node:test'
+import assert from 'node:assert/strict'
+
+import { applyPresenceChanges } from '../../static/js/presence-delta.js'
+
+test('applyPresenceChanges: статусы меняются на месте, без запроса списка', () => {
+  const online = { alice: true, bob: false }
+  const changed = applyPresenceChanges(online, [
+    { username: 'alice', status: 'offline', last_seen: '2026-01-01T10:00:00' },
+    { username: 'carol', status: 'online' },
+  ])
+  assert.equal(changed, true)
+  assert.deepEqual(online, { alice: false, bob: false, carol: true })
+})
+
+test('applyPresenceChanges: повтор известного статуса ничего не меняет', () => {
+  const online = { alice: true }
+  assert.equal(applyPresenceChanges(online, [{ username: 'alice', status: 'online' }]), false)
+  assert.equal(applyPresenceChanges(online, null), false)
+})
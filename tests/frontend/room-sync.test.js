@@ -0,0 +1,84 @@
+import { test } from 'node:test'
+import assert from 'node:assert/strict'
+
+import {
+  ROOM_PAGE_CACHE_MAX,
+  advanceCursor,
+  clearRoomPages,
+  cursorFromHistory,
+  rememberRoomPage,
+  resyncParams,
+  takeRoomPage,
+} from '../../static/js/room-sync.js'
+
+const cur = { room: 'r1', epoch: 'e1', seq: 5 }
+
+test('cursorFromHistory: без epoch/seq курсора нет', () => {
+  assert.equal(cursorFromHistory({ room: 'r1', messages: [] }), null)
+  assert.deepEqual(cursorFromHistory({ room: 'r1', epoch: 'e1', seq: 0 }), {
+    room: 'r1',
+    epoch: 'e1',
+    seq: 0,
+  })
+})
+
+test('advanceCursor: сдвигается только вперёд', () => {
+  assert.equal(advanceCursor(cur, 'r1', { room: 'r1', epoch: 'e1', seq: 6 }).seq, 6)
+  assert.equal(advanceCursor(cur, 'r1', { room: 'r1', epoch: 'e1', seq: 3 }), cur)
+})
+
+test('advanceCursor: через дырку не перескакивает, пока её не закроют', () => {
+  const ev = (seq) => ({ room: 'r1', epoch: 'e1', seq })
+  let c = advanceCursor(cur, 'r1', ev(8))
+  c = advanceCursor(c, 'r1', ev(7))
+  assert.equal(c.seq, 5)
+  assert.deepEqual(c.ahead, [7, 8])
+  assert.deepEqual(resyncParams(c, 'r1'), { epoch: 'e1', seq: 5 })
+
+  c = advanceCursor(c, 'r1', ev(6))
+  assert.deepEqual(c, { room: 'r1', epoch: 'e1', seq: 8 })
+})
+
+test('advanceCursor: события другой комнаты и без номера не трогают курсор', () => {
+  assert.equal(advanceCursor(cur, 'r1', { room: 'r2', epoch: 'e1', seq: 9 }), cur)
+  assert.equal(advanceCursor(cur, 'r1', { room: 'r1' }), cur)
+})
+
+test('advanceCursor: новая epoch — только с первого события, иначе сброс', () => {
+  assert.deepEqual(advanceCursor(cur, 'r1', { room: 'r1', epoch: 'e2', seq: 1 }), {
+    room: 'r1',
+    epoch: 'e2',
+    seq: 1,
+  })
+  assert.equal(advanceCursor(cur, 'r1', { room: 'r1', epoch: 'e2', seq: 4 }), null)
+})
+
+test('resyncParams: только для комнаты курсора', () => {
+  assert.deepEqual(resyncParams(cur, 'r1'), { epoch: 'e1', seq: 5 })
+  assert.equal(resyncParams(cur, 'r2'), null)
+  assert.equal(resyncParams(null, 'r1'), null)
+})
+
+test('rememberRoomPage: страницы без курсора не кэшируются', () => {
+  clearRoomPages()
+  rememberRoomPage('r1', { messages: [], hasMore: false, cursor: null })
+  assert.equal(takeRoomPage('r1'), null)
+})
+
+test('takeRoomPage: отдаёт страницу один раз', () => {
+  clearRoomPages()
+  const page = { messages: [{ message_id: 'm1' }], hasMore: true, cursor: cur }
+  rememberRoomPage('r1', page)
+  assert.equal(takeRoomPage('r1'), page)
+  assert.equal(takeRoomPage('r1'), null)
+})
+
+test('rememberRoomPage: вытесняет давно открытые чаты', () => {
+  clearRoomPages()
+  for (let i = 0; i <= ROOM_PAGE_CACHE_MAX; i++) {
+    const room = `r${i}`
+    rememberRoomPage(room, { messages: [], hasMore: false, cursor: { room, epoch: 'e', seq: i } })
+  }
+  assert.equal(takeRoomPage('r0'), null)
+  assert.equal(takeRoomPage(`r${ROOM_PAGE_CACHE_MAX}`).cursor.seq, ROOM_PAGE_CACHE_MAX)
+})
@@ -0,0 +1,52 @@
+import { test } from 'node:test'
+import assert from 'node:assert/strict'
+
+import { Decoder, Encoder, decodeMsgpack, encodeMsgpack } from '../../static/js/socket-msgpack.js'
+
+const hex = (bytes) => Buffer.from(bytes).toString('hex')
+
+test('encodeMsgpack: короткие формы как в спецификации', () => {
+  assert.equal(hex(encodeMsgpack({ a: 1 })), '81a16101')
+  assert.equal(hex(encodeMsgpack([null, true, false])), '93c0c3c2')
+  assert.equal(hex(encodeMsgpack(-1)), 'ff')
+  assert.equal(hex(encodeMsgpack(300)), 'cd012c')
+  assert.equal(hex(encodeMsgpack(1.5)), 'cb3ff8000000000000')
+})
+
+test('encodeMsgpack: поля undefined пропускаются, как в JSON', () => {
+  assert.deepEqual(decodeMsgpack(encodeMsgpack({ a: undefined, b: 2 })), { b: 2 })
+})
+
+test('decodeMsgpack: круговой проход чисел, строк и вложенности', () => {
+  const value = {
+    ints: [0, 127, 128, 65535, 65536, 2 ** 32, Date.now(), -33, -129, -40000, -(2 ** 31) - 1],
+    text: 'привет 👋'.repeat(20),
+    nested: { list: Array.from({ length: 20 }, (_, i) => ({ i })) },
+  }
+  assert.deepEqual(decodeMsgpack(encodeMsgpack(value)), value)
+})
+
+test('decodeMsgpack: бинарные данные приходят как ArrayBuffer', () => {
+  const out = decodeMsgpack(encodeMsgpack({ bin: new Uint8Array([1, 2, 3]) }))
+  assert.ok(out.bin instanceof ArrayBuffer)
+  assert.deepEqual([...new Uint8Array(out.bin)], [1, 2, 3])
+})
+
+test('Encoder/Decoder: пакет Socket.IO целиком в одном кадре', () => {
+  const packet = { type: 2, nsp: '/', data: ['receive_message', { id: 'm1' }], id: 7 }
+  const [frame] = new Encoder().encode(packet)
+  const decoder = new Decoder()
+  const seen = []
+  const onDecoded = (p) => seen.push(p)
+  decoder.on('decoded', onDecoded)
+  decoder.add(frame.buffer)
+  decoder.off('decoded', onDecoded)
+  decoder.add(frame)
+  assert.deepEqual(seen, [packet])
+})
+
+test('Decoder: текстовый кадр и пакет без nsp отклоняются', () => {
+  const decoder = new Decoder()
+  assert.throws(() => decoder.add('2["x"]'))
+  assert.throws(() => decoder.add(encodeMsgpack({ type: 2 })))
+})
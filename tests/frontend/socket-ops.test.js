@@ -0,0 +1,50 @@
+import { test } from 'node:test'
+import assert from 'node:assert/strict'
+
+/** Окружение браузера, которого `socket.js` касается: хранилище, `window`, `io()`. */
+const storage = new Map([['auth_username', 'alice']])
+globalThis.localStorage = {
+  getItem: (key) => storage.get(key) ?? null,
+  setItem: (key, value) => storage.set(key, String(value)),
+  removeItem: (key) => storage.delete(key),
+}
+globalThis.window = new EventTarget()
+
+class FakeSocket {
+  connected = true
+  handlers = {}
+  batches = []
+  on(event, fn) {
+    this.handlers[event] = fn
+  }
+  timeout() {
+    return this
+  }
+  emit(event, body) {
+    if (event === 'batch') this.batches.push(body.ops)
+  }
+}
+
+const fake = new FakeSocket()
+globalThis.io = () => fake
+
+const { BATCH_MAX_OPS, connectSocket, queueSocketOp } = await import('../../static/js/socket.js')
+
+test('операции, накопленные без связи, уходят пачками не больше BATCH_MAX_OPS', () => {
+  connectSocket()
+  fake.connected = false
+  const total = BATCH_MAX_OPS + 50
+  for (let i = 0; i < total; i++) {
+    assert.equal(queueSocketOp('add_reaction', { message_id: `m${i}`, emoji: '👍' }), true)
+  }
+  assert.equal(queueSocketOp('typing', { room: 'r1' }), false)
+  assert.deepEqual(fake.batches, [])
+
+  fake.connected = true
+  fake.handlers.connect()
+  assert.deepEqual(fake.batches.map((ops) => ops.length), [BATCH_MAX_OPS, 50])
+  assert.deepEqual(
+    fake.batches.flat().map((o) => o.message_id),
+    Array.from({ length: total }, (_, i) => `m${i}`),
+  )
+})